@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能能耗管理系统 - 告警规则引擎
+把 system_settings 中声明的阈值、设备类型覆盖和组合条件编译为谓词函数，
+单条读数直接调用谓词，批量数据按列生成向量化掩码
+"""
+
+import string
+from collections import namedtuple
+
+import numpy as np
+
+# 读数字段 -> 谓词参数名，顺序即谓词参数顺序
+METRICS = {
+    'power': 'p',
+    'voltage': 'v',
+    'current': 'c',
+    'power_factor': 'pf',
+    'temperature': 't',
+    'humidity': 'h'
+}
+METRIC_FIELDS = tuple(METRICS)
+# 告警消息模板可引用的读数字段
+MESSAGE_FIELDS = METRIC_FIELDS + ('device_id', 'timestamp')
+OPERATORS = {'>', '>=', '<', '<=', '==', '!='}
+
+DEFAULT_THRESHOLDS = {
+    'high_consumption': 1.2,
+    'low_efficiency': 0.8,
+    'cost_overrun': 1.1,
+    'voltage_range': [200, 240]
+}
+
+CompiledRule = namedtuple('CompiledRule', 'type severity predicate message threshold_value actual_index')
+
+
+class AlertRuleError(ValueError):
+    """规则定义无效"""
+
+
+class _TemplateValues(dict):
+    """模板缺少的字段原样保留占位符"""
+
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+
+def render_message(template, values):
+    """渲染告警消息模板，缺字段或格式说明无效时不抛异常"""
+    try:
+        return template.format_map(_TemplateValues(values))
+    except (ValueError, IndexError, AttributeError, TypeError):
+        return template
+
+
+def check_message_template(template):
+    """校验消息模板只引用 MESSAGE_FIELDS 中的字段"""
+    if not isinstance(template, str):
+        raise AlertRuleError(f"消息模板必须是字符串: {template!r}")
+    try:
+        fields = [field for _, field, _, _ in string.Formatter().parse(template) if field is not None]
+    except ValueError as e:
+        raise AlertRuleError(f"消息模板格式错误: {template} ({e})")
+    for field in fields:
+        name = field.split('.')[0].split('[')[0]
+        if name not in MESSAGE_FIELDS:
+            raise AlertRuleError(f"消息模板引用了未知字段 {{{field}}}，可用字段: {', '.join(MESSAGE_FIELDS)}")
+
+
+def _number(thresholds, name):
+    try:
+        return float(thresholds[name])
+    except (KeyError, TypeError, ValueError):
+        raise AlertRuleError(f"阈值 {name} 必须是数字: {thresholds.get(name)!r}")
+
+
+def _voltage_range(thresholds):
+    try:
+        low_voltage, high_voltage = (float(value) for value in thresholds['voltage_range'])
+    except (KeyError, TypeError, ValueError):
+        raise AlertRuleError(f"voltage_range 必须是 [下限, 上限] 两个数字: {thresholds.get('voltage_range')!r}")
+    if low_voltage >= high_voltage:
+        raise AlertRuleError(f"voltage_range 下限必须小于上限: {thresholds['voltage_range']!r}")
+    return low_voltage, high_voltage
+
+
+class AlertRuleEngine:
+    """告警规则引擎
+
+    规则来源：
+    - alert_thresholds：内置规则 high_consumption / voltage_abnormal / low_efficiency 的阈值，
+      cost_overrun 为预算告警倍数
+    - alert_threshold_overrides：按设备类型覆盖上述阈值，如 {"HVAC": {"high_consumption": 1.3}}
+    - alert_rules：自定义规则，条件用 all/any 组合，如
+      {"type": "hot_overload", "severity": "high", "device_types": ["HVAC"],
+       "message": "高温过载: {power}W", "all": [{"metric": "power_ratio", "op": ">", "value": 1.0},
+                                              {"metric": "temperature", "op": ">", "value": 30}]}
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.thresholds = dict(DEFAULT_THRESHOLDS)
+        self.thresholds.update(settings.get('alert_thresholds', {}))
+        self.overrides = settings.get('alert_threshold_overrides', {})
+        self.custom_rules = settings.get('alert_rules', [])
+        if not isinstance(self.overrides, dict) or not all(isinstance(value, dict) for value in self.overrides.values()):
+            raise AlertRuleError("alert_threshold_overrides 必须是 {设备类型: {阈值名: 值}}")
+        self.cost_overrun_ratio = _number(self.thresholds, 'cost_overrun')
+        self._definitions = {}
+        # 预先校验一遍，规则写错时在加载阶段就报错
+        for rule in self.custom_rules:
+            self._condition_source(rule, 1.0, vectorized=False)
+
+    # ---------- 规则定义 ----------
+
+    def definitions_for(self, device_type):
+        """返回某设备类型生效的规则定义（内置规则已套用类型覆盖阈值）"""
+        definitions = self._definitions.get(device_type)
+        if definitions is not None:
+            return definitions
+
+        thresholds = dict(self.thresholds)
+        thresholds.update(self.overrides.get(device_type, {}))
+        low_voltage, high_voltage = _voltage_range(thresholds)
+
+        definitions = [
+            {
+                'type': 'high_consumption', 'severity': 'medium',
+                'message': "功率消耗超出正常范围: {power}W",
+                'threshold_value': 'rated_power', 'actual_metric': 'power',
+                'all': [{'metric': 'power_ratio', 'op': '>', 'value': _number(thresholds, 'high_consumption')}]
+            },
+            {
+                'type': 'voltage_abnormal', 'severity': 'high',
+                'message': "电压异常: {voltage}V",
+                'threshold_value': (low_voltage + high_voltage) / 2, 'actual_metric': 'voltage',
+                'any': [{'metric': 'voltage', 'op': '<', 'value': low_voltage},
+                        {'metric': 'voltage', 'op': '>', 'value': high_voltage}]
+            },
+            {
+                'type': 'low_efficiency', 'severity': 'low',
+                'message': "功率因数偏低: {power_factor}",
+                'threshold_value': _number(thresholds, 'low_efficiency'), 'actual_metric': 'power_factor',
+                'all': [{'metric': 'power_factor', 'op': '<', 'value': _number(thresholds, 'low_efficiency')},
+                        {'metric': 'power', 'op': '>', 'value': 0}]
+            }
+        ]
+        for rule in self.custom_rules:
+            if not rule.get('device_types') or device_type in rule['device_types']:
+                definitions.append(rule)
+
+        self._definitions[device_type] = definitions
+        return definitions
+
+    def validate(self, device_types=()):
+        """编译每种设备类型生效的规则集（含类型覆盖），任何阈值、条件或消息模板无效时抛出 AlertRuleError
+
+        device_types 为现有设备的类型；覆盖和自定义规则中出现的类型以及无覆盖的缺省规则集总会检查。
+        """
+        types = {None, *device_types, *self.overrides}
+        for rule in self.custom_rules:
+            types.update(rule.get('device_types') or ())
+        for device_type in types:
+            for rule in self.definitions_for(device_type):
+                if not rule.get('type'):
+                    raise AlertRuleError(f"规则缺少 type: {rule}")
+                self._condition_source(rule, 1.0, vectorized=False)
+                self._condition_source(rule, 0.0, vectorized=True)
+                check_message_template(rule.get('message', ''))
+                actual_metric = rule.get('actual_metric') or self._first_metric(rule)
+                if actual_metric not in METRIC_FIELDS:
+                    raise AlertRuleError(f"规则 {rule['type']} 的 actual_metric 无效: {actual_metric}")
+
+    # ---------- 编译 ----------
+
+    def _condition_source(self, rule, rated_power, vectorized):
+        """把 all/any 条件生成为表达式源码"""
+        if 'all' in rule:
+            conditions, joiner = rule['all'], ' & ' if vectorized else ' and '
+        elif 'any' in rule:
+            conditions, joiner = rule['any'], ' | ' if vectorized else ' or '
+        else:
+            raise AlertRuleError(f"规则 {rule.get('type')} 缺少 all/any 条件")
+        if not conditions:
+            raise AlertRuleError(f"规则 {rule.get('type')} 条件为空")
+
+        parts = []
+        for condition in conditions:
+            metric, op = condition.get('metric'), condition.get('op')
+            if op not in OPERATORS:
+                raise AlertRuleError(f"不支持的比较运算符: {op}")
+            try:
+                value = float(condition['value'])
+            except (KeyError, TypeError, ValueError):
+                raise AlertRuleError(f"条件阈值无效: {condition}")
+
+            if metric == 'power_ratio':
+                # 相对额定功率的倍数在编译期折算为绝对功率
+                if vectorized:
+                    parts.append(f"((rated > 0) & (p {op} rated * {value!r}))")
+                elif rated_power > 0:
+                    parts.append(f"(p {op} {rated_power * value!r})")
+                else:
+                    parts.append("False")
+            elif metric in METRICS:
+                parts.append(f"({METRICS[metric]} {op} {value!r})")
+            else:
+                raise AlertRuleError(f"不支持的指标: {metric}")
+        return joiner.join(parts)
+
+    def compile_for_device(self, device):
+        """为单台设备编译规则，返回 CompiledRule 元组"""
+        rated_power = float(device.get('rated_power', 0) or 0)
+        compiled = []
+        for rule in self.definitions_for(device.get('type')):
+            source = self._condition_source(rule, rated_power, vectorized=False)
+            predicate = eval(f"lambda {', '.join(METRICS.values())}: {source}", {'__builtins__': {}})
+
+            threshold_value = rule.get('threshold_value')
+            if threshold_value == 'rated_power':
+                threshold_value = rated_power
+            actual_metric = rule.get('actual_metric') or self._first_metric(rule)
+
+            compiled.append(CompiledRule(
+                rule['type'], rule.get('severity', 'medium'), predicate,
+                rule.get('message', f"{rule['type']} 告警"), threshold_value,
+                METRIC_FIELDS.index(actual_metric)
+            ))
+        return tuple(compiled)
+
+    @staticmethod
+    def _first_metric(rule):
+        """自定义规则未指定 actual_metric 时取第一个条件的指标"""
+        metric = (rule.get('all') or rule.get('any'))[0]['metric']
+        return 'power' if metric == 'power_ratio' else metric
+
+    # ---------- 向量化批量评估 ----------
+
+    def evaluate_batch(self, columns, device_types, rated_powers):
+        """对一批读数按列评估所有规则
+
+        columns 为 {字段名: ndarray}，device_types / rated_powers 为与行对齐的数组。
+        返回 [(规则定义, 命中掩码)]，同一规则类型在不同设备类型下的掩码已合并。
+        """
+        # 按字符串键分组：设备类型可能缺失（None），不能直接交给 np.unique 排序
+        type_keys = np.array([str(device_type) for device_type in device_types], dtype=object)
+        originals = {str(device_type): device_type for device_type in device_types}
+        namespace = {METRICS[field]: np.asarray(columns[field], dtype=float) for field in METRIC_FIELDS}
+        namespace['rated'] = np.asarray(rated_powers, dtype=float)
+        row_count = len(type_keys)
+
+        results = {}
+        for type_key, device_type in originals.items():
+            type_mask = type_keys == type_key
+            for rule in self.definitions_for(device_type):
+                source = self._condition_source(rule, 0.0, vectorized=True)
+                hits = eval(source, {'__builtins__': {}}, namespace)
+                hits = np.broadcast_to(hits, (row_count,)) & type_mask
+                if rule['type'] in results:
+                    results[rule['type']][1][:] |= hits
+                else:
+                    results[rule['type']] = (rule, hits.copy())
+        return list(results.values())
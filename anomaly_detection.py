@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能能耗管理系统 - 统计异常检测
+每台设备保存O(1)状态：功率的EWMA均值/方差，以及按"一周中的小时"(168个时段)划分的基线画像。
+读数到来时先按基线打分再更新状态，既可逐条在线检测，也可批量扫描历史数据。
+"""
+
+import math
+
+HOURS_PER_WEEK = 168
+
+
+def hour_of_week(epoch_seconds):
+    """秒数 -> 一周中的小时 (周一0点为0)；1970-01-01 是周四"""
+    hours = epoch_seconds // 3600
+    return ((hours // 24 + 3) % 7) * 24 + hours % 24
+
+
+class DeviceBaseline:
+    """单台设备的检测状态"""
+
+    __slots__ = ('count', 'mean', 'var', 'profile_count', 'profile_mean', 'profile_var')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.profile_count = [0] * HOURS_PER_WEEK
+        self.profile_mean = [0.0] * HOURS_PER_WEEK
+        self.profile_var = [0.0] * HOURS_PER_WEEK
+
+    def to_dict(self):
+        """序列化为可写入JSON的字典（列表为副本，可在锁外编码）"""
+        return {'count': self.count, 'mean': self.mean, 'var': self.var,
+                'profile_count': list(self.profile_count), 'profile_mean': list(self.profile_mean),
+                'profile_var': list(self.profile_var)}
+
+    @classmethod
+    def from_dict(cls, data):
+        """从字典恢复"""
+        state = cls()
+        state.count = data['count']
+        state.mean = data['mean']
+        state.var = data['var']
+        state.profile_count = data['profile_count']
+        state.profile_mean = data['profile_mean']
+        state.profile_var = data['profile_var']
+        return state
+
+
+class AnomalyDetector:
+    """EWMA + 周内小时基线的在线异常检测器
+
+    打分优先使用当前时段的季节基线（该时段样本数达到 profile_warmup 后），
+    否则退回整体EWMA基线（样本数达到 warmup 后），两者都未就绪时得分为0。
+    """
+
+    def __init__(self, alpha=0.05, profile_alpha=0.2, z_threshold=4.0, warmup=30, profile_warmup=3):
+        self.alpha = alpha
+        self.profile_alpha = profile_alpha
+        self.z_threshold = z_threshold
+        self.warmup = warmup
+        self.profile_warmup = profile_warmup
+        self.states = {}
+
+    def score(self, device_id, epoch_seconds, power):
+        """对一条读数打分并更新状态，返回 (z分数, 期望功率)"""
+        state = self.states.get(device_id)
+        if state is None:
+            state = DeviceBaseline()
+            self.states[device_id] = state
+
+        slot = hour_of_week(epoch_seconds)
+        z_score, expected = 0.0, power
+        if state.profile_count[slot] >= self.profile_warmup:
+            expected = state.profile_mean[slot]
+            z_score = (power - expected) / self._std(state.profile_var[slot], expected)
+        elif state.count >= self.warmup:
+            expected = state.mean
+            z_score = (power - expected) / self._std(state.var, expected)
+
+        self._update(state, slot, power)
+        return z_score, expected
+
+    def score_batch(self, device_ids, epochs, powers):
+        """批量打分（按输入顺序逐条更新状态），返回z分数列表
+
+        与 score 逻辑相同，只是把属性和方法查找提到循环外，用于回填和历史扫描。
+        """
+        states = self.states
+        alpha, profile_alpha = self.alpha, self.profile_alpha
+        warmup, profile_warmup = self.warmup, self.profile_warmup
+        sqrt = math.sqrt
+        scores = []
+        append = scores.append
+
+        for device_id, epoch, power in zip(device_ids, epochs, powers):
+            state = states.get(device_id)
+            if state is None:
+                state = states[device_id] = DeviceBaseline()
+
+            hours = epoch // 3600
+            slot = ((hours // 24 + 3) % 7) * 24 + hours % 24
+            profile_count = state.profile_count
+            profile_mean = state.profile_mean
+            profile_var = state.profile_var
+
+            if profile_count[slot] >= profile_warmup:
+                expected = profile_mean[slot]
+                append((power - expected) / max(sqrt(profile_var[slot]), 0.05 * abs(expected), 1.0))
+            elif state.count >= warmup:
+                expected = state.mean
+                append((power - expected) / max(sqrt(state.var), 0.05 * abs(expected), 1.0))
+            else:
+                append(0.0)
+
+            # 整体EWMA
+            if state.count:
+                diff = power - state.mean
+                increment = alpha * diff
+                state.mean += increment
+                state.var = (1 - alpha) * (state.var + diff * increment)
+            else:
+                state.mean = power
+            state.count += 1
+
+            # 时段基线
+            if profile_count[slot]:
+                diff = power - profile_mean[slot]
+                increment = profile_alpha * diff
+                profile_mean[slot] += increment
+                profile_var[slot] = (1 - profile_alpha) * (profile_var[slot] + diff * increment)
+            else:
+                profile_mean[slot] = power
+            profile_count[slot] += 1
+
+        return scores
+
+    @staticmethod
+    def _std(variance, expected):
+        """标准差下限，避免恒定负载的方差趋零后任何波动都被判为异常"""
+        return max(math.sqrt(variance), 0.05 * abs(expected), 1.0)
+
+    def _update(self, state, slot, power):
+        """用读数更新整体EWMA和对应时段基线"""
+        if state.count:
+            diff = power - state.mean
+            increment = self.alpha * diff
+            state.mean += increment
+            state.var = (1 - self.alpha) * (state.var + diff * increment)
+        else:
+            state.mean = power
+        state.count += 1
+
+        if state.profile_count[slot]:
+            diff = power - state.profile_mean[slot]
+            increment = self.profile_alpha * diff
+            state.profile_mean[slot] += increment
+            state.profile_var[slot] = (1 - self.profile_alpha) * (state.profile_var[slot] + diff * increment)
+        else:
+            state.profile_mean[slot] = power
+        state.profile_count[slot] += 1
+
+    def to_dict(self):
+        """序列化所有设备状态"""
+        return {device_id: state.to_dict() for device_id, state in self.states.items()}
+
+    def load_states(self, data):
+        """恢复设备状态"""
+        self.states = {device_id: DeviceBaseline.from_dict(state) for device_id, state in data.items()}
@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能能耗管理系统 - 性能基准
+用 load_generator 生成不同规模的数据集，测量写入、查询、分析、成本和报表各操作的耗时、吞吐、
+每项操作期间的峰值常驻内存及其相对操作前的增量、Python 内存分配。每个规模在独立子进程中运行；
+会改变数据量的操作（单条写入）排在最后，会追加记录的报表和成本操作每次计时前恢复数据集，
+其他操作都在同一规模的数据上测量。结果写入 JSON，便于在不同提交之间比较。
+
+回归门禁模式把当前结果与仓库中的基线文件比较：每项操作取多次独立运行的中位数和 MAD（中位数绝对偏差），
+中位数变慢超过阈值百分比、且差值超过 MAD 给出的噪声范围时判定为性能回退。基线和门禁中的耗时都以
+同一子进程中固定校准负载的耗时为单位（相对倍数），基线文件因此可以在不同机器之间共用。
+
+用法示例:
+    python benchmark.py --sizes 1000,10000,100000 --repeat 3 --output benchmark_results.json
+    python benchmark.py --gate                  # 与 benchmark_baseline.json 比较，回退时退出码为1
+    python benchmark.py --update-baseline       # 在当前机器上重新生成基线
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，峰值内存记为 None
+    resource = None
+
+from load_generator import generate_devices, generate_dataset, EngineWriter
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+INTERVAL = 900
+READINGS_PER_DAY = 86400 // INTERVAL
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+# MAD 换算为正态分布标准差的系数
+MAD_SCALE = 1.4826
+
+
+def dataset_shape(size):
+    """读数规模 -> (设备数, 天数)：每台设备至少约30天数据，设备数不超过200"""
+    devices = max(1, min(200, size // (30 * READINGS_PER_DAY)))
+    return devices, size / (devices * READINGS_PER_DAY)
+
+
+def _proc_status_mb(field):
+    """读取 /proc/self/status 中的内存项（MB），非 Linux 时返回 None"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb():
+    """峰值常驻内存（MB）：Linux 上为自上次 reset_peak_rss 以来的峰值，其他平台为进程迄今的峰值"""
+    peak = _proc_status_mb('VmHWM')
+    if peak is not None:
+        return round(peak, 1)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 计，macOS 以字节计
+    return round(peak / (1024 * 1024 if platform.system() == 'Darwin' else 1024), 1)
+
+
+def reset_peak_rss():
+    """把峰值常驻内存重置为当前值（Linux 4.0+），返回操作前的常驻内存（MB）供计算增量
+
+    不支持重置时返回进程迄今的峰值，此时增量为操作把峰值推高了多少（下限估计）。
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _proc_status_mb('VmRSS')
+    except OSError:
+        return peak_rss_mb()
+
+
+def rss_metrics(rss_before):
+    """操作期间的峰值常驻内存和相对操作前的增量（MB）"""
+    peak = peak_rss_mb()
+    if peak is None or rss_before is None:
+        return {'peak_rss_mb': peak, 'rss_delta_mb': None}
+    return {'peak_rss_mb': peak, 'rss_delta_mb': round(max(peak - rss_before, 0.0), 1)}
+
+
+def median_and_mad(samples):
+    """样本中位数与中位数绝对偏差"""
+    median = statistics.median(samples)
+    return median, statistics.median(abs(sample - median) for sample in samples)
+
+
+def calibration_seconds(rounds=9):
+    """固定的纯Python校准负载（构造字典、排序、累加、JSON编解码）的最短耗时，作为门禁耗时的换算单位
+
+    取最短而不是中位数：校准只需反映机器本身的快慢，最短耗时受其他进程干扰最小。
+    """
+    def workload():
+        rows = [{'id': f"R{i:06d}", 'device_id': f"DEV{i % 50:03d}", 'power': (i * 37) % 5000 / 3}
+                for i in range(5000)]
+        rows.sort(key=lambda row: (row['device_id'], row['power']))
+        totals = {}
+        for row in rows:
+            totals[row['device_id']] = totals.get(row['device_id'], 0.0) + row['power']
+        json.loads(json.dumps(rows))
+
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        workload()
+        samples.append(time.perf_counter() - started)
+    return min(samples)
+
+
+def collection_reset(ems, names):
+    """返回把 names 中的集合截回当前长度的回调，供会追加记录的操作在每次计时前恢复数据集"""
+    lengths = {name: len(ems.data[name]) for name in names}
+
+    def reset():
+        for name, length in lengths.items():
+            del ems.data[name][length:]
+    return reset
+
+
+def measure(operation, items, repeat, track_allocations, budget_seconds=None, reset=None):
+    """计时 repeat 次，再在 tracemalloc 下单独执行一次统计分配，返回测量结果
+
+    单次耗时超过 budget_seconds 时不再重复，也不做分配统计（大规模下避免一项操作拖住整套基准）。
+    reset 为每次执行前（不计时）恢复数据集的回调。
+    """
+    samples = []
+    rss_before = reset_peak_rss()
+    for _ in range(repeat):
+        if reset:
+            reset()
+        started = time.perf_counter()
+        operation()
+        samples.append(time.perf_counter() - started)
+        if budget_seconds and samples[-1] > budget_seconds:
+            track_allocations = False
+            break
+
+    median, mad = median_and_mad(samples)
+    result = {
+        'items': items,
+        'samples': [round(sample, 6) for sample in samples],
+        'wall_seconds': round(median, 6),
+        'mad_seconds': round(mad, 6),
+        'throughput_per_sec': round(items / statistics.median(samples), 1) if items and min(samples) > 0 else None,
+        **rss_metrics(rss_before),
+        'alloc_peak_mb': None,
+        'alloc_blocks': None,
+        'truncated': len(samples) < repeat
+    }
+    if track_allocations:
+        if reset:
+            reset()
+        tracemalloc.start()
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        result['alloc_peak_mb'] = round(peak / 1024 / 1024, 3)
+        result['alloc_blocks'] = sum(stat.count for stat in snapshot.statistics('filename'))
+    return result
+
+
+def run_size(size, repeat=3, track_allocations=True, seed=0, operations=None, budget_seconds=30):
+    """在当前进程中对一个规模跑完整套操作（供子进程调用），返回 {操作名: 测量结果}
+
+    operations 为要测量的操作名列表，None 表示全部（批量写入总会执行，用于准备数据）。
+    """
+    from energy_management_system import EnergyManagementSystem
+
+    workdir = tempfile.mkdtemp()
+    quiet = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(quiet):
+            devices_count, days = dataset_shape(size)
+            devices = generate_devices(devices_count, seed)
+            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            start = today - timedelta(days=int(days) + 1)
+            data_file = os.path.join(workdir, "energy_data.json")
+
+            calibration = calibration_seconds()
+            results = {}
+            rss_before = reset_peak_rss()
+            started = time.perf_counter()
+            writer = EngineWriter(data_file, devices)
+            summary = generate_dataset(writer, devices, start, days, INTERVAL, seed)
+            elapsed = time.perf_counter() - started
+            results['batch_ingest'] = {
+                'items': summary['rows'],
+                'samples': [round(elapsed, 6)],
+                'wall_seconds': round(elapsed, 6),
+                'mad_seconds': 0.0,
+                'throughput_per_sec': round(summary['rows'] / elapsed, 1),
+                **rss_metrics(rss_before),
+                'alloc_peak_mb': None,
+                'alloc_blocks': None,
+                'truncated': False
+            }
+            ems = writer.ems
+            device_id = writer.id_map[devices[0]['id']]
+            last_day = ems.data['energy_readings'][-1]['timestamp'][:10]
+            year, month = int(last_day[:4]), int(last_day[5:7])
+            readings = len(ems.data['energy_readings'])
+
+            # 成本和报表操作会追加记录并保存，每次计时前截回原有记录，保存的数据量保持不变
+            restore = collection_reset(ems, ('cost_analysis', 'reports'))
+            # 单条写入每次都会增加读数，放在最后，前面的操作都在 readings 条数据上测量
+            suite = [
+                ('save_data', readings, ems.save_data, None),
+                ('load_data', readings, ems.load_data, None),
+                ('get_device_readings', None, lambda: ems.get_device_readings(device_id, 24), None),
+                ('analyze_energy_consumption', None, lambda: ems.analyze_energy_consumption(device_id, 7), None),
+                ('analyze_peak_valley_consumption', None,
+                 lambda: ems.analyze_peak_valley_consumption(device_id, 7), None),
+                ('calculate_monthly_cost', None, lambda: ems.calculate_monthly_cost(device_id, year, month), restore),
+                ('generate_daily_report', None, lambda: ems.generate_daily_report(last_day), restore),
+                ('generate_monthly_report', None, lambda: ems.generate_monthly_report(year, month), restore),
+                ('record_energy_reading', 1,
+                 lambda: ems.record_energy_reading(device_id, 220, 5, 1100, 25, 60), None)
+            ]
+            for name, items, operation, reset in suite:
+                if operations is None or name in operations:
+                    results[name] = measure(operation, items, repeat, track_allocations, budget_seconds, reset)
+            # 单条写入登记的延迟保存在删除临时目录之前完成
+            ems.flush_pending_save()
+            # 校准在测量前后各跑一次取较小值
+            calibration = min(calibration, calibration_seconds())
+        return {'size': size, 'readings': readings, 'devices': devices_count, 'days': round(days, 2),
+                'calibration_seconds': round(calibration, 6), 'operations': results}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def environment():
+    """记录运行环境，便于比较不同机器或提交的结果"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def run_suite(sizes=DEFAULT_SIZES, repeat=3, track_allocations=True, operations=None, budget_seconds=30,
+              progress=None):
+    """按规模依次在独立子进程中运行基准，返回完整结果"""
+    runs = []
+    for size in sizes:
+        if progress:
+            progress(size)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            runs.append(executor.submit(run_size, size, repeat, track_allocations, 0, operations,
+                                        budget_seconds).result())
+    return {'environment': environment(), 'repeat': repeat, 'runs': runs}
+
+
+# ==================== 回归门禁 ====================
+
+def collect_samples(size, runs, operations=None, progress=None):
+    """在 runs 个独立子进程中各跑一遍（每项操作计时一次），返回 {操作名: 样本列表}
+
+    样本为耗时除以同一子进程中校准负载的耗时（相对倍数），与机器快慢无关。
+    """
+    samples = {}
+    for index in range(runs):
+        if progress:
+            progress(index + 1, runs)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            run = executor.submit(run_size, size, 1, False, 0, operations, None).result()
+        for name, metrics in run['operations'].items():
+            samples.setdefault(name, []).extend(
+                round(sample / run['calibration_seconds'], 6) for sample in metrics['samples'])
+    return samples
+
+
+def summarize_samples(samples):
+    """{操作名: 样本} -> {操作名: {'median', 'mad', 'samples'}}"""
+    summary = {}
+    for name, values in samples.items():
+        median, mad = median_and_mad(values)
+        summary[name] = {'median': round(median, 6), 'mad': round(mad, 6), 'samples': values}
+    return summary
+
+
+def build_baseline(size=1000, runs=5, threshold_percent=25.0, mad_factor=3.0, thresholds=None, progress=None):
+    """测量并生成基线（操作耗时以校准负载为单位）"""
+    return {
+        'environment': environment(),
+        'units': 'calibration',
+        'size': size,
+        'runs': runs,
+        'threshold_percent': threshold_percent,
+        'mad_factor': mad_factor,
+        'thresholds': thresholds or {},
+        'operations': summarize_samples(collect_samples(size, runs, progress=progress))
+    }
+
+
+def compare_with_baseline(current, baseline, threshold_percent=None, mad_factor=None):
+    """逐项比较当前统计与基线，返回比较结果列表
+
+    判定为回退需同时满足：中位数变慢超过阈值百分比（可在基线 thresholds 中按操作覆盖），
+    且变慢量超过 mad_factor 倍的噪声尺度（两边 MAD 中较大者换算为标准差）。
+    """
+    default_threshold = threshold_percent if threshold_percent is not None else baseline.get('threshold_percent', 25.0)
+    mad_factor = mad_factor if mad_factor is not None else baseline.get('mad_factor', 3.0)
+    comparisons = []
+    for name in sorted(set(baseline['operations']) | set(current)):
+        reference = baseline['operations'].get(name)
+        measured = current.get(name)
+        if reference is None or measured is None:
+            comparisons.append({'operation': name, 'status': 'new' if reference is None else 'missing',
+                                'baseline': reference and reference['median'],
+                                'current': measured and measured['median']})
+            continue
+
+        threshold = baseline.get('thresholds', {}).get(name, default_threshold)
+        change = measured['median'] - reference['median']
+        change_percent = change / reference['median'] * 100 if reference['median'] > 0 else 0.0
+        noise = mad_factor * MAD_SCALE * max(reference['mad'], measured['mad'])
+        if change_percent > threshold and change > noise:
+            status = 'regressed'
+        elif change_percent < -threshold and -change > noise:
+            status = 'improved'
+        else:
+            status = 'ok'
+        comparisons.append({
+            'operation': name,
+            'status': status,
+            'baseline': reference['median'],
+            'current': measured['median'],
+            'change_percent': round(change_percent, 1),
+            'threshold_percent': threshold,
+            'noise_seconds': round(noise, 6)
+        })
+    return comparisons
+
+
+def run_gate(baseline_file=BASELINE_FILE, runs=None, threshold_percent=None, progress=None):
+    """按基线的规模和操作重新测量并比较，返回 (是否通过, 比较结果)"""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('units') != 'calibration':
+        raise ValueError("基线为旧格式（绝对耗时，只适用于生成它的机器），请用 --update-baseline 重新生成")
+    samples = collect_samples(baseline['size'], runs or baseline.get('runs', 5), list(baseline['operations']),
+                              progress)
+    comparisons = compare_with_baseline(summarize_samples(samples), baseline, threshold_percent)
+    passed = not any(item['status'] in ('regressed', 'missing') for item in comparisons)
+    return passed, comparisons
+
+
+def format_comparison(comparisons):
+    """把门禁比较结果格式化为表格"""
+    labels = {'ok': "正常", 'regressed': "回退", 'improved': "改善", 'new': "新增", 'missing': "缺失"}
+    lines = [f"{'操作':<32} {'基线(倍)':>10} {'当前(倍)':>10} {'变化':>8} {'阈值':>6}  结果", "-" * 80]
+    for item in comparisons:
+        baseline = f"{item['baseline']:.4f}" if item['baseline'] is not None else "-"
+        current = f"{item['current']:.4f}" if item['current'] is not None else "-"
+        change = f"{item['change_percent']:+.1f}%" if 'change_percent' in item else "-"
+        threshold = f"{item['threshold_percent']:.0f}%" if 'threshold_percent' in item else "-"
+        lines.append(f"{item['operation']:<32} {baseline:>10} {current:>10} {change:>8} {threshold:>6}  "
+                     f"{labels[item['status']]}")
+    return "\n".join(lines)
+
+
+def format_results(results):
+    """把结果格式化为表格"""
+    lines = [f"{'规模':>9} {'操作':<32} {'耗时(ms)':>11} {'吞吐(/s)':>12} {'峰值RSS(MB)':>12} {'RSS增量(MB)':>12} "
+             f"{'分配峰值(MB)':>13}", "-" * 109]
+    for run in results['runs']:
+        for name, metrics in run['operations'].items():
+            throughput = f"{metrics['throughput_per_sec']:.0f}" if metrics['throughput_per_sec'] else "-"
+            rss = f"{metrics['peak_rss_mb']:.1f}" if metrics['peak_rss_mb'] is not None else "-"
+            delta = f"{metrics['rss_delta_mb']:.1f}" if metrics.get('rss_delta_mb') is not None else "-"
+            alloc = f"{metrics['alloc_peak_mb']:.3f}" if metrics['alloc_peak_mb'] is not None else "-"
+            lines.append(f"{run['readings']:>9} {name:<32} {metrics['wall_seconds'] * 1000:>11.2f} "
+                         f"{throughput:>12} {rss:>12} {delta:>12} {alloc:>13}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="智能能耗管理系统 - 性能基准")
+    parser.add_argument('--sizes', default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="逗号分隔的读数规模，如 1000,10000,100000,1000000,10000000")
+    parser.add_argument('--repeat', type=int, default=3, help="每个操作的计时次数")
+    parser.add_argument('--no-alloc', action='store_true', help="不统计内存分配（tracemalloc 较慢）")
+    parser.add_argument('--operations', default=None, help="逗号分隔的操作名，默认全部")
+    parser.add_argument('--budget', type=float, default=30, help="单次耗时超过该秒数的操作不再重复")
+    parser.add_argument('--output', default="benchmark_results.json")
+    parser.add_argument('--gate', action='store_true', help="与基线比较，有回退时退出码为1")
+    parser.add_argument('--update-baseline', action='store_true', help="重新测量并写入基线文件")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="基线文件路径")
+    parser.add_argument('--runs', type=int, default=None, help="门禁/基线的独立运行次数（默认5）")
+    parser.add_argument('--threshold', type=float, default=None, help="回退判定阈值（百分比）")
+    args = parser.parse_args()
+
+    def show_progress(done, total):
+        print(f"第 {done}/{total} 次运行 ...", flush=True)
+
+    if args.update_baseline:
+        baseline = build_baseline(runs=args.runs or 5, threshold_percent=args.threshold or 25.0,
+                                  progress=show_progress)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f"基线已写入 {args.baseline}")
+        return 0
+    if args.gate:
+        passed, comparisons = run_gate(args.baseline, args.runs, args.threshold, show_progress)
+        print(format_comparison(comparisons))
+        print("\n✓ 未发现性能回退" if passed else "\n✗ 存在性能回退")
+        return 0 if passed else 1
+
+    sizes = [int(float(size)) for size in args.sizes.split(',')]
+    operations = args.operations.split(',') if args.operations else None
+    results = run_suite(sizes, args.repeat, not args.no_alloc, operations, args.budget,
+                        progress=lambda size: print(f"运行规模 {size} ...", flush=True))
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(format_results(results))
+    print(f"\n结果已写入 {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
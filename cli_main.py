@@ -7,8 +7,15 @@
 
 import os
 import sys
+import asyncio
 from datetime import datetime
 from energy_management_system import EnergyManagementSystem
+from backtesting import format_comparison_table
+from ingestion_server import IngestionServer
+from polling_collector import PollingCollector
+from instrumentation import format_hot_spots
+from metrics_exporter import MetricsExporter
+from log_config import configure_from_settings
 
 
 class EnergyManagementCLI:
@@ -16,6 +23,8 @@ class EnergyManagementCLI:
     
     def __init__(self):
         self.ems = EnergyManagementSystem()
+        configure_from_settings(self.ems.data['system_settings'])
+        self.metrics_exporter = None
         self.running = True
     
     def show_banner(self):
@@ -71,6 +80,7 @@ class EnergyManagementCLI:
             print("2. 注册新设备")
             print("3. 设备详情")
             print("4. 设备维护")
+            print("5. 虚拟电表")
             print("0. 返回主菜单")
             print("-" * 30)
             
@@ -84,6 +94,8 @@ class EnergyManagementCLI:
                 self.show_device_details()
             elif choice == '4':
                 self.schedule_maintenance()
+            elif choice == '5':
+                self.manage_virtual_meters()
             elif choice == '0':
                 break
             else:
@@ -215,6 +227,43 @@ class EnergyManagementCLI:
         except Exception as e:
             print(f"\n✗ 安排维护失败: {e}")
     
+    def manage_virtual_meters(self):
+        """虚拟电表管理"""
+        meters = self.ems.get_all_virtual_meters()
+        print(f"\n虚拟电表列表 (共{len(meters)}个):")
+        print("-" * 60)
+        for meter in meters:
+            formula = " ".join(f"{'+' if c['sign'] > 0 else '-'} {c['device_id']}" for c in meter['components'])
+            print(f"{meter['id']:<8} {meter['name']:<15} = {formula}")
+        print("-" * 60)
+        
+        if input("是否创建新的虚拟电表? (y/N): ").strip().lower() != 'y':
+            return
+        
+        try:
+            name = input("虚拟电表名称: ").strip()
+            if not name:
+                print("名称不能为空")
+                return
+            
+            formula = input("组成公式 (如 DEV001 -DEV002 -DEV003): ").strip()
+            components = []
+            for term in formula.split():
+                if term.startswith('-'):
+                    components.append((term[1:], -1))
+                else:
+                    components.append((term.lstrip('+'), 1))
+            
+            meter_id, msg = self.ems.create_virtual_meter(name, components)
+            
+            if meter_id:
+                print(f"\n✓ {msg}")
+            else:
+                print(f"\n✗ {msg}")
+                
+        except KeyboardInterrupt:
+            print("\n操作已取消")
+    
     def energy_monitoring_menu(self):
         """用电监控菜单"""
         while True:
@@ -224,6 +273,9 @@ class EnergyManagementCLI:
             print("1. 记录用电数据")
             print("2. 查看用电历史")
             print("3. 查看告警信息")
+            print("4. 历史告警回填")
+            print("5. 实时数据接入服务")
+            print("6. 轮询采集")
             print("0. 返回主菜单")
             print("-" * 30)
             
@@ -235,6 +287,12 @@ class EnergyManagementCLI:
                 self.view_energy_history()
             elif choice == '3':
                 self.view_alerts()
+            elif choice == '4':
+                self.backfill_alerts()
+            elif choice == '5':
+                self.run_ingestion_server()
+            elif choice == '6':
+                self.run_polling_collector()
             elif choice == '0':
                 break
             else:
@@ -324,17 +382,92 @@ class EnergyManagementCLI:
         
         print(f"\n告警信息 (共{len(alerts)}条):")
         print("-" * 80)
-        print(f"{'ID':<10} {'设备ID':<10} {'类型':<15} {'严重程度':<8} {'时间':<20}")
+        print(f"{'ID':<10} {'设备ID':<10} {'类型':<15} {'严重程度':<8} {'状态':<9} {'次数':<6} {'最近时间':<20}")
         print("-" * 80)
         
         for alert in alerts[-10:]:  # 显示最近10条
             print(f"{alert['id']:<10} {alert['device_id']:<10} {alert['type']:<15} "
-                  f"{alert['severity']:<8} {alert['timestamp']:<20}")
+                  f"{alert['severity']:<8} {alert['status']:<9} {alert.get('count', 1):<6} "
+                  f"{alert.get('last_seen', alert['timestamp']):<20}")
         
         if len(alerts) > 10:
             print(f"... (共{len(alerts)}条记录，仅显示最近10条)")
         print("-" * 80)
     
+    def backfill_alerts(self):
+        """按当前告警规则重新扫描历史读数"""
+        print("\n分区方式: 1. 按设备  2. 按月")
+        by = 'month' if input("请选择 [1]: ").strip() == '2' else 'device'
+        workers = input("并行进程数 [自动]: ").strip()
+        
+        def show_progress(done, total, key):
+            print(f"\r回填进度: {done}/{total}", end="", flush=True)
+        
+        try:
+            summary, message = self.ems.backfill_alerts(by=by, workers=int(workers) if workers else None,
+                                                        progress=show_progress)
+            print()
+            print(message)
+            if summary:
+                print(f"告警事件: {summary['episodes']}个")
+        except ValueError:
+            print("进程数格式错误")
+        except KeyboardInterrupt:
+            print("\n回填已中断，重新执行将从断点继续")
+    
+    def run_ingestion_server(self):
+        """在后台运行实时接入服务，按回车刷新计数，输入 q 停止"""
+        server = IngestionServer.from_settings(self.ems)
+        try:
+            server.start_in_thread()
+        except OSError as e:
+            print(f"\n✗ 实时接入服务启动失败: {e}")
+            return
+        
+        ports = ", ".join(f"{name.upper()} {server.host}:{port}" for name, port in server.ports.items())
+        print(f"\n✓ 实时接入服务已启动: {ports}")
+        print("支持 NDJSON 和行协议，例如: energy,device_id=DEV001 voltage=220,current=10,power=2200")
+        try:
+            while input("按回车刷新计数，输入 q 停止: ").strip().lower() != 'q':
+                stats = server.stats.summary()
+                print(f"已接收 {stats['received']} 条，入库 {stats['accepted']} 条，拒绝 {stats['rejected']} 条，"
+                      f"丢弃 {stats['dropped']} 条，{stats['throughput_per_sec']:.0f} 条/秒，"
+                      f"P99 延迟 {stats['latency_ms']['p99'] or 0:.1f} ms")
+        except KeyboardInterrupt:
+            print()
+        finally:
+            server.stop_thread()
+        print(f"实时接入服务已停止，本次共入库 {server.stats.accepted} 条")
+    
+    def run_polling_collector(self):
+        """按监控间隔轮询已配置采集驱动的设备"""
+        points = self.ems.get_collector_points()
+        if not points:
+            device_id = input("\n暂无采集点，输入设备ID配置模拟Modbus电表（留空返回）: ").strip()
+            if not device_id:
+                return
+            success, msg = self.ems.assign_collector_point(device_id, unit_id=1)
+            print(f"{'✓' if success else '✗'} {msg}")
+            if not success:
+                return
+            points = self.ems.get_collector_points()
+        
+        cycles = input("轮询周期数（留空则持续运行，Ctrl+C 停止）: ").strip()
+        try:
+            collector = PollingCollector(self.ems, points=points)
+            cycles = int(cycles) if cycles else None
+        except ValueError as e:
+            print(f"\n✗ {e}")
+            return
+        
+        print(f"\n开始轮询 {len(points)} 个采集点，间隔 {collector.interval:.0f} 秒")
+        try:
+            summary = asyncio.run(collector.run(cycles))
+        except KeyboardInterrupt:
+            summary = collector.stats.summary()
+        print(f"\n轮询 {summary['polls']} 次，成功 {summary['succeeded']} 次，超时 {summary['timeouts']} 次，"
+              f"失败 {summary['errors']} 次，错过周期 {summary['missed_cycles']} 次，写入 {summary['written']} 条")
+    
     def energy_analysis_menu(self):
         """能耗分析菜单"""
         while True:
@@ -345,6 +478,8 @@ class EnergyManagementCLI:
             print("2. 峰谷用电分析")
             print("3. 能耗预测")
             print("4. 设备效率评级")
+            print("5. 温度回归预测")
+            print("6. 预测回测对比")
             print("0. 返回主菜单")
             print("-" * 30)
             
@@ -358,6 +493,10 @@ class EnergyManagementCLI:
                 self.energy_prediction()
             elif choice == '4':
                 self.efficiency_rating()
+            elif choice == '5':
+                self.temperature_forecast()
+            elif choice == '6':
+                self.forecast_backtest()
             elif choice == '0':
                 break
             else:
@@ -456,7 +595,8 @@ class EnergyManagementCLI:
                 print("-" * 40)
                 print(f"预测时长: {prediction['prediction_hours']} 小时")
                 print(f"预测能耗: {prediction['predicted_energy_kwh']} kWh")
-                print(f"基准功率: {prediction['base_power_w']} W")
+                print(f"预测区间: {prediction['lower_energy_kwh']} ~ {prediction['upper_energy_kwh']} kWh")
+                print(f"平均功率: {prediction['base_power_w']} W")
                 print(f"置信度: {prediction['confidence']*100:.1f}%")
                 print("-" * 40)
                 
@@ -497,6 +637,59 @@ class EnergyManagementCLI:
         except Exception as e:
             print(f"\n✗ 评级失败: {e}")
     
+    def temperature_forecast(self):
+        """按温度预报预测能耗"""
+        device_id = input("\n请输入设备ID: ").strip()
+        if not device_id:
+            print("设备ID不能为空")
+            return
+        
+        try:
+            hours = int(input("预测小时数 [24]: ").strip() or "24")
+            text = input("逐小时温度预报(°C，逗号分隔，只填一个值表示恒定) [25]: ").strip() or "25"
+            temperatures = [float(t) for t in text.split(',')]
+            if len(temperatures) == 1:
+                temperatures = temperatures * hours
+            
+            forecast, msg = self.ems.forecast_with_temperature(device_id, temperatures[:hours])
+            if forecast:
+                sensitivity = forecast['sensitivity']
+                print(f"\n温度回归预测结果:")
+                print("-" * 40)
+                print(f"预测时长: {len(forecast['hours'])} 小时")
+                print(f"预测能耗: {forecast['predicted_energy_kwh']} kWh")
+                print(f"制冷敏感度: {sensitivity['cooling_w_per_degree']} W/°C (高于22°C)")
+                print(f"采暖敏感度: {sensitivity['heating_w_per_degree']} W/°C (低于15°C)")
+                print("-" * 40)
+                for hour, temperature, power in list(zip(forecast['hours'], forecast['temperature'],
+                                                         forecast['power_w']))[:12]:
+                    print(f"{hour}时  {temperature:>5.1f}°C  {power:>10.1f} W")
+            else:
+                print(f"\n✗ {msg}")
+                
+        except ValueError:
+            print("\n✗ 请输入有效的数值")
+    
+    def forecast_backtest(self):
+        """用历史数据回测各预测器"""
+        try:
+            horizon = int(input("\n预测时长(小时) [24]: ").strip() or "24")
+            step = int(input("起点间隔(小时) [24]: ").strip() or "24")
+            min_train = int(input("最少训练小时数 [168]: ").strip() or "168")
+        except ValueError:
+            print("\n✗ 请输入有效的小时数")
+            return
+        
+        print("\n正在回测，请稍候...")
+        summary, msg = self.ems.backtest_forecasters(horizon, step, min_train)
+        if summary:
+            print(f"\n{msg}")
+            print("-" * 64)
+            print(format_comparison_table(summary))
+            print("-" * 64)
+        else:
+            print(f"\n✗ {msg}")
+    
     def recommendations_menu(self):
         """节能建议菜单"""
         while True:
@@ -507,6 +700,9 @@ class EnergyManagementCLI:
             print("2. 查看建议列表")
             print("3. 实施建议")
             print("4. 跟踪节能效果")
+            print("5. 全部设备批量生成")
+            print("6. 节能效果汇总")
+            print("7. 负荷转移调度")
             print("0. 返回主菜单")
             print("-" * 30)
             
@@ -520,6 +716,12 @@ class EnergyManagementCLI:
                 self.implement_recommendation()
             elif choice == '4':
                 self.track_savings()
+            elif choice == '5':
+                self.generate_fleet_recommendations()
+            elif choice == '6':
+                self.fleet_savings_summary()
+            elif choice == '7':
+                self.optimize_load_schedule()
             elif choice == '0':
                 break
             else:
@@ -554,6 +756,85 @@ class EnergyManagementCLI:
         except Exception as e:
             print(f"\n✗ 生成建议失败: {e}")
     
+    def generate_fleet_recommendations(self):
+        """为所有设备批量生成节能建议"""
+        try:
+            days = int(input("\n分析天数 [7]: ").strip() or "7")
+        except ValueError:
+            print("\n✗ 请输入有效的天数")
+            return
+        
+        summary, msg = self.ems.generate_fleet_recommendations(days)
+        print(f"\n{'✓' if summary else '✗'} {msg}")
+    
+    def fleet_savings_summary(self):
+        """汇总所有已实施建议的节能效果"""
+        normalized = input("\n按温度做天气归一化? (y/N): ").strip().lower() == 'y'
+        summary, msg = self.ems.summarize_fleet_savings(weather_normalized=normalized)
+        if not summary:
+            print(f"\n✗ {msg}")
+            return
+        
+        print(f"\n{msg}")
+        print("-" * 40)
+        print(f"日节能量合计: {summary['daily_energy_saved']} kWh")
+        print(f"报告期节能量合计: {summary['total_energy_saved']} kWh")
+        print(f"整体节能比例: {summary['savings_percentage']}%")
+        for rec_type, group in summary['by_type'].items():
+            print(f"  {rec_type:<24} {group['count']}条  日节能 {group['daily_energy_saved']} kWh")
+        if summary['unmeasured']:
+            print(f"数据不足未测量: {', '.join(summary['unmeasured'])}")
+        print("-" * 40)
+    
+    def optimize_load_schedule(self):
+        """录入可调度负荷并按分时电价安排运行时段"""
+        print("\n逐个录入可调度负荷，设备ID留空结束")
+        loads = []
+        while True:
+            device_id = input("\n设备ID: ").strip()
+            if not device_id:
+                break
+            try:
+                energy = float(input("每次运行所需电量(kWh): ").strip())
+                power = input("功率上限(kW，留空取额定功率): ").strip()
+                windows = input("允许时段 (如 22:00-08:00,12:00-14:00，留空为全天): ").strip()
+                baseline = input("当前开机时刻 (HH:MM，留空为允许时段开始): ").strip()
+                contiguous = input("必须连续运行? (y/N): ").strip().lower() == 'y'
+            except ValueError:
+                print("✗ 请输入有效的数值")
+                continue
+            
+            load = {'device_id': device_id, 'energy_kwh': energy, 'contiguous': contiguous,
+                    'windows': [tuple(part.strip().split('-')) for part in windows.split(',')] if windows else []}
+            if power:
+                load['power_kw'] = float(power)
+            if baseline:
+                load['baseline_start'] = baseline
+            loads.append(load)
+        
+        if not loads:
+            print("\n未录入负荷")
+            return
+        
+        cap = input("\n全站功率上限(kW，留空不限): ").strip()
+        try:
+            summary, msg = self.ems.optimize_load_schedule(loads, float(cap) if cap else None)
+        except ValueError:
+            print("\n✗ 请输入有效的功率上限")
+            return
+        if not summary:
+            print(f"\n✗ {msg}")
+            return
+        
+        print(f"\n✓ {msg}")
+        print("-" * 60)
+        for result in summary['loads']:
+            runs = ", ".join(f"{start}-{end}" for start, end, _ in result['schedule']) or "无法安排"
+            print(f"{result['device_id']:<10} {runs}")
+            print(f"{'':<10} 电费 {result['baseline_cost']:.2f} -> {result['optimized_cost']:.2f} 元")
+        print("-" * 60)
+        print(f"每日合计: {summary['baseline_cost']:.2f} -> {summary['optimized_cost']:.2f} 元")
+    
     def list_recommendations(self):
         """查看建议列表"""
         recommendations = self.ems.get_all_recommendations()
@@ -598,13 +879,17 @@ class EnergyManagementCLI:
             return
         
         try:
-            savings, msg = self.ems.track_savings_performance(rec_id)
+            normalized = input("按温度做天气归一化? (y/N): ").strip().lower() == 'y'
+            savings, msg = self.ems.track_savings_performance(rec_id, weather_normalized=normalized)
             
             if savings:
                 print(f"\n节能效果跟踪结果:")
                 print("-" * 40)
                 print(f"建议ID: {savings['recommendation_id']}")
                 print(f"设备ID: {savings['device_id']}")
+                print(f"实施日期: {savings['implementation_date']}")
+                print(f"基准期/报告期: {savings['baseline_days']} / {savings['reporting_days']} 天"
+                      f"{' (已天气归一化)' if savings['weather_normalized'] else ''}")
                 print(f"基准日均能耗: {savings['baseline_daily_consumption']} kWh")
                 print(f"当前日均能耗: {savings['current_daily_consumption']} kWh")
                 print(f"日节能量: {savings['daily_energy_saved']} kWh")
@@ -736,18 +1021,42 @@ class EnergyManagementCLI:
     
     def budget_variance_analysis(self):
         """预算差异分析"""
-        print("\n预算差异分析功能开发中...")
-        print("当前系统中的预算数据:")
-        
-        budgets = self.ems.data.get('energy_budgets', [])
-        if budgets:
-            for budget in budgets:
-                print(f"\n部门: {budget['department']}")
-                print(f"月度预算: {budget['monthly_budget']} 元")
-                print(f"当前支出: {budget['current_spending']} 元")
-                print(f"剩余预算: {budget['remaining_budget']} 元")
-        else:
-            print("暂无预算数据")
+        print("\n预算差异分析:")
+        print("1. 查看各部门预算执行情况")
+        print("2. 设置部门月度预算")
+        print("3. 设备归属部门")
+        print("0. 返回")
+        
+        choice = input("请选择操作: ").strip()
+        
+        try:
+            if choice == '1':
+                budgets = self.ems.data.get('energy_budgets', [])
+                if not budgets:
+                    print("暂无预算数据")
+                    return
+                for budget in budgets:
+                    variance, msg = self.ems.check_budget_variance(budget['department'])
+                    if not variance:
+                        print(f"\n✗ {msg}")
+                        continue
+                    print(f"\n部门: {variance['department']}")
+                    print(f"月度预算: {variance['monthly_budget']} 元")
+                    print(f"本月累计支出: {variance['current_spending']} 元")
+                    print(f"剩余预算: {variance['remaining_budget']:.2f} 元")
+                    print(f"状态: {variance['status']} ({variance['variance_percentage']}%)")
+            elif choice == '2':
+                department = input("部门名称: ").strip()
+                amount = float(input("月度预算(元): ").strip())
+                budget_id, msg = self.ems.set_department_budget(department, amount)
+                print(f"\n{'✓' if budget_id else '✗'} {msg}")
+            elif choice == '3':
+                device_id = input("设备ID: ").strip()
+                department = input("部门名称: ").strip()
+                success, msg = self.ems.assign_device_department(device_id, department)
+                print(f"\n{'✓' if success else '✗'} {msg}")
+        except ValueError:
+            print("\n✗ 请输入有效的数值")
     
     def report_generation_menu(self):
         """报表生成菜单"""
@@ -802,6 +1111,7 @@ class EnergyManagementCLI:
                 for device in report_data['devices']:
                     print(f"{device['device_name']}: {device['energy_consumed']:.3f}kWh, "
                           f"{device['cost']:.2f}元, 效率{device['efficiency']:.1f}%")
+                self.print_percentile_section(report_data.get('percentiles'))
                 print("=" * 50)
             else:
                 print(f"\n✗ {msg}")
@@ -833,6 +1143,7 @@ class EnergyManagementCLI:
                 for device in report_data['devices']:
                     print(f"{device['device_name']}: {device['monthly_consumption']:.3f}kWh, "
                           f"{device['monthly_cost']:.2f}元")
+                self.print_percentile_section(report_data.get('percentiles'))
                 print("=" * 50)
             else:
                 print(f"\n✗ {msg}")
@@ -842,6 +1153,18 @@ class EnergyManagementCLI:
         except Exception as e:
             print(f"\n✗ 生成报表失败: {e}")
     
+    def print_percentile_section(self, percentiles):
+        """打印报表中的功率分位数"""
+        if not percentiles or not percentiles['devices']:
+            return
+        
+        print("\n功率分位数 (P50 / P95 / P99):")
+        print("-" * 50)
+        for item in percentiles['devices']:
+            print(f"{item['device_name']}: {item['p50']}W / {item['p95']}W / {item['p99']}W")
+        for item in percentiles['floors']:
+            print(f"{item['floor']}层合计: {item['p50']}W / {item['p95']}W / {item['p99']}W")
+    
     def list_reports(self):
         """查看历史报表"""
         reports = self.ems.data.get('reports', [])
@@ -869,6 +1192,8 @@ class EnergyManagementCLI:
             print("1. 数据备份")
             print("2. 数据统计")
             print("3. 清理数据")
+            print("4. 性能剖析")
+            print(f"5. {'停止' if self.metrics_exporter else '启动'}指标导出 (Prometheus)")
             print("0. 返回主菜单")
             print("-" * 30)
             
@@ -880,6 +1205,10 @@ class EnergyManagementCLI:
                 self.data_statistics()
             elif choice == '3':
                 self.clean_data()
+            elif choice == '4':
+                self.performance_profiling_menu()
+            elif choice == '5':
+                self.toggle_metrics_exporter()
             elif choice == '0':
                 break
             else:
@@ -908,7 +1237,7 @@ class EnergyManagementCLI:
         print(f"能耗记录: {len(self.ems.data['energy_consumption'])}")
         print(f"成本分析: {len(self.ems.data['cost_analysis'])}")
         print(f"节能建议: {len(self.ems.data['recommendations'])}")
-        print(f"告警信息: {len(self.ems.data['alerts'])}")
+        print(f"告警信息: {len(self.ems.data['alerts'])} (已归档 {len(self.ems.get_archived_alerts())})")
         print(f"维护计划: {len(self.ems.data['maintenance_schedule'])}")
         print(f"报表数量: {len(self.ems.data['reports'])}")
         print(f"预算记录: {len(self.ems.data['energy_budgets'])}")
@@ -921,11 +1250,113 @@ class EnergyManagementCLI:
         except:
             print("数据文件大小: 未知")
     
+    def toggle_metrics_exporter(self):
+        """在后台启动或停止 Prometheus 指标导出"""
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
+            self.metrics_exporter = None
+            print("\n✓ 指标导出已停止")
+            return
+        
+        options = self.ems.data['system_settings'].get('metrics', {})
+        try:
+            port = input(f"HTTP 端口 (留空不启用) [{options.get('http_port') or ''}]: ").strip() or options.get('http_port')
+            textfile = input(f"指标文件路径 (留空不写文件) [{options.get('textfile') or ''}]: ").strip() or \
+                options.get('textfile')
+            exporter = MetricsExporter.from_settings(self.ems, http_port=int(port) if port else None, textfile=textfile)
+        except ValueError:
+            print("端口格式错误")
+            return
+        if exporter.port is None and not exporter.textfile:
+            print("\n✗ 需要指定 HTTP 端口或指标文件路径")
+            return
+        
+        try:
+            exporter.start()
+        except OSError as e:
+            print(f"\n✗ 指标导出启动失败: {e}")
+            return
+        self.metrics_exporter = exporter
+        if exporter.bound_port:
+            print(f"\n✓ 指标端点: http://{exporter.host}:{exporter.bound_port}/metrics")
+        if exporter.textfile:
+            print(f"✓ 每 {exporter.interval:g} 秒重写指标文件: {exporter.textfile}")
+    
+    def performance_profiling_menu(self):
+        """性能剖析菜单"""
+        while True:
+            enabled = self.ems.instrumentation is not None and self.ems.instrumentation.enabled
+            print("\n" + "-" * 30)
+            print("      性能剖析")
+            print("-" * 30)
+            print(f"1. {'关闭' if enabled else '开启'}方法计时")
+            print("2. 查看热点方法")
+            print("3. 剖析单次调用")
+            print("4. 清空计时统计")
+            print("0. 返回")
+            print("-" * 30)
+            
+            choice = input("请选择操作: ").strip()
+            
+            if choice == '1':
+                if enabled:
+                    success, message = self.ems.disable_instrumentation()
+                else:
+                    count, message = self.ems.enable_instrumentation()
+                print(f"\n{message}")
+            elif choice == '2':
+                self.show_hot_spots()
+            elif choice == '3':
+                self.profile_single_call()
+            elif choice == '4':
+                if self.ems.instrumentation is not None:
+                    self.ems.instrumentation.reset()
+                print("\n计时统计已清空")
+            elif choice == '0':
+                break
+            else:
+                print("无效选择，请重新输入")
+    
+    def show_hot_spots(self):
+        """按累计耗时显示热点方法"""
+        sort_options = {'1': 'total_ms', '2': 'mean_ms', '3': 'p95_ms', '4': 'calls'}
+        sort_by = sort_options.get(input("排序方式 (1.累计耗时 2.平均耗时 3.P95 4.调用次数) [1]: ").strip(), 'total_ms')
+        rows = self.ems.get_method_latency(sort_by, limit=20)
+        if not rows:
+            print("\n暂无计时数据，请先开启方法计时并执行一些操作")
+            return
+        print()
+        print(format_hot_spots(rows))
+    
+    def profile_single_call(self):
+        """用 cProfile/tracemalloc 剖析一次无参数调用"""
+        print("\n常用: save_data, generate_daily_report, analyze_fleet_consumption, generate_fleet_recommendations")
+        method_name = input("方法名: ").strip()
+        if not method_name:
+            print("方法名不能为空")
+            return
+        
+        try:
+            report, message = self.ems.profile_method(method_name)
+        except TypeError as e:
+            print(f"\n✗ 调用失败（仅支持无必填参数的方法）: {e}")
+            return
+        if report is None:
+            print(f"\n✗ {message}")
+            return
+        
+        print(f"\n✓ {message}")
+        if report['alloc_peak_kb'] is not None:
+            print(f"内存分配峰值: {report['alloc_peak_kb']:.1f} KB")
+            for allocation in report['top_allocations'][:5]:
+                print(f"  {allocation['size_kb']:>9.1f} KB  {allocation['location']}")
+        print(report['profile'])
+    
     def clean_data(self):
         """清理数据"""
         print("\n数据清理选项:")
         print("1. 清理30天前的用电记录")
-        print("2. 清理已处理的告警")
+        print("2. 归档已处理的告警")
         print("3. 清理已完成的维护记录")
         print("0. 取消")
         
@@ -934,7 +1365,14 @@ class EnergyManagementCLI:
         if choice == '1':
             print("清理30天前的用电记录功能开发中...")
         elif choice == '2':
-            print("清理已处理的告警功能开发中...")
+            days = self.ems.data['system_settings'].get('alert_archive_days', 30)
+            try:
+                days = int(input(f"归档多少天前已处理的告警 [{days}]: ").strip() or days)
+            except ValueError:
+                print("天数格式错误")
+                return
+            count, message = self.ems.archive_alerts(days)
+            print(message)
         elif choice == '3':
             print("清理已完成的维护记录功能开发中...")
         elif choice == '0':
@@ -970,6 +1408,8 @@ class EnergyManagementCLI:
                 elif choice == '8':
                     self.data_management_menu()
                 elif choice == '0':
+                    if self.metrics_exporter:
+                        self.metrics_exporter.stop()
                     print("\n感谢使用智能能耗管理系统！")
                     self.running = False
                 else:
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能能耗管理系统 - 并发控制
+引擎数据按集合划分为锁域，每个锁域一把写优先的读写锁：
+
+    settings         system_settings
+    devices          devices, maintenance_schedule, virtual_meters
+    readings         energy_readings, energy_consumption, 小时/日汇总, 虚拟电表桶, 统计/草图/积分/异常/预测状态
+    alerts           alerts, alert_archive
+    recommendations  recommendations, energy_savings
+    costs            cost_analysis, tariff_rates, energy_budgets, department_costs
+    reports          reports
+
+查询方法只取所需锁域的读锁，可以并行；写方法对所写锁域取写锁，只对实际读取的锁域（含嵌套调用的方法所需的）取读锁，
+写不同锁域的方法因此可以并行，同一锁域的写入串行。锁总是按 LOCK_DOMAINS 的顺序获取，同一线程内的嵌套调用对
+已持有的锁直接重入，需要逆序获取或把读锁升级为写锁时抛出 LockOrderError，而不是留下死锁隐患。
+持锁期间请求的收尾工作（如保存数据文件要取全部锁域的读锁）用 defer 推迟到线程释放全部锁之后执行。
+"""
+
+import functools
+import threading
+
+LOCK_DOMAINS = ('settings', 'devices', 'readings', 'alerts', 'recommendations', 'costs', 'reports')
+DOMAIN_ORDER = {domain: index for index, domain in enumerate(LOCK_DOMAINS)}
+
+
+class LockOrderError(RuntimeError):
+    """锁获取顺序错误（逆序获取或读锁升级），说明方法的锁声明不完整"""
+
+
+class ReadWriteLock:
+    """写优先的读写锁：有写者等待时新的读者排队，避免持续读负载饿死写入"""
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._condition:
+            self._writer = False
+            self._condition.notify_all()
+
+
+class DomainLocks:
+    """一组按锁域划分的读写锁，记录每个线程已持有的锁以支持重入"""
+
+    def __init__(self):
+        self.locks = {domain: ReadWriteLock() for domain in LOCK_DOMAINS}
+        self._local = threading.local()
+
+    def defer(self, callback):
+        """当前线程释放全部锁之后执行 callback，同一回调在一次持锁期间只执行一次"""
+        deferred = getattr(self._local, 'deferred', None)
+        if deferred is None:
+            deferred = self._local.deferred = []
+        if callback not in deferred:
+            deferred.append(callback)
+
+    def held(self):
+        """当前线程持有的锁 {锁域: 是否写锁}"""
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            held = self._local.held = {}
+        return held
+
+    def acquire(self, plan):
+        """按 plan [(锁域, 是否写锁)]（已按 LOCK_DOMAINS 排序）获取锁，返回本次实际获取的锁"""
+        held = self.held()
+        acquired = []
+        try:
+            for domain, write in plan:
+                current = held.get(domain)
+                if current is not None:
+                    if write and not current:
+                        raise LockOrderError(f"锁域 {domain}: 持有读锁时不能升级为写锁")
+                    continue
+                if held and max(DOMAIN_ORDER[name] for name in held) > DOMAIN_ORDER[domain]:
+                    raise LockOrderError(f"锁域 {domain}: 已持有 {sorted(held)}，不能逆序获取")
+                lock = self.locks[domain]
+                if write:
+                    lock.acquire_write()
+                else:
+                    lock.acquire_read()
+                held[domain] = write
+                acquired.append((domain, write))
+        except BaseException:
+            self.release(acquired)
+            raise
+        return acquired
+
+    def release(self, acquired):
+        held = self.held()
+        for domain, write in reversed(acquired):
+            del held[domain]
+            if write:
+                self.locks[domain].release_write()
+            else:
+                self.locks[domain].release_read()
+        deferred = getattr(self._local, 'deferred', None)
+        if deferred and not held:
+            self._local.deferred = []
+            for callback in deferred:
+                callback()
+
+    def hold(self, reads=(), writes=()):
+        """上下文管理器形式，供引擎外部的批量读取（如指标汇总）使用"""
+        return _Held(self, lock_plan(reads, writes))
+
+
+class _Held:
+    def __init__(self, locks, plan):
+        self.locks = locks
+        self.plan = plan
+        self.acquired = None
+
+    def __enter__(self):
+        self.acquired = self.locks.acquire(self.plan)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.locks.release(self.acquired)
+
+
+def lock_plan(reads=(), writes=()):
+    for domain in (*reads, *writes):
+        if domain not in DOMAIN_ORDER:
+            raise ValueError(f"未知的锁域: {domain}")
+    return tuple((domain, domain in writes) for domain in LOCK_DOMAINS if domain in reads or domain in writes)
+
+
+def _locked(plan):
+    def decorator(method):
+        @functools.wraps(method)
+        def locked(self, *args, **kwargs):
+            acquired = self.locks.acquire(plan)
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.locks.release(acquired)
+
+        locked.lock_plan = plan
+        return locked
+
+    return decorator
+
+
+def read_locked(*domains):
+    """查询方法：取所列锁域的读锁"""
+    return _locked(lock_plan(reads=domains))
+
+
+def write_locked(*domains, reads=()):
+    """写方法：取所列锁域的写锁和 reads 中锁域的读锁"""
+    return _locked(lock_plan(reads=reads, writes=domains))
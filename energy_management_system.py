@@ -10,52 +10,191 @@
 import json
 import os
 import math
+import itertools
+import time
+import threading
+import atexit
+import weakref
 from datetime import datetime, timedelta
+from statistics import NormalDist
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import matplotlib.font_manager as fm
+import numpy as np
+from streaming_stats import DeviceStatistics, TDigest, timestamp_to_epoch
+from alert_rules import AlertRuleEngine, render_message
+from anomaly_detection import AnomalyDetector
+from alert_backfill import run_alert_backfill
+from forecasting import (SeasonalForecaster, TemperatureRegression, DeviceForecastState, hour_key_to_index,
+                         HEATING_BASE, COOLING_BASE)
+from backtesting import run_backtest
+from load_scheduler import optimize_schedule, slot_prices
+from instrumentation import Instrumentation, profile_call
+from metrics_exporter import EngineMetrics
+from log_config import get_logger
+from concurrency import DomainLocks, LOCK_DOMAINS, read_locked, write_locked
 
 # 设置中文字体
 plt.rcParams['font.sans-serif'] = ['SimHei', 'DejaVu Sans']
 plt.rcParams['axes.unicode_minus'] = False
 
+storage_log = get_logger('storage')
+alerts_log = get_logger('alerts')
+recommendations_log = get_logger('recommendations')
+cost_log = get_logger('cost')
+
+# 只追加、记录写入后不再修改的集合，保存快照时复制列表即可
+APPEND_ONLY_COLLECTIONS = ('energy_readings', 'energy_consumption', 'cost_analysis')
+
+# 由读数增量维护的派生状态，旧数据文件缺少时在加载时重放读数重建
+DERIVED_COLLECTIONS = ('hourly_rollups', 'virtual_meter_buckets', 'device_statistics', 'quantile_sketches',
+                       'integrator_state', 'anomaly_state')
+
+
+def _flush_on_exit(ems_ref):
+    """进程退出时补做尚未执行的延迟保存"""
+    ems = ems_ref()
+    if ems is not None:
+        ems.flush_pending_save()
+
+
+def copy_json_tree(value):
+    """复制由 dict / list 组成的 JSON 结构（标量共享），快照与实时数据不再共用可变对象"""
+    if type(value) is dict:
+        return {key: copy_json_tree(item) for key, item in value.items()}
+    if type(value) is list:
+        return [copy_json_tree(item) for item in value]
+    return value
+
 
 class EnergyManagementSystem:
     """智能能耗管理系统主类"""
     
-    def __init__(self):
-        """初始化系统"""
-        self.data_file = os.path.join(os.path.dirname(__file__), "../data/energy_data.json")
+    def __init__(self, data_file=None):
+        """初始化系统，data_file 缺省为 ../data/energy_data.json"""
+        self.data_file = data_file or os.path.join(os.path.dirname(__file__), "../data/energy_data.json")
         self.data = {}
+        self.instrumentation = None
+        self.metrics = EngineMetrics()
+        self.locks = DomainLocks()
+        self._save_lock = threading.Lock()
+        self._saved_sequence = 0
+        self._snapshot_sequence = 0
+        # 草图压缩会修改草图本身，多个读方法（含保存快照）并行时在此串行
+        self._sketch_lock = threading.Lock()
+        self._id_lock = threading.Lock()
+        self._id_counters = {}
+        self._save_timer = None
+        self._save_timer_lock = threading.Lock()
         self.load_data()
+        atexit.register(_flush_on_exit, weakref.ref(self))
+        if self.data['system_settings'].get('instrumentation', {}).get('enabled'):
+            self.enable_instrumentation()
         
+    @write_locked(*LOCK_DOMAINS)
     def load_data(self):
         """从JSON文件加载数据"""
         try:
             with open(self.data_file, 'r', encoding='utf-8') as f:
                 self.data = json.load(f)
-            print("数据加载成功")
+            self.ensure_data_schema()
+            self.archive_alerts()
+            storage_log.info("数据加载成功", extra={'data_file': self.data_file,
+                                                 'readings': len(self.data['energy_readings'])})
         except FileNotFoundError:
-            print("数据文件不存在，创建默认数据")
+            storage_log.info("数据文件不存在，创建默认数据", extra={'data_file': self.data_file})
             self.init_default_data()
-        except json.JSONDecodeError:
-            print("数据文件格式错误，创建默认数据")
+        except json.JSONDecodeError as e:
+            storage_log.warning("数据文件格式错误，创建默认数据: %s", e, extra={'data_file': self.data_file})
             self.init_default_data()
     
     def save_data(self):
-        """保存数据到JSON文件"""
+        """保存数据到JSON文件
+        
+        在加锁方法内部调用时推迟到该线程释放全部锁之后执行。快照在全部锁域的读锁下取得，
+        JSON 编码和文件写入在锁外进行；并发保存时较旧的快照不会覆盖较新的。
+        """
+        if self.locks.held():
+            self.locks.defer(self.save_data)
+            return True
+        started = time.perf_counter()
         try:
             # 确保目录存在
             os.makedirs(os.path.dirname(self.data_file), exist_ok=True)
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, indent=2, ensure_ascii=False)
-            print("数据保存成功")
+            with self.locks.hold(reads=LOCK_DOMAINS):
+                sequence, snapshot = self.snapshot_data()
+            # 先整体编码再写入：json.dump 和带 indent 的编码都走纯Python编码器，逐条保存时慢数倍
+            content = json.dumps(snapshot, ensure_ascii=False).encode('utf-8')
+            with self._save_lock:
+                if sequence < self._saved_sequence:
+                    return True
+                with open(self.data_file, 'wb') as f:
+                    f.write(content)
+                self._saved_sequence = sequence
+                elapsed = time.perf_counter() - started
+                self.metrics.observe_save(elapsed, len(content))
+            storage_log.debug("数据保存成功", extra={'bytes': len(content), 'duration_ms': round(elapsed * 1000, 3)})
             return True
         except Exception as e:
-            print(f"数据保存失败: {e}")
+            self.metrics.save_failures += 1
+            storage_log.error("数据保存失败: %s", e, exc_info=True, extra={'data_file': self.data_file})
+            return False
+    
+    def schedule_save(self):
+        """在 storage.save_delay 秒后保存数据文件，期间的多次写入合并为一次保存（逐条写入时使用）"""
+        delay = self.data['system_settings'].get('storage', {}).get('save_delay', 1.0)
+        with self._save_timer_lock:
+            if self._save_timer is not None:
+                return
+            timer = self._save_timer = threading.Timer(delay, self._run_scheduled_save)
+            timer.daemon = True
+        timer.start()
+    
+    def _run_scheduled_save(self):
+        """延迟保存到期"""
+        with self._save_timer_lock:
+            self._save_timer = None
+        self.save_data()
+    
+    def flush_pending_save(self):
+        """立即执行尚未到期的延迟保存，没有待保存的修改时返回 False"""
+        with self._save_timer_lock:
+            timer, self._save_timer = self._save_timer, None
+        if timer is None:
             return False
+        timer.cancel()
+        return self.save_data()
+    
+    def snapshot_data(self):
+        """复制一份可在锁外序列化的数据快照，返回 (快照序号, 快照)；调用方持有全部锁域的读锁
+        
+        派生状态（统计、异常基线、预测和回归状态）由 to_dict 生成新字典放入快照而不是写回 self.data；
+        已收尾的小时草图整体替换、不会原地修改，只复制到小时一层，正在写入的小时在 _sketch_lock 下序列化。
+        """
+        derived = {
+            'device_statistics': {device_id: stats.to_dict() for device_id, stats in self._device_stats.items()},
+            'anomaly_state': self.anomaly_detector.to_dict(),
+            'forecast_state': self.forecaster.to_dict(),
+            'regression_state': self.temperature_model.to_dict(),
+            'quantile_sketches': {device_id: dict(hours)
+                                  for device_id, hours in self.data['quantile_sketches'].items()}
+        }
+        snapshot = {}
+        for key, value in self.data.items():
+            if key in derived:
+                snapshot[key] = derived[key]
+            elif key in APPEND_ONLY_COLLECTIONS:
+                snapshot[key] = list(value)
+            else:
+                snapshot[key] = copy_json_tree(value)
+        with self._sketch_lock:
+            for device_id, (hour_key, digest) in self._open_sketches.items():
+                snapshot['quantile_sketches'][device_id][hour_key] = digest.to_dict()
+            self._snapshot_sequence += 1
+            sequence = self._snapshot_sequence
+        return sequence, snapshot
     
     def init_default_data(self):
         """初始化默认数据"""
@@ -87,15 +226,88 @@ class EnergyManagementSystem:
             "energy_savings": [],
             "recommendations": [],
             "alerts": [],
+            "alert_archive": {},
             "maintenance_schedule": [],
             "reports": [],
             "energy_budgets": [],
+            "virtual_meters": [],
+            "hourly_rollups": {},
+            "daily_rollups": {},
+            "virtual_meter_buckets": {},
+            "department_costs": {},
+            "device_statistics": {},
+            "quantile_sketches": {},
+            "integrator_state": {},
+            "anomaly_state": {},
+            "forecast_state": {},
+            "regression_state": {},
             "system_settings": {
                 "monitoring_interval": 15,
+                "integration_method": "trapezoidal",
+                "max_gap_minutes": 60,
+                "ewma_alpha": 0.1,
                 "alert_thresholds": {
                     "high_consumption": 1.2,
                     "low_efficiency": 0.8,
-                    "cost_overrun": 1.1
+                    "cost_overrun": 1.1,
+                    "voltage_range": [200, 240]
+                },
+                "alert_threshold_overrides": {},
+                "alert_rules": [],
+                "alert_suppression": {
+                    "default_minutes": 30,
+                    "by_type": {}
+                },
+                "alert_archive_days": 30,
+                "anomaly_detection": {
+                    "enabled": True,
+                    "z_threshold": 4.0,
+                    "alpha": 0.05,
+                    "warmup": 30
+                },
+                "forecasting": {
+                    "alpha": 0.2,
+                    "beta": 0.01,
+                    "gamma": 0.3,
+                    "phi": 0.98,
+                    "regression_decay": 0.999
+                },
+                "ingestion": {
+                    "host": "127.0.0.1",
+                    "tcp_port": 9009,
+                    "udp_port": 9010,
+                    "http_port": None,
+                    "batch_size": 1000,
+                    "flush_interval": 0.5,
+                    "queue_size": 100,
+                    "save_interval": 5.0
+                },
+                "collector": {
+                    "jitter": 1.0,
+                    "timeout": 2.0,
+                    "pool_size": 8,
+                    "flush_interval": 1.0,
+                    "batch_size": 500,
+                    "save_interval": 60.0
+                },
+                "instrumentation": {
+                    "enabled": False
+                },
+                "storage": {
+                    "save_delay": 1.0
+                },
+                "metrics": {
+                    "host": "127.0.0.1",
+                    "http_port": None,
+                    "textfile": None,
+                    "interval": 15.0
+                },
+                "logging": {
+                    "enabled": False,
+                    "level": "INFO",
+                    "levels": {"storage": "WARNING"},
+                    "format": "text",
+                    "file": None
                 },
                 "report_generation": {
                     "auto_generate": True,
@@ -109,21 +321,127 @@ class EnergyManagementSystem:
                 }
             }
         }
+        self.ensure_data_schema()
         self.save_data()
     
+    def ensure_data_schema(self):
+        """补齐旧数据文件缺少的集合，并重建内存索引"""
+        self._id_counters = {}
+        if 'hourly_rollups' in self.data and self.rollup_reading_count() != len(self.data['energy_readings']):
+            # 小时汇总未覆盖全部读数（升级时只建了空汇总的数据文件），派生状态整体按读数重建
+            storage_log.warning("小时汇总与读数条数不一致，重建派生状态",
+                                extra={'readings': len(self.data['energy_readings'])})
+            for key in (*DERIVED_COLLECTIONS, 'daily_rollups', 'forecast_state', 'regression_state'):
+                self.data.pop(key, None)
+        missing = {key for key in DERIVED_COLLECTIONS if key not in self.data}
+        self.data.setdefault('virtual_meters', [])
+        self.data.setdefault('hourly_rollups', {})
+        self.data.setdefault('virtual_meter_buckets', {})
+        self.data.setdefault('department_costs', {})
+        self.data.setdefault('device_statistics', {})
+        self._device_stats = {
+            device_id: DeviceStatistics.from_dict(stats)
+            for device_id, stats in self.data['device_statistics'].items()
+        }
+        self.data.setdefault('quantile_sketches', {})
+        self.data.setdefault('integrator_state', {})
+        self._devices_by_id = {device['id']: device for device in self.data['devices']}
+        self._open_sketches = {}
+        self.rebuild_virtual_meter_index()
+        self.rebuild_budget_index()
+        self.rebuild_recommendation_index()
+        self._tariff_table = None
+        self.data.setdefault('alert_archive', {})
+        self.reload_alert_rules()
+        self.rebuild_alert_index()
+        self.data.setdefault('anomaly_state', {})
+        self.anomaly_detector = self.create_anomaly_detector()
+        self.anomaly_detector.load_states(self.data['anomaly_state'])
+        self.data.setdefault('forecast_state', {})
+        self.forecaster = self.create_forecaster()
+        self.forecaster.load_states(self.data['forecast_state'])
+        self.data.setdefault('regression_state', {})
+        self.temperature_model = TemperatureRegression(
+            decay=self.data['system_settings'].get('forecasting', {}).get('regression_decay', 0.999)
+        )
+        self.temperature_model.load_states(self.data['regression_state'])
+        if missing and self.data['energy_readings']:
+            self.replay_readings(missing)
+        if 'daily_rollups' not in self.data:
+            self.data['daily_rollups'] = self.build_daily_rollups()
+        for device_id, rollups in self.data['hourly_rollups'].items():
+            if device_id not in self.forecaster.states:
+                self.forecaster.replay(device_id, rollups)
+            if device_id not in self.temperature_model.states:
+                self.temperature_model.replay(device_id, rollups)
+    
+    def rollup_reading_count(self):
+        """小时汇总覆盖的读数条数，与 energy_readings 条数一致时汇总完整"""
+        return sum(rollup['count'] for rollups in self.data['hourly_rollups'].values() for rollup in rollups.values())
+    
+    def replay_readings(self, collections):
+        """按时间顺序重放已有读数，重建数据文件中缺少的派生状态（旧数据文件升级时使用）
+        
+        只重建 collections 中列出的集合；小时汇总同时驱动虚拟电表桶和预测、回归状态。
+        不产生告警，也不重复计入部门成本。
+        """
+        readings = sorted(self.data['energy_readings'], key=lambda r: r['timestamp'])
+        epochs = [timestamp_to_epoch(reading['timestamp']) for reading in readings]
+        rebuild_rollups = 'hourly_rollups' in collections
+        if rebuild_rollups:
+            self.data['virtual_meter_buckets'] = {}
+        
+        for reading in readings:
+            if rebuild_rollups:
+                self.update_hourly_rollup(reading)
+            if 'device_statistics' in collections:
+                self.update_device_statistics(reading)
+            if 'quantile_sketches' in collections:
+                self.update_quantile_sketch(reading)
+        
+        if not rebuild_rollups and 'virtual_meter_buckets' in collections:
+            for meter in self.data['virtual_meters']:
+                self.backfill_virtual_meter(meter)
+        if 'anomaly_state' in collections:
+            self.anomaly_detector.score_batch([r['device_id'] for r in readings], epochs,
+                                              [r['power'] for r in readings])
+        if 'integrator_state' in collections:
+            states = self.data['integrator_state']
+            for reading, epoch in zip(readings, epochs):
+                states[reading['device_id']] = {"timestamp": reading['timestamp'], "epoch": epoch,
+                                                "power": reading['power']}
+        storage_log.info("已由读数重建派生状态", extra={'readings': len(readings),
+                                                  'collections': sorted(collections)})
+    
     # ==================== 辅助方法 ====================
     
-    def generate_id(self, prefix, collection_name):
-        """生成唯一ID"""
-        count = len(self.data[collection_name]) + 1
-        return f"{prefix}{count:03d}"
+    def generate_id(self, prefix, collection_name, existing=None):
+        """生成唯一ID
+        
+        每个集合一个递增计数器，首次使用时从现有最大序号续起（existing 缺省为该集合的记录）；
+        不依赖集合长度，并发写入或删除记录后也不会产生重复ID。
+        """
+        with self._id_lock:
+            counter = self._id_counters.get(collection_name)
+            if counter is None:
+                items = self.data[collection_name] if existing is None else existing
+                counter = max((int(item['id'][len(prefix):]) for item in items
+                               if item.get('id', '').startswith(prefix) and item['id'][len(prefix):].isdigit()),
+                              default=0)
+            counter += 1
+            self._id_counters[collection_name] = counter
+        return f"{prefix}{counter:03d}"
     
     def find_device_by_id(self, device_id):
         """根据ID查找设备"""
-        for device in self.data['devices']:
-            if device['id'] == device_id:
-                return device
-        return None
+        return self._devices_by_id.get(device_id)
+    
+    def find_meter_by_id(self, meter_id):
+        """根据ID查找设备或虚拟电表"""
+        device = self.find_device_by_id(meter_id)
+        if device:
+            return device
+        return self.find_virtual_meter_by_id(meter_id)
     
     def find_recommendation_by_id(self, rec_id):
         """根据ID查找建议"""
@@ -136,81 +454,247 @@ class EnergyManagementSystem:
         """获取当前时间戳"""
         return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
+    def parse_as_of(self, as_of):
+        """把截止时间参数统一为 datetime，None 表示当前时间"""
+        if as_of is None:
+            return datetime.now()
+        if isinstance(as_of, str):
+            return datetime.strptime(as_of, "%Y-%m-%d %H:%M:%S")
+        return as_of
+    
     def get_current_date(self):
         """获取当前日期"""
         return datetime.now().strftime("%Y-%m-%d")
     
     # ==================== 1. 用电监控系统 ====================
     
-    def record_energy_reading(self, device_id, voltage, current, power, temperature=None, humidity=None):
-        """记录实时用电数据"""
+    @write_locked('readings', 'alerts', 'costs', reads=('settings', 'devices'))
+    def record_energy_reading(self, device_id, voltage, current, power, temperature=None, humidity=None,
+                              timestamp=None):
+        """记录实时用电数据，数据文件由延迟保存合并写出（见 schedule_save）"""
         try:
+            started = time.perf_counter()
             device = self.find_device_by_id(device_id)
             if not device:
+                self.metrics.readings_rejected += 1
                 return False, "设备不存在"
             
-            reading_id = self.generate_id("READ", "energy_readings")
-            reading = {
-                "id": reading_id,
-                "device_id": device_id,
-                "timestamp": self.get_current_timestamp(),
-                "voltage": float(voltage),
-                "current": float(current),
-                "power": float(power),
-                "energy_consumed": round(float(power) / 1000, 3),  # 转换为kWh
-                "power_factor": round(float(power) / (float(voltage) * float(current)), 3) if voltage and current else 0.95,
-                "frequency": 50.0,
-                "temperature": float(temperature) if temperature else 22.0,
-                "humidity": float(humidity) if humidity else 65.0
-            }
+            reading = self.build_energy_reading(device_id, voltage, current, power, temperature, humidity, timestamp)
+            self.ingest_reading(device, reading)
+            self.metrics.observe_ingest(1, 0, time.perf_counter() - started)
             
-            self.data['energy_readings'].append(reading)
-            
-            # 检查异常
-            self.check_energy_anomalies(reading)
-            
-            self.save_data()
-            return True, f"用电数据记录成功，ID: {reading_id}"
+            self.schedule_save()
+            return True, f"用电数据记录成功，ID: {reading['id']}"
             
         except Exception as e:
             return False, f"记录用电数据失败: {e}"
     
+    @write_locked('readings', 'alerts', 'costs', reads=('settings', 'devices'))
+    def record_energy_readings_batch(self, rows, save=True):
+        """批量记录用电数据（实时批量写入和历史回填共用）
+        
+        rows 为字典列表，字段同 record_energy_reading，可带 timestamp。
+        按时间排序后逐条走同一条增量管线，最后只保存一次；save=False 时由调用方决定何时保存。
+        设备不存在、缺字段或数值/时间戳无效的行单独拒绝，不影响同批其他行；返回值为实际入库条数。
+        """
+        accepted = 0
+        try:
+            started = time.perf_counter()
+            default_timestamp = self.get_current_timestamp()
+            ordered = sorted(rows, key=lambda row: str(row.get('timestamp') or default_timestamp))
+            
+            # 早于设备实时游标的行是历史回填：用独立的积分状态按自身时间间隔积分，不回拨实时游标
+            live_cursors = {}
+            backfill_states = {}
+            
+            rejected = 0
+            for row in ordered:
+                device = self.find_device_by_id(row.get('device_id'))
+                if not device:
+                    rejected += 1
+                    continue
+                timestamp = row.get('timestamp') or default_timestamp
+                if row['device_id'] not in live_cursors:
+                    live_state = self.data['integrator_state'].get(row['device_id'])
+                    live_cursors[row['device_id']] = live_state['epoch'] if live_state else None
+                cursor = live_cursors[row['device_id']]
+                try:
+                    backfill = cursor is not None and timestamp_to_epoch(timestamp) < cursor
+                    reading = self.build_energy_reading(
+                        row['device_id'], row['voltage'], row['current'], row['power'],
+                        row.get('temperature'), row.get('humidity'), timestamp,
+                        integrator_states=backfill_states if backfill else None
+                    )
+                except (KeyError, TypeError, ValueError):
+                    rejected += 1
+                    continue
+                try:
+                    self.ingest_reading(device, reading)
+                except Exception as e:
+                    # 单行入库出错不中断整批，按拒绝计数并记录
+                    rejected += 1
+                    storage_log.error("读数入库失败: %s", e, exc_info=True,
+                                      extra={'device_id': row['device_id'], 'reading_id': reading['id']})
+                    continue
+                accepted += 1
+            self.metrics.observe_ingest(accepted, rejected, time.perf_counter() - started)
+            
+            if accepted and save:
+                self.save_data()
+            return accepted, f"批量记录完成: 成功{accepted}条，拒绝{rejected}条"
+            
+        except Exception as e:
+            return accepted, f"批量记录用电数据失败（已写入{accepted}条）: {e}"
+    
+    def build_energy_reading(self, device_id, voltage, current, power, temperature=None, humidity=None,
+                             timestamp=None, integrator_states=None):
+        """构造读数记录，能耗按实际时间间隔积分
+        
+        数值字段或时间戳无效时抛出 ValueError / TypeError，此时积分状态和ID计数器都未改动。
+        """
+        timestamp = timestamp or self.get_current_timestamp()
+        voltage = float(voltage)
+        current = float(current)
+        power = float(power)
+        temperature = float(temperature) if temperature else 22.0
+        humidity = float(humidity) if humidity else 65.0
+        if not all(math.isfinite(value) for value in (voltage, current, power, temperature, humidity)):
+            raise ValueError("读数包含非有限数值")
+        timestamp_to_epoch(timestamp)  # 时间戳格式无效时在积分前抛出
+        energy, integration = self.integrate_energy(device_id, timestamp, power, integrator_states)
+        
+        reading = {
+            "id": self.generate_id("READ", "energy_readings"),
+            "device_id": device_id,
+            "timestamp": timestamp,
+            "voltage": voltage,
+            "current": current,
+            "power": power,
+            "energy_consumed": round(energy, 6),  # kWh
+            "power_factor": round(power / (voltage * current), 3) if voltage and current else 0.95,
+            "frequency": 50.0,
+            "temperature": temperature,
+            "humidity": humidity
+        }
+        if integration != "integrated":
+            reading['integration'] = integration
+        return reading
+    
+    def ingest_reading(self, device, reading):
+        """读数入库并驱动各项增量计算"""
+        self.data['energy_readings'].append(reading)
+        
+        # 增量维护小时汇总、虚拟电表和部门成本
+        self.update_hourly_rollup(reading)
+        self.update_daily_rollup(reading)
+        self.accumulate_department_cost(device, reading)
+        self.update_device_statistics(reading)
+        self.update_quantile_sketch(reading)
+        
+        # 检查异常
+        self.check_energy_anomalies(reading)
+        self.check_statistical_anomaly(reading)
+    
     def check_energy_anomalies(self, reading):
-        """检查用电异常"""
+        """检查用电异常（规则由 system_settings 编译而来）"""
         try:
-            device = self.find_device_by_id(reading['device_id'])
-            if not device:
-                return
+            device_id = reading['device_id']
+            rules = self._compiled_rules.get(device_id)
+            if rules is None:
+                device = self.find_device_by_id(device_id)
+                if not device:
+                    return
+                rules = self.alert_engine.compile_for_device(device)
+                self._compiled_rules[device_id] = rules
+            
+            values = (reading['power'], reading['voltage'], reading['current'],
+                      reading['power_factor'], reading['temperature'], reading['humidity'])
+            # 同一类型可能有多条规则：任一命中即告警，全部未命中才关闭
+            matched = set()
+            for rule in rules:
+                if rule.predicate(*values):
+                    matched.add(rule.type)
+                    self.create_alert(
+                        device_id,
+                        rule.type,
+                        rule.severity,
+                        render_message(rule.message, reading),
+                        rule.threshold_value,
+                        values[rule.actual_index],
+                        timestamp=reading['timestamp']
+                    )
+            for rule_type in {rule.type for rule in rules} - matched:
+                if (device_id, rule_type) in self._open_alerts:
+                    # 条件已恢复，自动关闭告警
+                    self._close_alert((device_id, rule_type), reading['timestamp'])
             
-            # 检查功率是否超过额定功率的20%
-            if reading['power'] > device['rated_power'] * 1.2:
-                self.create_alert(
-                    reading['device_id'], 
-                    "high_consumption", 
-                    "medium",
-                    f"功率消耗超出正常范围: {reading['power']}W",
-                    device['rated_power'], 
-                    reading['power']
-                )
+        except Exception as e:
+            alerts_log.error("异常检查失败: %s", e, exc_info=True,
+                             extra={'device_id': reading.get('device_id'), 'reading_id': reading.get('id')})
+    
+    def reload_alert_rules(self):
+        """按当前设置重新编译告警规则"""
+        self.alert_engine = AlertRuleEngine(self.data['system_settings'])
+        self._compiled_rules = {}
+    
+    @write_locked('settings', 'alerts', reads=('devices',))
+    def update_alert_settings(self, thresholds=None, overrides=None, rules=None):
+        """更新告警阈值、设备类型覆盖或自定义规则
+        
+        每种设备类型生效的规则集都完整编译校验一遍，阈值、条件或消息模板无效时拒绝更新。
+        """
+        try:
+            settings = dict(self.data['system_settings'])
+            if thresholds is not None:
+                settings['alert_thresholds'] = {**settings.get('alert_thresholds', {}), **thresholds}
+            if overrides is not None:
+                settings['alert_threshold_overrides'] = overrides
+            if rules is not None:
+                settings['alert_rules'] = rules
+            
+            # 规则无效时抛出 AlertRuleError
+            AlertRuleEngine(settings).validate({device.get('type') for device in self.data['devices']})
+            
+            self.data['system_settings'] = settings
+            self.reload_alert_rules()
+            self.save_data()
+            return True, "告警规则已更新"
             
-            # 检查电压异常
-            if reading['voltage'] < 200 or reading['voltage'] > 240:
-                self.create_alert(
-                    reading['device_id'], 
-                    "voltage_abnormal", 
-                    "high",
-                    f"电压异常: {reading['voltage']}V",
-                    220, 
-                    reading['voltage']
-                )
-                
         except Exception as e:
-            print(f"异常检查失败: {e}")
+            return False, f"告警规则更新失败: {e}"
     
-    def create_alert(self, device_id, alert_type, severity, message, threshold_value, actual_value):
-        """创建告警"""
+    @write_locked('alerts', reads=('settings',))
+    def create_alert(self, device_id, alert_type, severity, message, threshold_value, actual_value,
+                     timestamp=None, dedup_key=None):
+        """创建告警
+        
+        同一 (设备, 类型) 只保留一条未关闭告警，重复触发时累加次数并刷新最近时间；
+        自动恢复后在抑制窗口内再次触发，会重新打开原告警而不是新建。
+        """
         try:
-            alert_id = self.generate_id("ALERT", "alerts")
+            timestamp = timestamp or self.get_current_timestamp()
+            key = dedup_key or (device_id, alert_type)
+            
+            alert = self._open_alerts.get(key)
+            if alert is None:
+                alert = self._resolved_alerts.get(key)
+                if alert is not None and self._within_suppression_window(alert, alert_type, timestamp):
+                    self._set_alert_status(alert, 'active')
+                    alert['reopen_count'] = alert.get('reopen_count', 0) + 1
+                    alert.pop('resolved_time', None)
+                    del self._resolved_alerts[key]
+                    self._open_alerts[key] = alert
+                else:
+                    alert = None
+            
+            if alert is not None:
+                alert['count'] = alert.get('count', 1) + 1
+                alert['last_seen'] = timestamp
+                alert['message'] = message
+                alert['actual_value'] = actual_value
+                return alert['id']
+            
+            alert_id = self.next_alert_id()
             alert = {
                 "id": alert_id,
                 "device_id": device_id,
@@ -219,23 +703,133 @@ class EnergyManagementSystem:
                 "message": message,
                 "threshold_value": threshold_value,
                 "actual_value": actual_value,
-                "timestamp": self.get_current_timestamp(),
+                "timestamp": timestamp,
+                "last_seen": timestamp,
+                "count": 1,
                 "status": "active",
                 "acknowledged": False
             }
+            if dedup_key:
+                alert['dedup_key'] = list(dedup_key)
             
             self.data['alerts'].append(alert)
+            self._index_alert(alert)
+            self._open_alerts[key] = alert
+            alerts_log.info("新告警: %s", message, extra={'alert_id': alert_id, 'device_id': device_id,
+                                                         'alert_type': alert_type, 'severity': severity})
             return alert_id
             
         except Exception as e:
-            print(f"创建告警失败: {e}")
+            alerts_log.error("创建告警失败: %s", e, exc_info=True,
+                             extra={'device_id': device_id, 'alert_type': alert_type})
             return None
     
-    def get_device_readings(self, device_id, hours=24):
-        """获取设备的用电读数"""
-        end_time = datetime.now()
+    @write_locked('alerts')
+    def resolve_alert(self, alert_id, timestamp=None):
+        """关闭告警"""
+        for key, alert in self._open_alerts.items():
+            if alert['id'] == alert_id:
+                self._close_alert(key, timestamp or self.get_current_timestamp())
+                self.save_data()
+                return True, "告警已关闭"
+        return False, "告警不存在或已关闭"
+    
+    def _close_alert(self, key, timestamp):
+        """把告警移出未关闭索引，记入最近恢复索引供抑制窗口判断"""
+        alert = self._open_alerts.pop(key)
+        self._set_alert_status(alert, 'resolved')
+        alert['resolved_time'] = timestamp
+        self._resolved_alerts[key] = alert
+    
+    def _within_suppression_window(self, alert, alert_type, timestamp):
+        """判断告警恢复后是否仍在抑制窗口内"""
+        suppression = self.data['system_settings'].get('alert_suppression', {})
+        window_minutes = suppression.get('by_type', {}).get(alert_type, suppression.get('default_minutes', 30))
+        elapsed = timestamp_to_epoch(timestamp) - timestamp_to_epoch(alert['resolved_time'])
+        return elapsed <= window_minutes * 60
+    
+    def rebuild_alert_index(self):
+        """从告警列表重建未关闭/最近恢复告警索引，以及按状态、设备、日期的二级索引"""
+        self._open_alerts = {}
+        self._resolved_alerts = {}
+        self._alerts_by_status = {}
+        self._alerts_by_device = {}
+        self._alerts_by_day = {}
+        for alert in self.data['alerts']:
+            self._index_alert(alert)
+            key = tuple(alert['dedup_key']) if 'dedup_key' in alert else (alert['device_id'], alert['type'])
+            if alert['status'] == 'active':
+                self._open_alerts[key] = alert
+            elif alert['status'] == 'resolved' and 'resolved_time' in alert:
+                self._resolved_alerts[key] = alert
+    
+    def _index_alert(self, alert):
+        """把新告警加入二级索引"""
+        self._alerts_by_status.setdefault(alert['status'], {})[alert['id']] = alert
+        self._alerts_by_device.setdefault(alert['device_id'], []).append(alert)
+        self._alerts_by_day.setdefault(alert['timestamp'][:10], []).append(alert)
+    
+    def _set_alert_status(self, alert, status):
+        """修改告警状态并同步状态索引"""
+        self._alerts_by_status.get(alert['status'], {}).pop(alert['id'], None)
+        alert['status'] = status
+        self._alerts_by_status.setdefault(status, {})[alert['id']] = alert
+    
+    def next_alert_id(self):
+        """告警ID计数器从在线与归档告警的最大序号续起，归档或删除后也不会重复"""
+        archived = (alert for alerts in self.data['alert_archive'].values() for alert in alerts)
+        return self.generate_id("ALERT", 'alerts', itertools.chain(self.data['alerts'], archived))
+    
+    @write_locked('alerts', reads=('settings',))
+    def archive_alerts(self, max_age_days=None, now=None):
+        """把已恢复或已确认且超过保留天数的告警移入按月分区的归档，保持在线告警集合精简
+        
+        保留天数默认取 system_settings 中的 alert_archive_days，按恢复时间（无则按最近触发时间）计算。
+        """
+        try:
+            if max_age_days is None:
+                max_age_days = self.data['system_settings'].get('alert_archive_days', 30)
+            cutoff = ((now or datetime.now()) - timedelta(days=max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
+            
+            archive = self.data['alert_archive']
+            hot = []
+            archived = 0
+            for alert in self.data['alerts']:
+                closed = alert['status'] != 'active' or alert.get('acknowledged')
+                if closed and alert.get('resolved_time', alert.get('last_seen', alert['timestamp'])) < cutoff:
+                    archive.setdefault(alert['timestamp'][:7], []).append(alert)
+                    archived += 1
+                else:
+                    hot.append(alert)
+            
+            if archived:
+                self.data['alerts'] = hot
+                self.rebuild_alert_index()
+                self.save_data()
+            return archived, f"已归档{archived}条告警"
+            
+        except Exception as e:
+            return 0, f"告警归档失败: {e}"
+    
+    @read_locked('alerts')
+    def count_alerts_on(self, date_str):
+        """统计某天触发的告警数（含已归档）"""
+        archived = self.data['alert_archive'].get(date_str[:7], [])
+        return (len(self._alerts_by_day.get(date_str, []))
+                + sum(1 for alert in archived if alert['timestamp'].startswith(date_str)))
+    
+    @read_locked('devices', 'readings')
+    def get_device_readings(self, device_id, hours=24, as_of=None):
+        """获取设备的用电读数
+        
+        as_of 为截止时间（datetime 或时间戳字符串），默认当前时间，用于回测时按历史时刻取数。
+        """
+        end_time = self.parse_as_of(as_of)
         start_time = end_time - timedelta(hours=hours)
         
+        if device_id in self._virtual_meters_by_id:
+            return self.get_virtual_meter_readings(device_id, start_time, end_time)
+        
         readings = []
         for reading in self.data['energy_readings']:
             if reading['device_id'] == device_id:
@@ -247,6 +841,7 @@ class EnergyManagementSystem:
     
     # ==================== 2. 能耗分析系统 ====================
     
+    @read_locked('devices', 'readings')
     def analyze_energy_consumption(self, device_id, days=7):
         """分析设备能耗"""
         try:
@@ -254,7 +849,7 @@ class EnergyManagementSystem:
             if not readings:
                 return None, "没有可用的数据进行分析"
             
-            device = self.find_device_by_id(device_id)
+            device = self.find_meter_by_id(device_id)
             if not device:
                 return None, "设备不存在"
             
@@ -285,32 +880,32 @@ class EnergyManagementSystem:
         except Exception as e:
             return None, f"能耗分析失败: {e}"
     
-    def predict_energy_consumption(self, device_id, hours=24):
-        """预测未来能耗"""
+    @read_locked('settings', 'devices', 'readings')
+    def predict_energy_consumption(self, device_id, hours=24, confidence=0.95, as_of=None):
+        """预测未来能耗（基于季节性预测模型，附带预测区间）
+        
+        as_of 指定时，只用该时刻之前的数据，从该时刻起预测。
+        """
         try:
-            recent_readings = self.get_device_readings(device_id, hours=48)
-            if len(recent_readings) < 10:
+            forecast = self.forecast_device_power(device_id, hours, confidence=confidence, as_of=as_of)
+            if forecast is None:
                 return None, "数据不足，无法进行预测"
             
-            # 简单移动平均预测
-            recent_powers = [r['power'] for r in recent_readings[-10:]]
-            avg_power = sum(recent_powers) / len(recent_powers)
-            predicted_energy = (avg_power * hours) / 1000  # 转换为kWh
-            
-            # 考虑时间模式（简单的周期性调整）
-            current_hour = datetime.now().hour
-            if 8 <= current_hour <= 18:  # 工作时间
-                predicted_energy *= 1.2
-            else:  # 非工作时间
-                predicted_energy *= 0.8
-            
+            mean, lower, upper = forecast['power_w'], forecast['lower_w'], forecast['upper_w']
             prediction = {
                 'device_id': device_id,
                 'prediction_hours': hours,
-                'predicted_energy_kwh': round(predicted_energy, 3),
-                'confidence': 0.75,
-                'prediction_date': self.get_current_timestamp(),
-                'base_power_w': round(avg_power, 2)
+                'predicted_energy_kwh': round(sum(mean) / 1000, 3),
+                'lower_energy_kwh': round(sum(lower) / 1000, 3),
+                'upper_energy_kwh': round(sum(upper) / 1000, 3),
+                'confidence': confidence,
+                'prediction_date': self.parse_as_of(as_of).strftime("%Y-%m-%d %H:%M:%S"),
+                'base_power_w': round(sum(mean) / len(mean), 2),
+                'method': 'holt_winters',
+                'hourly': [
+                    {'hour': hour, 'power_w': round(p, 2), 'lower_w': round(lo, 2), 'upper_w': round(hi, 2)}
+                    for hour, p, lo, hi in zip(forecast['hours'], mean, lower, upper)
+                ]
             }
             
             return prediction, "能耗预测完成"
@@ -318,6 +913,7 @@ class EnergyManagementSystem:
         except Exception as e:
             return None, f"能耗预测失败: {e}"
     
+    @read_locked('devices', 'readings')
     def analyze_peak_valley_consumption(self, device_id, days=7):
         """分析峰谷用电"""
         try:
@@ -359,62 +955,175 @@ class EnergyManagementSystem:
     
     # ==================== 3. 节能建议系统 ====================
     
+    @write_locked('recommendations', reads=('devices', 'readings'))
     def generate_energy_recommendations(self, device_id):
-        """生成节能建议"""
+        """生成节能建议（同一设备同类型的待处理建议只更新不重复创建）"""
         try:
             device = self.find_device_by_id(device_id)
             if not device:
                 return [], "设备不存在"
             
-            recommendations = []
-            
             # 分析近期能耗
             analysis, _ = self.analyze_energy_consumption(device_id, days=7)
             if not analysis:
                 return [], "数据不足，无法生成建议"
             
-            # 根据设备类型和能耗情况生成建议
-            if device['type'] == 'HVAC':
-                # 空调设备建议
-                if analysis['efficiency_percentage'] > 90:
-                    rec_id = self.create_recommendation(
-                        device_id, "temperature_adjustment", "medium",
-                        "建议将空调温度调高2度，可节能15%",
-                        "15%节能效果", 0.0, "立即生效"
-                    )
-                    recommendations.append(rec_id)
-                
-                if analysis['average_power_w'] > device['rated_power'] * 0.8:
-                    rec_id = self.create_recommendation(
-                        device_id, "schedule_optimization", "high",
-                        "建议在非工作时间关闭空调或调至节能模式",
-                        "25%节能效果", 0.0, "立即生效"
-                    )
-                    recommendations.append(rec_id)
-            
-            elif device['type'] == 'Lighting':
-                # 照明设备建议
-                rec_id = self.create_recommendation(
-                    device_id, "schedule_optimization", "low",
-                    "建议在午休时间减少照明亮度",
-                    "8%节能效果", 0.0, "立即生效"
-                )
-                recommendations.append(rec_id)
-            
-            # 通用建议
-            if analysis['efficiency_percentage'] < 70:
-                rec_id = self.create_recommendation(
-                    device_id, "maintenance_check", "high",
-                    "设备效率较低，建议进行维护检查",
-                    "10-20%效率提升", 200.0, "1-2周"
-                )
-                recommendations.append(rec_id)
+            recommendations = [self.upsert_recommendation(device_id, *rule)[0]
+                               for rule in self._recommendation_rules(device, analysis)]
             
             return recommendations, "节能建议生成成功"
             
         except Exception as e:
             return [], f"生成节能建议失败: {e}"
     
+    def _recommendation_rules(self, device, analysis):
+        """根据设备类型和能耗情况匹配建议
+        
+        返回 [(类型, 优先级, 描述, 预期节能, 实施成本, 回收期)]。
+        """
+        rules = []
+        if device['type'] == 'HVAC':
+            # 空调设备建议
+            if analysis['efficiency_percentage'] > 90:
+                rules.append(("temperature_adjustment", "medium", "建议将空调温度调高2度，可节能15%",
+                              "15%节能效果", 0.0, "立即生效"))
+            
+            if analysis['average_power_w'] > device['rated_power'] * 0.8:
+                rules.append(("schedule_optimization", "high", "建议在非工作时间关闭空调或调至节能模式",
+                              "25%节能效果", 0.0, "立即生效"))
+        
+        elif device['type'] == 'Lighting':
+            # 照明设备建议
+            rules.append(("schedule_optimization", "low", "建议在午休时间减少照明亮度",
+                          "8%节能效果", 0.0, "立即生效"))
+        
+        # 通用建议
+        if analysis['efficiency_percentage'] < 70:
+            rules.append(("maintenance_check", "high", "设备效率较低，建议进行维护检查",
+                          "10-20%效率提升", 200.0, "1-2周"))
+        return rules
+    
+    @read_locked('devices', 'readings')
+    def analyze_fleet_consumption(self, days=7):
+        """基于小时汇总一次性分析所有设备近期能耗
+        
+        返回 {设备ID: 分析结果}，字段与 analyze_energy_consumption 相同；
+        按整点小时取窗口，不逐条扫描读数。没有数据的设备不出现在结果中。
+        """
+        now = datetime.now()
+        hour_keys = [(now - timedelta(hours=i)).strftime("%Y-%m-%d %H") for i in range(days * 24 + 1)]
+        analysis_date = self.get_current_date()
+        
+        analyses = {}
+        for device in self.data['devices']:
+            rollups = self.data['hourly_rollups'].get(device['id'])
+            if not rollups:
+                continue
+            
+            total_energy = 0.0
+            power_sum = 0.0
+            count = 0
+            peak_power = None
+            min_power = None
+            for hour_key in hour_keys:
+                rollup = rollups.get(hour_key)
+                if rollup is None:
+                    continue
+                total_energy += rollup['energy_kwh']
+                power_sum += rollup['power_sum']
+                count += rollup['count']
+                if peak_power is None or rollup['power_max'] > peak_power:
+                    peak_power = rollup['power_max']
+                if min_power is None or rollup['power_min'] < min_power:
+                    min_power = rollup['power_min']
+            if not count:
+                continue
+            
+            avg_power = power_sum / count
+            efficiency = (avg_power / device['rated_power']) * 100 if device['rated_power'] > 0 else 0
+            analyses[device['id']] = {
+                'device_id': device['id'],
+                'device_name': device['name'],
+                'period_days': days,
+                'total_energy_kwh': round(total_energy, 3),
+                'average_power_w': round(avg_power, 2),
+                'peak_power_w': peak_power,
+                'min_power_w': min_power,
+                'efficiency_percentage': round(efficiency, 2),
+                'readings_count': count,
+                'analysis_date': analysis_date
+            }
+        return analyses
+    
+    @write_locked('recommendations', reads=('devices', 'readings'))
+    def generate_fleet_recommendations(self, days=7):
+        """对所有设备批量生成节能建议
+        
+        共用一次汇总分析，逐设备匹配规则；已有同类型待处理建议时更新而不重复创建，
+        因此可以每晚重复执行。返回 (汇总, 消息)。
+        """
+        try:
+            analyses = self.analyze_fleet_consumption(days)
+            created = 0
+            updated = 0
+            rec_ids = []
+            for device in self.data['devices']:
+                analysis = analyses.get(device['id'])
+                if analysis is None:
+                    continue
+                for rule in self._recommendation_rules(device, analysis):
+                    rec_id, is_new = self.upsert_recommendation(device['id'], *rule)
+                    rec_ids.append(rec_id)
+                    if is_new:
+                        created += 1
+                    else:
+                        updated += 1
+            
+            self.save_data()
+            without_data = [device['id'] for device in self.data['devices'] if device['id'] not in analyses]
+            if without_data:
+                recommendations_log.info("%d台设备近%d天没有读数，未生成建议", len(without_data), days,
+                                         extra={'devices': without_data[:20]})
+            summary = {
+                'devices_analyzed': len(analyses),
+                'devices_without_data': without_data,
+                'created': created,
+                'updated': updated,
+                'recommendations': rec_ids
+            }
+            return summary, (f"已分析{len(analyses)}台设备（{len(without_data)}台无近期数据），"
+                             f"新增建议{created}条，更新{updated}条")
+            
+        except Exception as e:
+            return None, f"批量生成节能建议失败: {e}"
+    
+    def rebuild_recommendation_index(self):
+        """重建 (设备, 建议类型) -> 待处理建议 索引"""
+        self._pending_recommendations = {
+            (rec['device_id'], rec['type']): rec
+            for rec in self.data['recommendations'] if rec['status'] == 'pending'
+        }
+    
+    @write_locked('recommendations')
+    def upsert_recommendation(self, device_id, rec_type, priority, description,
+                              estimated_savings, implementation_cost, payback_period):
+        """同一设备同类型已有待处理建议时更新其内容，否则新建；返回 (建议ID, 是否新建)"""
+        rec = self._pending_recommendations.get((device_id, rec_type))
+        if rec is None:
+            return self.create_recommendation(device_id, rec_type, priority, description,
+                                              estimated_savings, implementation_cost, payback_period), True
+        
+        rec.update({
+            "priority": priority,
+            "description": description,
+            "estimated_savings": estimated_savings,
+            "implementation_cost": implementation_cost,
+            "payback_period": payback_period,
+            "updated_date": self.get_current_date()
+        })
+        return rec['id'], False
+    
+    @write_locked('recommendations')
     def create_recommendation(self, device_id, rec_type, priority, description, 
                             estimated_savings, implementation_cost, payback_period):
         """创建节能建议"""
@@ -434,12 +1143,15 @@ class EnergyManagementSystem:
             }
             
             self.data['recommendations'].append(recommendation)
+            self._pending_recommendations[(device_id, rec_type)] = recommendation
             return rec_id
             
         except Exception as e:
-            print(f"创建建议失败: {e}")
+            recommendations_log.error("创建建议失败: %s", e, exc_info=True,
+                                      extra={'device_id': device_id, 'rec_type': rec_type})
             return None
     
+    @write_locked('recommendations')
     def implement_recommendation(self, rec_id):
         """实施节能建议"""
         try:
@@ -447,6 +1159,8 @@ class EnergyManagementSystem:
             if not rec:
                 return False, "建议不存在"
             
+            if rec['status'] == 'pending':
+                self._pending_recommendations.pop((rec['device_id'], rec['type']), None)
             rec['status'] = 'implemented'
             rec['implementation_date'] = self.get_current_date()
             
@@ -456,8 +1170,13 @@ class EnergyManagementSystem:
         except Exception as e:
             return False, f"实施建议失败: {e}"
     
-    def track_savings_performance(self, rec_id):
-        """跟踪节能效果"""
+    @read_locked('readings', 'recommendations')
+    def track_savings_performance(self, rec_id, baseline_days=14, reporting_days=7, weather_normalized=False):
+        """跟踪节能效果
+        
+        以实施日期为界：实施前 baseline_days 天为基准期，实施次日起 reporting_days 天为报告期，
+        均按日汇总计算；weather_normalized 为 True 时按温度对基准期做天气归一化。
+        """
         try:
             rec = self.find_recommendation_by_id(rec_id)
             if not rec:
@@ -466,36 +1185,11 @@ class EnergyManagementSystem:
             if rec['status'] != 'implemented':
                 return None, "建议尚未实施"
             
-            device_id = rec['device_id']
-            
-            # 获取实施前后的能耗数据
-            baseline_analysis, _ = self.analyze_energy_consumption(device_id, days=14)
-            current_analysis, _ = self.analyze_energy_consumption(device_id, days=7)
-            
-            if baseline_analysis and current_analysis:
-                baseline_consumption = baseline_analysis['total_energy_kwh']
-                current_consumption = current_analysis['total_energy_kwh']
-                
-                # 按天计算平均值进行比较
-                baseline_daily = baseline_consumption / baseline_analysis['period_days']
-                current_daily = current_consumption / current_analysis['period_days']
-                
-                energy_saved = baseline_daily - current_daily
-                savings_percentage = (energy_saved / baseline_daily * 100) if baseline_daily > 0 else 0
-                
-                savings_record = {
-                    'recommendation_id': rec_id,
-                    'device_id': device_id,
-                    'baseline_daily_consumption': round(baseline_daily, 3),
-                    'current_daily_consumption': round(current_daily, 3),
-                    'daily_energy_saved': round(energy_saved, 3),
-                    'savings_percentage': round(savings_percentage, 2),
-                    'measurement_date': self.get_current_date()
-                }
-                
-                return savings_record, "节能效果跟踪完成"
+            savings_record = self.measure_savings(rec, baseline_days, reporting_days, weather_normalized)
+            if savings_record is None:
+                return None, "数据不足，无法计算节能效果"
             
-            return None, "数据不足，无法计算节能效果"
+            return savings_record, "节能效果跟踪完成"
             
         except Exception as e:
             return None, f"跟踪节能效果失败: {e}"
@@ -518,9 +1212,37 @@ class EnergyManagementSystem:
             return 0.65
             
         except Exception as e:
-            print(f"获取电价费率失败: {e}")
+            cost_log.warning("获取电价费率失败，使用默认费率0.65: %s", e, extra={'rate_type': rate_type})
             return 0.65
     
+    def compile_tariff(self):
+        """把分时电价编译为按分钟索引的费率表，读数计费时O(1)查表"""
+        table = [self.get_tariff_rate("default")] * 1440
+        today = self.get_current_date()
+        tariffs = sorted(
+            (t for t in self.data['tariff_rates'] if t.get('effective_date', '') <= today),
+            key=lambda t: t.get('effective_date', '')
+        )
+        for tariff in tariffs:
+            start = int(tariff['time_start'][:2]) * 60 + int(tariff['time_start'][3:5])
+            end = int(tariff['time_end'][:2]) * 60 + int(tariff['time_end'][3:5])
+            if end <= start:  # 跨零点时段，如 22:00-08:00
+                end += 1440
+            for minute in range(start, end):
+                table[minute % 1440] = tariff['rate_per_kwh']
+        self._tariff_table = table
+        return table
+    
+    def invalidate_tariff(self):
+        """电价变更后使编译结果失效"""
+        self._tariff_table = None
+    
+    def get_rate_at(self, timestamp):
+        """按读数时间戳查询适用电价"""
+        table = self._tariff_table or self.compile_tariff()
+        return table[int(timestamp[11:13]) * 60 + int(timestamp[14:16])]
+    
+    @write_locked('costs', reads=('devices', 'readings'))
     def calculate_electricity_cost(self, device_id, date_str=None):
         """计算电费成本"""
         try:
@@ -581,6 +1303,7 @@ class EnergyManagementSystem:
         except Exception as e:
             return None, f"电费计算失败: {e}"
     
+    @write_locked('costs', reads=('devices', 'readings'))
     def calculate_monthly_cost(self, device_id, year, month):
         """计算月度电费"""
         try:
@@ -627,31 +1350,38 @@ class EnergyManagementSystem:
         except Exception as e:
             return None, f"月度电费计算失败: {e}"
     
+    @write_locked('alerts', 'costs', reads=('settings',))
     def check_budget_variance(self, department):
         """检查预算差异"""
         try:
-            budget = None
-            for b in self.data['energy_budgets']:
-                if b['department'] == department:
-                    budget = b
-                    break
-            
+            budget = self._budget_index.get(department)
             if not budget:
                 return None, "未找到该部门的预算信息"
             
-            current_spending = budget['current_spending']
+            month = self.get_current_date()[:7]
+            department_costs = self.data['department_costs'].get(department)
             monthly_budget = budget['monthly_budget']
+            if department_costs is not None:
+                # 已接入自动归集的部门直接读取本月累计值，并刷新预算记录（跨月后不再沿用上月数值）
+                current_spending = round(department_costs.get(month, {}).get('cost', 0.0), 2)
+                budget['current_spending'] = current_spending
+                budget['remaining_budget'] = round(monthly_budget - current_spending, 2)
+            else:
+                current_spending = budget['current_spending']
             variance = current_spending - monthly_budget
             variance_percentage = (variance / monthly_budget * 100) if monthly_budget > 0 else 0
             
             status = "超支" if variance > 0 else "正常"
             
-            # 如果超支，创建告警
-            if variance > 0:
+            # 超出 cost_overrun 告警倍数且本月尚未告警时，创建告警
+            limit = monthly_budget * self.alert_engine.cost_overrun_ratio
+            if current_spending > limit and budget.get('overrun_alert_month') != month:
+                budget['overrun_alert_month'] = month
                 self.create_alert(
                     "BUDGET", "budget_overrun", "high",
                     f"{department}部门预算超支 {variance:.2f}元",
-                    monthly_budget, current_spending
+                    monthly_budget, current_spending,
+                    dedup_key=("BUDGET", "budget_overrun", department, month)
                 )
             
             variance_analysis = {
@@ -672,6 +1402,7 @@ class EnergyManagementSystem:
     
     # ==================== 5. 设备管理系统 ====================
     
+    @write_locked('devices')
     def register_device(self, name, device_type, location, rated_power, 
                        energy_efficiency="A", manufacturer="通用", model="标准型"):
         """注册新设备"""
@@ -694,6 +1425,7 @@ class EnergyManagementSystem:
             }
             
             self.data['devices'].append(device)
+            self._devices_by_id[device_id] = device
             self.save_data()
             
             return device_id, f"设备注册成功，ID: {device_id}"
@@ -701,6 +1433,7 @@ class EnergyManagementSystem:
         except Exception as e:
             return None, f"设备注册失败: {e}"
     
+    @write_locked('devices')
     def update_device_status(self, device_id, status):
         """更新设备状态"""
         try:
@@ -717,6 +1450,7 @@ class EnergyManagementSystem:
         except Exception as e:
             return False, f"更新设备状态失败: {e}"
     
+    @write_locked('devices')
     def schedule_maintenance(self, device_id, maintenance_type, scheduled_date, 
                            description, technician="待分配", cost_estimate=0.0):
         """安排设备维护"""
@@ -747,6 +1481,7 @@ class EnergyManagementSystem:
         except Exception as e:
             return None, f"安排维护失败: {e}"
     
+    @read_locked('devices', 'readings')
     def get_device_efficiency_rating(self, device_id):
         """获取设备能效评级"""
         try:
@@ -801,6 +1536,7 @@ class EnergyManagementSystem:
     
     # ==================== 6. 报表生成系统 ====================
     
+    @write_locked('costs', 'reports', reads=('devices', 'readings', 'alerts'))
     def generate_daily_report(self, date_str=None):
         """生成日报表"""
         try:
@@ -817,8 +1553,8 @@ class EnergyManagementSystem:
                 'efficiency_summary': {}
             }
             
-            # 统计各设备数据
-            for device in self.data['devices']:
+            # 统计各设备数据（虚拟电表参与展示但不计入合计，避免重复计量）
+            for device in self.get_all_meters():
                 device_id = device['id']
                 
                 # 获取设备当日数据
@@ -832,20 +1568,25 @@ class EnergyManagementSystem:
                     'energy_consumed': energy_analysis['total_energy_kwh'] if energy_analysis else 0,
                     'cost': cost_analysis['total_cost'] if cost_analysis else 0,
                     'efficiency': energy_analysis['efficiency_percentage'] if energy_analysis else 0,
-                    'status': device['status']
+                    'status': device['status'],
+                    'virtual': device.get('virtual', False)
                 }
                 
                 report_data['devices'].append(device_data)
+                if device_data['virtual']:
+                    continue
                 report_data['total_consumption'] += device_data['energy_consumed']
                 report_data['total_cost'] += device_data['cost']
             
+            # 功率分位数
+            report_data['percentiles'] = self.build_percentile_section(f"{date_str} 00", f"{date_str} 23")
+            
             # 统计告警数量
-            today_alerts = [alert for alert in self.data['alerts'] 
-                          if alert['timestamp'].startswith(date_str)]
-            report_data['alerts_count'] = len(today_alerts)
+            report_data['alerts_count'] = self.count_alerts_on(date_str)
             
             # 效率汇总
-            efficiencies = [d['efficiency'] for d in report_data['devices'] if d['efficiency'] > 0]
+            efficiencies = [d['efficiency'] for d in report_data['devices']
+                            if d['efficiency'] > 0 and not d['virtual']]
             if efficiencies:
                 report_data['efficiency_summary'] = {
                     'average_efficiency': round(sum(efficiencies) / len(efficiencies), 2),
@@ -875,6 +1616,7 @@ class EnergyManagementSystem:
         except Exception as e:
             return None, f"生成日报表失败: {e}"
     
+    @write_locked('costs', 'reports', reads=('devices', 'readings'))
     def generate_monthly_report(self, year, month):
         """生成月报表"""
         try:
@@ -898,8 +1640,8 @@ class EnergyManagementSystem:
                 'cost_trends': {}
             }
             
-            # 按设备统计月度数据
-            for device in self.data['devices']:
+            # 按设备统计月度数据（虚拟电表参与展示但不计入合计）
+            for device in self.get_all_meters():
                 device_id = device['id']
                 monthly_cost, _ = self.calculate_monthly_cost(device_id, year, month)
                 
@@ -911,13 +1653,21 @@ class EnergyManagementSystem:
                         'monthly_consumption': monthly_cost['total_energy_kwh'],
                         'monthly_cost': monthly_cost['total_cost'],
                         'average_daily_consumption': monthly_cost['average_daily_energy'],
-                        'average_daily_cost': monthly_cost['average_daily_cost']
+                        'average_daily_cost': monthly_cost['average_daily_cost'],
+                        'virtual': device.get('virtual', False)
                     }
                     
                     report_data['devices'].append(device_data)
+                    if device_data['virtual']:
+                        continue
                     report_data['total_consumption'] += device_data['monthly_consumption']
                     report_data['total_cost'] += device_data['monthly_cost']
             
+            # 功率分位数
+            report_data['percentiles'] = self.build_percentile_section(
+                f"{report_data['period_start']} 00", f"{report_data['period_end']} 23"
+            )
+            
             # 保存月报表
             report_id = self.generate_id("RPT", "reports")
             report_record = {
@@ -940,6 +1690,7 @@ class EnergyManagementSystem:
         except Exception as e:
             return None, f"生成月报表失败: {e}"
     
+    @read_locked('reports')
     def export_report_to_file(self, report_id, file_format='json'):
         """导出报表到文件"""
         try:
@@ -966,16 +1717,1037 @@ class EnergyManagementSystem:
         except Exception as e:
             return None, f"导出报表失败: {e}"
     
+    # ==================== 7. 虚拟电表 ====================
+    
+    def rebuild_virtual_meter_index(self):
+        """重建虚拟电表索引（设备ID -> [(虚拟电表ID, 符号)]）"""
+        self._virtual_meters_by_id = {}
+        self._virtual_meter_index = {}
+        for meter in self.data['virtual_meters']:
+            self._virtual_meters_by_id[meter['id']] = meter
+            for component in meter['components']:
+                self._virtual_meter_index.setdefault(component['device_id'], []).append(
+                    (meter['id'], component['sign'])
+                )
+    
+    def find_virtual_meter_by_id(self, meter_id):
+        """根据ID查找虚拟电表"""
+        return self._virtual_meters_by_id.get(meter_id)
+    
+    @write_locked('devices', 'readings')
+    def create_virtual_meter(self, name, components, location="虚拟计量", rated_power=None):
+        """创建虚拟电表
+        
+        components 为 [(设备ID, 符号)] 列表，符号取 1 (相加) 或 -1 (相减)，
+        例如总进线减去已知分表即为未计量负荷。
+        """
+        try:
+            if not components:
+                return None, "虚拟电表至少需要一个组成设备"
+            
+            normalized = []
+            for device_id, sign in components:
+                device = self.find_device_by_id(device_id)
+                if not device:
+                    return None, f"设备不存在: {device_id}"
+                if sign not in (1, -1):
+                    return None, f"组成符号必须为1或-1: {device_id}"
+                normalized.append({"device_id": device_id, "sign": sign})
+            
+            if rated_power is None:
+                rated_power = sum(c['sign'] * self.find_device_by_id(c['device_id'])['rated_power']
+                                  for c in normalized)
+            
+            meter_id = self.generate_id("VM", "virtual_meters")
+            meter = {
+                "id": meter_id,
+                "name": name,
+                "type": "Virtual",
+                "location": location,
+                "rated_power": max(float(rated_power), 0.0),
+                "components": normalized,
+                "status": "online",
+                "virtual": True,
+                "created_date": self.get_current_date()
+            }
+            
+            self.data['virtual_meters'].append(meter)
+            self.rebuild_virtual_meter_index()
+            
+            # 用组成设备已有的小时汇总一次性回填历史桶，之后随读数增量维护
+            self.backfill_virtual_meter(meter)
+            
+            self.save_data()
+            return meter_id, f"虚拟电表创建成功，ID: {meter_id}"
+            
+        except Exception as e:
+            return None, f"虚拟电表创建失败: {e}"
+    
+    def backfill_virtual_meter(self, meter):
+        """用组成设备的小时汇总重新生成虚拟电表的全部小时桶"""
+        buckets = self.data['virtual_meter_buckets'][meter['id']] = {}
+        for component in meter['components']:
+            rollups = self.data['hourly_rollups'].get(component['device_id'], {})
+            for hour_key, rollup in rollups.items():
+                self._apply_virtual_meter_delta(
+                    buckets, hour_key, component['sign'] * rollup['energy_kwh'],
+                    component['sign'] * rollup['power_sum'] / rollup['count'], rollup['count']
+                )
+    
+    @write_locked('devices', 'readings')
+    def delete_virtual_meter(self, meter_id):
+        """删除虚拟电表"""
+        meter = self.find_virtual_meter_by_id(meter_id)
+        if not meter:
+            return False, "虚拟电表不存在"
+        
+        self.data['virtual_meters'].remove(meter)
+        self.data['virtual_meter_buckets'].pop(meter_id, None)
+        self.rebuild_virtual_meter_index()
+        self.save_data()
+        return True, "虚拟电表已删除"
+    
+    def update_hourly_rollup(self, reading):
+        """按小时对齐增量汇总读数，并同步更新包含该设备的虚拟电表"""
+        device_id = reading['device_id']
+        hour_key = reading['timestamp'][:13]
+        power = reading['power']
+        energy = reading['energy_consumed']
+        
+        device_rollups = self.data['hourly_rollups'].setdefault(device_id, {})
+        rollup = device_rollups.get(hour_key)
+        if rollup is None:
+            rollup = {
+                "energy_kwh": 0.0,
+                "power_sum": 0.0,
+                "power_max": power,
+                "power_min": power,
+                "temperature_sum": 0.0,
+                "count": 0
+            }
+            device_rollups[hour_key] = rollup
+            old_average = 0.0
+            self.forecaster.on_new_hour(device_id, hour_key, device_rollups)
+            self.temperature_model.on_new_hour(device_id, hour_key, device_rollups)
+        else:
+            old_average = rollup['power_sum'] / rollup['count']
+        
+        rollup['energy_kwh'] += energy
+        rollup['power_sum'] += power
+        rollup['temperature_sum'] += reading['temperature']
+        rollup['count'] += 1
+        if power > rollup['power_max']:
+            rollup['power_max'] = power
+        if power < rollup['power_min']:
+            rollup['power_min'] = power
+        
+        memberships = self._virtual_meter_index.get(device_id)
+        if memberships:
+            power_delta = rollup['power_sum'] / rollup['count'] - old_average
+            for meter_id, sign in memberships:
+                buckets = self.data['virtual_meter_buckets'].setdefault(meter_id, {})
+                self._apply_virtual_meter_delta(buckets, hour_key, sign * energy, sign * power_delta, 1)
+    
+    def _apply_virtual_meter_delta(self, buckets, hour_key, energy_delta, power_delta, count):
+        """把组成设备的增量叠加到虚拟电表的小时桶"""
+        bucket = buckets.get(hour_key)
+        if bucket is None:
+            bucket = {"energy_kwh": 0.0, "average_power_w": 0.0, "count": 0}
+            buckets[hour_key] = bucket
+        bucket['energy_kwh'] += energy_delta
+        bucket['average_power_w'] += power_delta
+        bucket['count'] += count
+    
+    def get_virtual_meter_readings(self, meter_id, start_time, end_time):
+        """以小时桶的形式返回虚拟电表的等效读数"""
+        start_key = start_time.strftime("%Y-%m-%d %H")
+        end_key = end_time.strftime("%Y-%m-%d %H")
+        buckets = self.data['virtual_meter_buckets'].get(meter_id, {})
+        
+        readings = []
+        for hour_key in sorted(buckets):
+            if start_key <= hour_key <= end_key:
+                bucket = buckets[hour_key]
+                readings.append({
+                    "device_id": meter_id,
+                    "timestamp": f"{hour_key}:00:00",
+                    "voltage": 0.0,
+                    "current": 0.0,
+                    "power": round(bucket['average_power_w'], 2),
+                    "energy_consumed": round(bucket['energy_kwh'], 3),
+                    "temperature": 0.0,
+                    "humidity": 0.0,
+                    "virtual": True
+                })
+        return readings
+    
+    @read_locked('devices', 'readings')
+    def get_meter_energy(self, meter_id, hours=24):
+        """从小时桶汇总设备或虚拟电表最近一段时间的能耗(kWh)"""
+        start_key = (datetime.now() - timedelta(hours=hours)).strftime("%Y-%m-%d %H")
+        if meter_id in self._virtual_meters_by_id:
+            buckets = self.data['virtual_meter_buckets'].get(meter_id, {})
+        else:
+            buckets = self.data['hourly_rollups'].get(meter_id, {})
+        return round(sum(b['energy_kwh'] for key, b in buckets.items() if key >= start_key), 3)
+    
+    # ==================== 8. 部门成本归集 ====================
+    
+    def rebuild_budget_index(self):
+        """重建部门 -> 预算记录索引"""
+        self._budget_index = {b['department']: b for b in self.data['energy_budgets']}
+    
+    @write_locked('costs')
+    def set_department_budget(self, department, monthly_budget):
+        """设置部门月度预算"""
+        try:
+            budget = self._budget_index.get(department)
+            if budget is None:
+                budget = {
+                    "id": self.generate_id("BUDGET", "energy_budgets"),
+                    "department": department,
+                    "current_spending": 0.0,
+                    "created_date": self.get_current_date()
+                }
+                self.data['energy_budgets'].append(budget)
+                self._budget_index[department] = budget
+            
+            budget['monthly_budget'] = float(monthly_budget)
+            spending = self.get_department_spending(department)
+            if spending is not None:
+                budget['current_spending'] = spending
+            budget['remaining_budget'] = round(budget['monthly_budget'] - budget['current_spending'], 2)
+            
+            self.save_data()
+            return budget['id'], f"{department}部门预算已设置为 {monthly_budget} 元"
+            
+        except Exception as e:
+            return None, f"设置部门预算失败: {e}"
+    
+    @write_locked('devices', 'costs', reads=('readings',))
+    def assign_device_department(self, device_id, department):
+        """把设备归属到部门，此后其读数按电价计入部门成本
+        
+        设备本月已有读数的成本一并转入新部门；改归属时从原部门本月成本中扣除。
+        """
+        device = self.find_device_by_id(device_id)
+        if not device:
+            return False, "设备不存在"
+        
+        previous = device.get('department')
+        self.data['department_costs'].setdefault(department, {})
+        if previous != department:
+            month = self.get_current_date()[:7]
+            cost = 0.0
+            energy = 0.0
+            for reading in self.data['energy_readings']:
+                if reading['device_id'] == device_id and reading['timestamp'][:7] == month:
+                    cost += reading['energy_consumed'] * self.get_rate_at(reading['timestamp'])
+                    energy += reading['energy_consumed']
+            if energy:
+                if previous:
+                    self._adjust_department_cost(previous, month, -cost, -energy)
+                self._adjust_department_cost(department, month, cost, energy)
+        
+        device['department'] = department
+        self.save_data()
+        return True, f"设备 {device_id} 已归属到 {department}"
+    
+    def _adjust_department_cost(self, department, month, cost, energy):
+        """调整部门某月累计成本，并同步本月预算记录"""
+        totals = self.data['department_costs'].setdefault(department, {}).setdefault(
+            month, {"cost": 0.0, "energy_kwh": 0.0})
+        totals['cost'] = max(totals['cost'] + cost, 0.0)
+        totals['energy_kwh'] = max(totals['energy_kwh'] + energy, 0.0)
+        budget = self._budget_index.get(department)
+        if budget is not None and month == self.get_current_date()[:7]:
+            budget['current_spending'] = round(totals['cost'], 2)
+            budget['remaining_budget'] = round(budget['monthly_budget'] - totals['cost'], 2)
+    
+    def accumulate_department_cost(self, device, reading):
+        """按电价把读数能耗累加到部门本月成本，越过预算时立即告警"""
+        department = device.get('department')
+        if not department:
+            return
+        
+        month = reading['timestamp'][:7]
+        energy = reading['energy_consumed']
+        cost = energy * self.get_rate_at(reading['timestamp'])
+        
+        month_costs = self.data['department_costs'].setdefault(department, {})
+        totals = month_costs.get(month)
+        if totals is None:
+            totals = {"cost": 0.0, "energy_kwh": 0.0}
+            month_costs[month] = totals
+        previous = totals['cost']
+        totals['cost'] += cost
+        totals['energy_kwh'] += energy
+        
+        budget = self._budget_index.get(department)
+        if budget is None or month != self.get_current_date()[:7]:
+            return
+        
+        budget['current_spending'] = round(totals['cost'], 2)
+        budget['remaining_budget'] = round(budget['monthly_budget'] - totals['cost'], 2)
+        limit = budget['monthly_budget'] * self.alert_engine.cost_overrun_ratio
+        if previous <= limit < totals['cost'] and budget.get('overrun_alert_month') != month:
+            budget['overrun_alert_month'] = month
+            self.create_alert(
+                "BUDGET", "budget_overrun", "high",
+                f"{department}部门预算超支 {totals['cost'] - budget['monthly_budget']:.2f}元",
+                budget['monthly_budget'], round(totals['cost'], 2),
+                timestamp=reading['timestamp'], dedup_key=("BUDGET", "budget_overrun", department, month)
+            )
+    
+    @read_locked('costs')
+    def get_department_spending(self, department, month=None):
+        """获取部门某月累计电费，未接入自动归集时返回None"""
+        month_costs = self.data['department_costs'].get(department)
+        if month_costs is None:
+            return None
+        month = month or self.get_current_date()[:7]
+        return round(month_costs.get(month, {}).get('cost', 0.0), 2)
+    
+    # ==================== 9. 流式统计 ====================
+    
+    def update_device_statistics(self, reading):
+        """O(1) 更新设备功率的在线统计量"""
+        stats = self._device_stats.get(reading['device_id'])
+        if stats is None:
+            stats = DeviceStatistics(self.data['system_settings'].get('ewma_alpha', 0.1))
+            self._device_stats[reading['device_id']] = stats
+        stats.update(timestamp_to_epoch(reading['timestamp']), reading['power'])
+    
+    @read_locked('readings')
+    def get_device_statistics(self, device_id, window=None):
+        """获取设备功率统计
+        
+        window 为 None 时返回全量累计统计（含EWMA），
+        为 "hour" 或 "day" 时返回最近1小时/1天的滑动窗口统计。
+        """
+        stats = self._device_stats.get(device_id)
+        if stats is None:
+            return None, "该设备暂无统计数据"
+        
+        if window is None:
+            summary = stats.total.summary()
+        elif window in ('hour', 'day'):
+            now_epoch = timestamp_to_epoch(self.get_current_timestamp())
+            summary = getattr(stats, window).summary(now_epoch)
+        else:
+            return None, f"不支持的统计窗口: {window}"
+        
+        summary['device_id'] = device_id
+        summary['window'] = window or 'all'
+        return summary, "设备统计获取成功"
+    
+    @read_locked('readings')
+    def get_all_device_statistics(self, window=None):
+        """获取所有设备的功率统计，供实时看板使用"""
+        results = {}
+        for device_id in self._device_stats:
+            summary, _ = self.get_device_statistics(device_id, window)
+            results[device_id] = summary
+        return results
+    
+    # ==================== 10. 功率分位数 ====================
+    
+    def update_quantile_sketch(self, reading):
+        """把功率读数写入设备当前小时的分位数草图"""
+        device_id = reading['device_id']
+        hour_key = reading['timestamp'][:13]
+        
+        entry = self._open_sketches.get(device_id)
+        if entry is None or entry[0] != hour_key:
+            if entry is not None:
+                self.data['quantile_sketches'][device_id][entry[0]] = entry[1].to_dict()
+            sketches = self.data['quantile_sketches'].setdefault(device_id, {})
+            stored = sketches.get(hour_key)
+            entry = [hour_key, TDigest.from_dict(stored) if stored else TDigest()]
+            if stored is None:
+                # 先占位：合并和保存快照按已有的小时键取正在写入的草图，不在读取时增删键
+                sketches[hour_key] = entry[1].to_dict()
+            self._open_sketches[device_id] = entry
+        entry[1].add(reading['power'])
+    
+    def merge_power_sketches(self, device_ids, start_key, end_key):
+        """合并若干设备在 [start_key, end_key] 小时范围内的草图
+        
+        正在写入的小时直接并入内存中的草图，不回写数据集合；读方法可能并行调用，
+        并入时会压缩该草图，因此在 _sketch_lock 下进行。
+        """
+        merged = TDigest()
+        with self._sketch_lock:
+            for device_id in device_ids:
+                open_entry = self._open_sketches.get(device_id)
+                for hour_key, sketch in self.data['quantile_sketches'].get(device_id, {}).items():
+                    if start_key <= hour_key <= end_key:
+                        if open_entry is not None and open_entry[0] == hour_key:
+                            merged.merge(open_entry[1])
+                        else:
+                            merged.merge(TDigest.from_dict(sketch))
+        return merged
+    
+    def _summarize_sketch(self, digest, quantiles=(0.5, 0.95, 0.99)):
+        """把草图转换为分位数字典"""
+        summary = {f"p{round(q * 100, 1):g}": round(digest.quantile(q), 2) for q in quantiles}
+        summary['samples'] = int(digest.total_weight)
+        return summary
+    
+    @read_locked('devices', 'readings')
+    def get_power_percentiles(self, device_id=None, floor=None, start_time=None, end_time=None,
+                              quantiles=(0.5, 0.95, 0.99)):
+        """查询设备、楼层或全部设备在任意时间段内的功率分位数"""
+        try:
+            end_time = end_time or datetime.now()
+            start_time = start_time or end_time - timedelta(hours=24)
+            
+            if device_id:
+                device_ids = [device_id]
+            elif floor is not None:
+                device_ids = [d['id'] for d in self.data['devices'] if d.get('floor') == floor]
+            else:
+                device_ids = [d['id'] for d in self.data['devices']]
+            
+            digest = self.merge_power_sketches(
+                device_ids, start_time.strftime("%Y-%m-%d %H"), end_time.strftime("%Y-%m-%d %H")
+            )
+            if digest.total_weight == 0:
+                return None, "该时间段没有功率数据"
+            
+            return self._summarize_sketch(digest, quantiles), "功率分位数计算完成"
+            
+        except Exception as e:
+            return None, f"功率分位数计算失败: {e}"
+    
+    def build_percentile_section(self, start_key, end_key):
+        """生成报表中的功率分位数部分（按设备和楼层）"""
+        section = {'devices': [], 'floors': []}
+        floor_digests = {}
+        
+        for device in self.data['devices']:
+            digest = self.merge_power_sketches([device['id']], start_key, end_key)
+            if digest.total_weight == 0:
+                continue
+            
+            device_summary = self._summarize_sketch(digest)
+            device_summary['device_id'] = device['id']
+            device_summary['device_name'] = device['name']
+            section['devices'].append(device_summary)
+            
+            floor = device.get('floor', 1)
+            floor_digests.setdefault(floor, TDigest()).merge(digest)
+        
+        for floor in sorted(floor_digests, key=str):
+            floor_summary = self._summarize_sketch(floor_digests[floor])
+            floor_summary['floor'] = floor
+            section['floors'].append(floor_summary)
+        
+        return section
+    
+    # ==================== 11. 能耗积分 ====================
+    
+    def integrate_energy(self, device_id, timestamp, power, states=None):
+        """按实际时间戳对功率积分，返回 (本区间能耗kWh, 积分方式)
+        
+        每台设备只保留上一个采样点。相邻采样间隔超过 max_gap_minutes 视为数据缺口，
+        积分时长按上限截断；首个采样或乱序采样按一个监测周期估算。
+        states 缺省为实时积分游标 integrator_state，批量回填早于游标的历史数据时传入独立的状态字典。
+        """
+        settings = self.data['system_settings']
+        interval_hours = settings.get('monitoring_interval', 15) / 60
+        epoch = timestamp_to_epoch(timestamp)
+        
+        if states is None:
+            states = self.data['integrator_state']
+        state = states.get(device_id)
+        if state is None or epoch < state['epoch']:
+            if state is None:
+                states[device_id] = {"timestamp": timestamp, "epoch": epoch, "power": power}
+                return power * interval_hours / 1000, "nominal"
+            return power * interval_hours / 1000, "out_of_order"
+        
+        elapsed_hours = (epoch - state['epoch']) / 3600
+        max_gap_hours = settings.get('max_gap_minutes', 60) / 60
+        integration = "integrated"
+        if elapsed_hours > max_gap_hours:
+            elapsed_hours = max_gap_hours
+            integration = "gap_capped"
+        
+        if settings.get('integration_method', 'trapezoidal') == 'left_riemann':
+            energy = state['power'] * elapsed_hours / 1000
+        else:
+            energy = (state['power'] + power) / 2 * elapsed_hours / 1000
+        
+        state['timestamp'] = timestamp
+        state['epoch'] = epoch
+        state['power'] = power
+        return energy, integration
+    
+    # ==================== 12. 统计异常检测 ====================
+    
+    def create_anomaly_detector(self):
+        """按设置创建统计异常检测器"""
+        settings = self.data['system_settings'].get('anomaly_detection', {})
+        return AnomalyDetector(
+            alpha=settings.get('alpha', 0.05),
+            z_threshold=settings.get('z_threshold', 4.0),
+            warmup=settings.get('warmup', 30)
+        )
+    
+    def check_statistical_anomaly(self, reading):
+        """按设备基线对读数打分，偏离超过阈值时产生 statistical_anomaly 告警"""
+        if not self.data['system_settings'].get('anomaly_detection', {}).get('enabled', True):
+            return
+        
+        device_id = reading['device_id']
+        z_score, expected = self.anomaly_detector.score(
+            device_id, timestamp_to_epoch(reading['timestamp']), reading['power']
+        )
+        
+        if abs(z_score) > self.anomaly_detector.z_threshold:
+            self.create_alert(
+                device_id, "statistical_anomaly", "medium",
+                f"功率偏离基线: {reading['power']}W (基线 {expected:.0f}W, z={z_score:.1f})",
+                round(expected, 2), reading['power'],
+                timestamp=reading['timestamp']
+            )
+        elif (device_id, "statistical_anomaly") in self._open_alerts:
+            self._close_alert((device_id, "statistical_anomaly"), reading['timestamp'])
+    
+    @read_locked('settings', 'readings')
+    def scan_historical_anomalies(self, readings=None, z_threshold=None):
+        """用全新的检测器批量扫描历史读数，返回异常读数列表（不改变在线状态、不产生告警）"""
+        readings = self.data['energy_readings'] if readings is None else readings
+        readings = sorted(readings, key=lambda r: r['timestamp'])
+        detector = self.create_anomaly_detector()
+        threshold = z_threshold or detector.z_threshold
+        
+        scores = detector.score_batch(
+            [r['device_id'] for r in readings],
+            [timestamp_to_epoch(r['timestamp']) for r in readings],
+            [r['power'] for r in readings]
+        )
+        return [
+            {'reading_id': r.get('id'), 'device_id': r['device_id'], 'timestamp': r['timestamp'],
+             'power': r['power'], 'z_score': round(z, 2)}
+            for r, z in zip(readings, scores) if abs(z) > threshold
+        ]
+    
+    # ==================== 13. 历史告警回填 ====================
+    
+    @write_locked('alerts', reads=('settings', 'devices', 'readings'))
+    def backfill_alerts(self, by='device', workers=None, progress=None, checkpoint_file=None):
+        """按当前告警规则并行重新评估全部历史读数
+        
+        by 为 'device' 或 'month'；progress(已完成, 总数, 分区键) 用于进度报告；
+        中断后重跑会从断点文件跳过已完成的分区。
+        """
+        try:
+            summary, msg = run_alert_backfill(self, by, workers, checkpoint_file, progress)
+            if summary:
+                self.save_data()
+            return summary, msg
+            
+        except Exception as e:
+            return None, f"历史告警回填失败: {e}"
+    
+    def merge_backfill_alerts(self, episodes):
+        """把回填得到的告警事件去重写入告警列表，返回 (新增数, 合并数)"""
+        all_alerts = self.data['alerts'] + [a for alerts in self.data['alert_archive'].values() for a in alerts]
+        existing = {(a['device_id'], a['type'], a['timestamp']): a for a in all_alerts}
+        created = 0
+        merged = 0
+        
+        for episode in sorted(episodes, key=lambda e: e['start']):
+            key = (episode['device_id'], episode['type'])
+            alert = existing.get((episode['device_id'], episode['type'], episode['start']))
+            if alert is None:
+                open_alert = self._open_alerts.get(key)
+                if open_alert and open_alert['timestamp'] <= episode['end'] \
+                        and open_alert.get('last_seen', open_alert['timestamp']) >= episode['start']:
+                    alert = open_alert
+            
+            if alert is not None:
+                # 与已有告警重叠，合并次数和时间范围
+                alert['count'] = max(alert.get('count', 1), episode['count'])
+                alert['last_seen'] = max(alert.get('last_seen', alert['timestamp']), episode['end'])
+                merged += 1
+                continue
+            
+            state = self.data['integrator_state'].get(episode['device_id'])
+            ongoing = state is not None and state['timestamp'] == episode['end'] and key not in self._open_alerts
+            alert = {
+                "id": self.next_alert_id(),
+                "device_id": episode['device_id'],
+                "type": episode['type'],
+                "severity": episode['severity'],
+                "message": episode['message'],
+                "threshold_value": episode['threshold_value'],
+                "actual_value": episode['actual_value'],
+                "timestamp": episode['start'],
+                "last_seen": episode['end'],
+                "count": episode['count'],
+                "status": "active" if ongoing else "resolved",
+                "acknowledged": False,
+                "source": "backfill"
+            }
+            if ongoing:
+                self._open_alerts[key] = alert
+            else:
+                alert['resolved_time'] = episode['end']
+            
+            self.data['alerts'].append(alert)
+            self._index_alert(alert)
+            existing[(alert['device_id'], alert['type'], alert['timestamp'])] = alert
+            created += 1
+        
+        return created, merged
+    
+    # ==================== 14. 季节性预测 ====================
+    
+    def create_forecaster(self):
+        """按设置创建季节性预测器"""
+        settings = self.data['system_settings'].get('forecasting', {})
+        return SeasonalForecaster(
+            alpha=settings.get('alpha', 0.2),
+            beta=settings.get('beta', 0.01),
+            gamma=settings.get('gamma', 0.3),
+            phi=settings.get('phi', 0.98)
+        )
+    
+    def _forecast_hours(self, start_time, hours):
+        """预测起点的小时序号及逐小时的时间键"""
+        start = (start_time or datetime.now()).replace(minute=0, second=0, microsecond=0)
+        keys = [(start + timedelta(hours=i)).strftime("%Y-%m-%d %H") for i in range(hours)]
+        return hour_key_to_index(keys[0]), keys
+    
+    def _open_forecast_hour(self, device_id):
+        """设备尚未结束的当前小时 (小时序号, 平均功率)，用于让预测包含最新数据"""
+        state = self.forecaster.states.get(device_id)
+        if state is None or state.pending_hour is None:
+            return None
+        rollup = self.data['hourly_rollups'].get(device_id, {}).get(state.pending_hour)
+        if not rollup:
+            return None
+        return hour_key_to_index(state.pending_hour), rollup['power_sum'] / rollup['count']
+    
+    @read_locked('settings', 'devices', 'readings')
+    def forecast_device_power(self, device_id, hours=24, start_time=None, confidence=0.95, as_of=None):
+        """预测设备未来逐小时平均功率及预测区间，没有数据时返回 None
+        
+        as_of 指定时按该时刻之前的小时汇总重建状态，预测默认从 as_of 所在小时开始。
+        返回 {'hours': [小时键], 'power_w': [...], 'lower_w': [...], 'upper_w': [...]}。
+        """
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        if as_of is None:
+            start_index, keys = self._forecast_hours(start_time, hours)
+            result = self._forecast_window(device_id, start_index, len(keys), z)
+        else:
+            as_of = self.parse_as_of(as_of)
+            start_index, keys = self._forecast_hours(start_time or as_of, hours)
+            result = self._forecaster_as_of(device_id, as_of).forecast(device_id, start_index, len(keys), z)
+        if result is None:
+            return None
+        mean, lower, upper = result
+        return {'hours': keys, 'power_w': mean.tolist(), 'lower_w': lower.tolist(), 'upper_w': upper.tolist()}
+    
+    def _forecaster_as_of(self, device_id, as_of):
+        """只用 as_of 所在小时之前的小时汇总重建一个预测器"""
+        forecaster = self.create_forecaster()
+        state = forecaster.states[device_id] = DeviceForecastState()
+        cutoff = as_of.strftime("%Y-%m-%d %H")
+        rollups = self.data['hourly_rollups'].get(device_id, {})
+        for hour_key in sorted(key for key in rollups if key < cutoff):
+            rollup = rollups[hour_key]
+            forecaster.observe(state, hour_key_to_index(hour_key), rollup['power_sum'] / rollup['count'])
+        return forecaster
+    
+    def _forecast_window(self, device_id, start_index, hours, z):
+        """调用预测器，并把当前未结束的小时一并纳入"""
+        return self.forecaster.forecast(device_id, start_index, hours, z, self._open_forecast_hour(device_id))
+    
+    @read_locked('devices', 'readings')
+    def forecast_all_devices(self, hours=168, start_time=None, confidence=0.95):
+        """预测所有设备未来逐小时能耗
+        
+        返回 ({'hours': [小时键], 'devices': {设备ID: {energy_kwh, lower_kwh, upper_kwh, total_kwh}}}, 消息)。
+        每小时平均功率(W)折算为该小时能耗(kWh)。
+        """
+        try:
+            start_index, keys = self._forecast_hours(start_time, hours)
+            z = NormalDist().inv_cdf((1 + confidence) / 2)
+            devices = {}
+            for device in self.data['devices']:
+                result = self._forecast_window(device['id'], start_index, hours, z)
+                if result is None:
+                    continue
+                mean, lower, upper = (values / 1000 for values in result)
+                devices[device['id']] = {
+                    'energy_kwh': mean.tolist(),
+                    'lower_kwh': lower.tolist(),
+                    'upper_kwh': upper.tolist(),
+                    'total_kwh': round(float(mean.sum()), 3)
+                }
+            return {'hours': keys, 'devices': devices}, f"已预测{len(devices)}台设备未来{hours}小时能耗"
+            
+        except Exception as e:
+            return None, f"能耗预测失败: {e}"
+    
+    # ==================== 15. 温度回归预测 ====================
+    
+    @read_locked('readings')
+    def get_temperature_sensitivity(self, device_id):
+        """设备功率对温度的敏感度（W/°C），样本不足时返回 None"""
+        coefficients = self.temperature_model.coefficients(device_id)
+        if coefficients is None:
+            return None
+        return {
+            'temperature_w_per_degree': round(float(coefficients[-3]), 3),
+            'heating_w_per_degree': round(float(coefficients[-2]), 3),
+            'cooling_w_per_degree': round(float(coefficients[-1]), 3)
+        }
+    
+    @read_locked('devices', 'readings')
+    def forecast_with_temperature(self, device_id, temperature_outlook, start_time=None, confidence=0.95):
+        """按温度预报预测设备逐小时功率
+        
+        temperature_outlook 为逐小时温度列表（从 start_time 所在小时起，长度即预测小时数），
+        或 {"YYYY-MM-DD HH": 温度} 字典。
+        """
+        try:
+            if isinstance(temperature_outlook, dict):
+                keys = sorted(temperature_outlook)
+                temperatures = [temperature_outlook[key] for key in keys]
+                indexes = [hour_key_to_index(key) for key in keys]
+            else:
+                temperatures = list(temperature_outlook)
+                start_index, keys = self._forecast_hours(start_time, len(temperatures))
+                indexes = [start_index + i for i in range(len(keys))]
+            if not temperatures:
+                return None, "温度预报为空"
+            
+            power = self.temperature_model.predict(device_id, indexes, temperatures)
+            if power is None:
+                return None, "数据不足，无法进行温度回归预测"
+            
+            spread = NormalDist().inv_cdf((1 + confidence) / 2) * self.temperature_model.residual_std(device_id)
+            forecast = {
+                'device_id': device_id,
+                'hours': keys,
+                'temperature': temperatures,
+                'power_w': [round(p, 2) for p in power.tolist()],
+                'lower_w': [round(max(p - spread, 0.0), 2) for p in power.tolist()],
+                'upper_w': [round(p + spread, 2) for p in power.tolist()],
+                'predicted_energy_kwh': round(float(power.sum()) / 1000, 3),
+                'confidence': confidence,
+                'sensitivity': self.get_temperature_sensitivity(device_id)
+            }
+            return forecast, "温度回归预测完成"
+            
+        except Exception as e:
+            return None, f"温度回归预测失败: {e}"
+    
+    # ==================== 16. 预测回测 ====================
+    
+    @read_locked('devices', 'readings')
+    def backtest_forecasters(self, horizon=24, step=24, min_train=168, device_ids=None, workers=None):
+        """对内置预测器做滚动起点回测，返回 (汇总指标, 消息)，见 backtesting.run_backtest"""
+        try:
+            return run_backtest(self, horizon=horizon, step=step, min_train=min_train,
+                                device_ids=device_ids, workers=workers)
+        except Exception as e:
+            return None, f"预测回测失败: {e}"
+    
+    # ==================== 17. 节能量测量与验证 ====================
+    
+    def update_daily_rollup(self, reading):
+        """按日增量汇总能耗和温度，供节能量测量使用"""
+        device_rollups = self.data['daily_rollups'].setdefault(reading['device_id'], {})
+        rollup = device_rollups.get(reading['timestamp'][:10])
+        if rollup is None:
+            rollup = {"energy_kwh": 0.0, "temperature_sum": 0.0, "count": 0}
+            device_rollups[reading['timestamp'][:10]] = rollup
+        rollup['energy_kwh'] += reading['energy_consumed']
+        rollup['temperature_sum'] += reading['temperature']
+        rollup['count'] += 1
+    
+    def build_daily_rollups(self):
+        """由小时汇总生成日汇总（旧数据文件升级时使用）"""
+        daily_rollups = {}
+        for device_id, hourly in self.data['hourly_rollups'].items():
+            device_rollups = daily_rollups.setdefault(device_id, {})
+            for hour_key, hour in hourly.items():
+                rollup = device_rollups.setdefault(hour_key[:10], {"energy_kwh": 0.0, "temperature_sum": 0.0,
+                                                                   "count": 0})
+                rollup['energy_kwh'] += hour['energy_kwh']
+                rollup['temperature_sum'] += hour['temperature_sum']
+                rollup['count'] += hour['count']
+        return daily_rollups
+    
+    def _daily_series(self, device_id, start_date, days):
+        """取连续 days 天中有数据的日汇总，返回 (日能耗数组, 日均温度数组)"""
+        rollups = self.data['daily_rollups'].get(device_id, {})
+        energy = []
+        temperature = []
+        for offset in range(days):
+            rollup = rollups.get((start_date + timedelta(days=offset)).strftime("%Y-%m-%d"))
+            if rollup and rollup['count']:
+                energy.append(rollup['energy_kwh'])
+                temperature.append(rollup['temperature_sum'] / rollup['count'])
+        return np.asarray(energy), np.asarray(temperature)
+    
+    @staticmethod
+    def _degree_day_design(temperature):
+        """日均温度 -> [1, 采暖度日, 制冷度日] 设计矩阵"""
+        return np.column_stack([np.ones(len(temperature)),
+                                np.maximum(HEATING_BASE - temperature, 0.0),
+                                np.maximum(temperature - COOLING_BASE, 0.0)])
+    
+    def measure_savings(self, rec, baseline_days=14, reporting_days=7, weather_normalized=False, today=None):
+        """按实施日期前后的日汇总计算节能量，任一时期没有数据时返回 None
+        
+        天气归一化：在基准期拟合 日能耗 = a + b·采暖度日 + c·制冷度日（只保留有变化的度日项），
+        再用报告期的实际温度推算"未实施时"的日能耗作为调整后基准。
+        """
+        implementation_date = datetime.strptime(rec['implementation_date'], "%Y-%m-%d")
+        today = today or datetime.now()
+        reporting_start = implementation_date + timedelta(days=1)
+        reporting_days = max(min(reporting_days, (today - reporting_start).days + 1), 0)
+        
+        baseline_energy, baseline_temperature = self._daily_series(
+            rec['device_id'], implementation_date - timedelta(days=baseline_days), baseline_days)
+        reporting_energy, reporting_temperature = self._daily_series(
+            rec['device_id'], reporting_start, reporting_days)
+        if not len(baseline_energy) or not len(reporting_energy):
+            return None
+        
+        baseline_daily = float(baseline_energy.mean())
+        normalized = False
+        if weather_normalized:
+            design = self._degree_day_design(baseline_temperature)
+            columns = [0] + [i for i in (1, 2) if design[:, i].any()]
+            if len(baseline_energy) >= len(columns) + 2:
+                coefficients = np.linalg.lstsq(design[:, columns], baseline_energy, rcond=None)[0]
+                adjusted = self._degree_day_design(reporting_temperature)[:, columns] @ coefficients
+                baseline_daily = float(adjusted.mean())
+                normalized = True
+        
+        current_daily = float(reporting_energy.mean())
+        energy_saved = baseline_daily - current_daily
+        savings_percentage = (energy_saved / baseline_daily * 100) if baseline_daily > 0 else 0
+        return {
+            'recommendation_id': rec['id'],
+            'device_id': rec['device_id'],
+            'implementation_date': rec['implementation_date'],
+            'baseline_days': len(baseline_energy),
+            'reporting_days': len(reporting_energy),
+            'weather_normalized': normalized,
+            'baseline_daily_consumption': round(baseline_daily, 3),
+            'current_daily_consumption': round(current_daily, 3),
+            'daily_energy_saved': round(energy_saved, 3),
+            'total_energy_saved': round(energy_saved * len(reporting_energy), 3),
+            'savings_percentage': round(savings_percentage, 2),
+            'measurement_date': today.strftime("%Y-%m-%d")
+        }
+    
+    @read_locked('readings', 'recommendations')
+    def summarize_fleet_savings(self, baseline_days=14, reporting_days=7, weather_normalized=False):
+        """汇总所有已实施建议的节能效果，返回 (汇总, 消息)"""
+        try:
+            today = datetime.now()
+            measured = []
+            unmeasured = []
+            by_type = {}
+            for rec in self.data['recommendations']:
+                if rec['status'] != 'implemented' or 'implementation_date' not in rec:
+                    continue
+                record = self.measure_savings(rec, baseline_days, reporting_days, weather_normalized, today)
+                if record is None:
+                    unmeasured.append(rec['id'])
+                    continue
+                measured.append(record)
+                group = by_type.setdefault(rec['type'], {'count': 0, 'daily_energy_saved': 0.0,
+                                                         'total_energy_saved': 0.0})
+                group['count'] += 1
+                group['daily_energy_saved'] += record['daily_energy_saved']
+                group['total_energy_saved'] += record['total_energy_saved']
+            
+            baseline_total = sum(r['baseline_daily_consumption'] for r in measured)
+            daily_saved = sum(r['daily_energy_saved'] for r in measured)
+            for group in by_type.values():
+                group['daily_energy_saved'] = round(group['daily_energy_saved'], 3)
+                group['total_energy_saved'] = round(group['total_energy_saved'], 3)
+            summary = {
+                'measured_count': len(measured),
+                'unmeasured': unmeasured,
+                'daily_energy_saved': round(daily_saved, 3),
+                'total_energy_saved': round(sum(r['total_energy_saved'] for r in measured), 3),
+                'savings_percentage': round(daily_saved / baseline_total * 100, 2) if baseline_total > 0 else 0,
+                'by_type': by_type,
+                'records': measured
+            }
+            return summary, f"已测量{len(measured)}条已实施建议的节能效果"
+            
+        except Exception as e:
+            return None, f"节能效果汇总失败: {e}"
+    
+    # ==================== 18. 负荷转移调度 ====================
+    
+    @write_locked('recommendations', reads=('devices', 'costs'))
+    def optimize_load_schedule(self, loads, site_cap_kw=None, slot_minutes=15, create_recommendations=True):
+        """按分时电价为可调度负荷安排运行时段
+        
+        loads: [{'device_id', 'energy_kwh', 'power_kw'(默认额定功率), 'windows': [("HH:MM", "HH:MM")],
+                 'contiguous': 是否必须连续运行, 'baseline_start': 当前开机时刻"HH:MM"}]
+        节省金额为正的负荷会生成或更新 schedule_optimization 建议。返回 (汇总, 消息)。
+        """
+        try:
+            if 1440 % slot_minutes:
+                return None, "时段分辨率必须能整除一天的分钟数"
+            
+            prepared = []
+            for load in loads:
+                device = self.find_device_by_id(load['device_id'])
+                if not device:
+                    return None, f"设备不存在: {load['device_id']}"
+                load = dict(load)
+                load.setdefault('power_kw', device['rated_power'] / 1000)
+                if load['power_kw'] <= 0 or load['energy_kwh'] <= 0:
+                    return None, f"设备 {device['id']} 的功率上限和运行电量必须大于0"
+                prepared.append(load)
+            
+            prices = slot_prices(self._tariff_table or self.compile_tariff(), slot_minutes)
+            results, unserved = optimize_schedule(prepared, prices, site_cap_kw, slot_minutes)
+            
+            if create_recommendations:
+                for result in results:
+                    if result['savings'] <= 0.005:
+                        continue
+                    device = self.find_device_by_id(result['device_id'])
+                    percentage = result['savings'] / result['baseline_cost'] * 100 if result['baseline_cost'] else 0
+                    runs = "、".join(f"{start}-{end}" for start, end, _ in result['schedule'])
+                    rec_id, _ = self.upsert_recommendation(
+                        device['id'], "schedule_optimization", "high" if percentage >= 20 else "medium",
+                        f"建议将{device['name']}的运行时段调整为 {runs}，每日可节省电费{result['savings']:.2f}元",
+                        f"每日节省{result['savings']:.2f}元({percentage:.1f}%)", 0.0, "立即生效"
+                    )
+                    rec = self.find_recommendation_by_id(rec_id)
+                    rec['schedule'] = result['schedule']
+                    rec['daily_cost_savings'] = result['savings']
+                    result['recommendation_id'] = rec_id
+                self.save_data()
+            
+            baseline_cost = sum(r['baseline_cost'] for r in results)
+            optimized_cost = sum(r['optimized_cost'] for r in results)
+            summary = {
+                'loads': results,
+                'baseline_cost': round(baseline_cost, 2),
+                'optimized_cost': round(optimized_cost, 2),
+                'savings': round(sum(r['savings'] for r in results), 2),
+                'unserved_kwh': unserved,
+                'slot_minutes': slot_minutes
+            }
+            message = f"调度优化完成: {len(results)}个负荷，每日可节省{summary['savings']:.2f}元"
+            if unserved:
+                message += f"，{unserved} kWh 无法在允许时段内安排"
+            return summary, message
+            
+        except Exception as e:
+            return None, f"调度优化失败: {e}"
+    
+    # ==================== 19. 轮询采集 ====================
+    
+    @write_locked('devices')
+    def assign_collector_point(self, device_id, driver="simulated_modbus", **options):
+        """为设备配置轮询采集驱动，options 为驱动参数（如 unit_id、host）"""
+        device = self.find_device_by_id(device_id)
+        if not device:
+            return False, "设备不存在"
+        
+        device['collector'] = dict(options, driver=driver)
+        self.save_data()
+        return True, f"设备 {device_id} 已配置采集驱动 {driver}"
+    
+    @read_locked('devices')
+    def get_collector_points(self):
+        """已配置采集驱动的在线设备列表"""
+        return [
+            dict(device['collector'], device_id=device['id'], rated_power=device.get('rated_power'))
+            for device in self.data['devices']
+            if device.get('collector') and device.get('status', 'online') == 'online'
+        ]
+    
+    # ==================== 20. 性能剖析 ====================
+    
+    def enable_instrumentation(self, methods=None):
+        """为公开方法开启计时统计，methods 缺省为全部可计时方法"""
+        if self.instrumentation is None:
+            self.instrumentation = Instrumentation(self)
+        count = self.instrumentation.enable(methods)
+        return count, f"已开启 {count} 个方法的性能计时"
+    
+    def disable_instrumentation(self):
+        """关闭计时并恢复原方法，已收集的统计保留"""
+        if self.instrumentation is None or not self.instrumentation.enabled:
+            return False, "性能计时未开启"
+        self.instrumentation.disable()
+        return True, "已关闭性能计时"
+    
+    def get_method_latency(self, sort_by='total_ms', limit=None):
+        """按累计耗时降序的方法调用统计（热点方法）"""
+        if self.instrumentation is None:
+            return []
+        return self.instrumentation.hot_spots(sort_by, limit)
+    
+    def profile_method(self, method_name, *args, **kwargs):
+        """用 cProfile 和 tracemalloc 剖析一次方法调用，返回 (剖析报告, 消息)"""
+        method = getattr(self, method_name, None)
+        if method_name.startswith('_') or not callable(method):
+            return None, f"方法不存在: {method_name}"
+        
+        result, report = profile_call(method, args, kwargs)
+        report['method'] = method_name
+        report['result'] = result
+        return report, f"{method_name} 耗时 {report['elapsed_ms']:.1f}ms，函数调用 {report['function_calls']} 次"
+    
     def get_all_devices(self):
         """获取所有设备列表"""
         return self.data['devices']
     
+    def get_all_virtual_meters(self):
+        """获取所有虚拟电表"""
+        return self.data['virtual_meters']
+    
+    def get_all_meters(self):
+        """获取所有设备和虚拟电表"""
+        return self.data['devices'] + self.data['virtual_meters']
+    
+    @read_locked('alerts')
     def get_all_alerts(self, status=None):
-        """获取所有告警"""
+        """获取所有告警（不含已归档）"""
         if status:
-            return [alert for alert in self.data['alerts'] if alert['status'] == status]
+            return list(self._alerts_by_status.get(status, {}).values())
         return self.data['alerts']
     
+    @read_locked('alerts')
+    def get_device_alerts(self, device_id):
+        """获取设备的告警（不含已归档）"""
+        return self._alerts_by_device.get(device_id, [])
+    
+    @read_locked('alerts')
+    def get_alerts_by_day(self, date_str):
+        """获取某天触发的告警（不含已归档）"""
+        return self._alerts_by_day.get(date_str, [])
+    
+    @read_locked('alerts')
+    def get_archived_alerts(self, month=None):
+        """获取已归档告警，month 为 "YYYY-MM" 时只返回该分区"""
+        if month:
+            return self.data['alert_archive'].get(month, [])
+        return [alert for key in sorted(self.data['alert_archive']) for alert in self.data['alert_archive'][key]]
+    
+    @read_locked('recommendations')
     def get_all_recommendations(self, status=None):
         """获取所有建议"""
         if status:
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能能耗管理系统 - 能耗预测
+SeasonalForecaster：每台设备保存 Holt-Winters 风格的状态（水平、阻尼趋势和168个"一周中的小时"季节项），
+每个整点小时汇总完成后增量更新一次，无需重新拟合；按任意时长生成逐小时功率及预测区间。
+TemperatureRegression：按小时、星期、温度和度时特征的最小二乘回归，可按温度预报预测。
+"""
+
+import numpy as np
+
+from anomaly_detection import HOURS_PER_WEEK, hour_of_week
+from streaming_stats import timestamp_to_epoch
+
+
+def hour_key_to_index(hour_key):
+    """ "YYYY-MM-DD HH" -> 自1970年起的小时序号"""
+    return timestamp_to_epoch(hour_key + ":00:00") // 3600
+
+
+class DeviceForecastState:
+    """单台设备的预测状态"""
+
+    __slots__ = ('count', 'level', 'trend', 'variance', 'last_index', 'pending_hour',
+                 'seasonal', 'seasonal_count')
+
+    def __init__(self):
+        self.count = 0
+        self.level = 0.0
+        self.trend = 0.0
+        self.variance = 0.0
+        self.last_index = None
+        self.pending_hour = None
+        self.seasonal = [0.0] * HOURS_PER_WEEK
+        self.seasonal_count = [0] * HOURS_PER_WEEK
+
+    def to_dict(self):
+        """序列化为可写入JSON的字典（列表为副本，可在锁外编码）"""
+        return {'count': self.count, 'level': self.level, 'trend': self.trend, 'variance': self.variance,
+                'last_index': self.last_index, 'pending_hour': self.pending_hour,
+                'seasonal': list(self.seasonal), 'seasonal_count': list(self.seasonal_count)}
+
+    @classmethod
+    def from_dict(cls, data):
+        """从字典恢复"""
+        state = cls()
+        state.count = data['count']
+        state.level = data['level']
+        state.trend = data['trend']
+        state.variance = data['variance']
+        state.last_index = data['last_index']
+        state.pending_hour = data['pending_hour']
+        state.seasonal = data['seasonal']
+        state.seasonal_count = data['seasonal_count']
+        return state
+
+    def copy(self):
+        """复制状态（用于把未完成的小时临时并入预测）"""
+        return DeviceForecastState.from_dict({
+            'count': self.count, 'level': self.level, 'trend': self.trend, 'variance': self.variance,
+            'last_index': self.last_index, 'pending_hour': self.pending_hour,
+            'seasonal': list(self.seasonal), 'seasonal_count': list(self.seasonal_count)
+        })
+
+
+class SeasonalForecaster:
+    """加法 Holt-Winters 预测器，季节周期为一周168小时
+
+    alpha/beta/gamma 为水平、趋势、季节项的平滑系数，phi 为趋势阻尼，
+    variance_alpha 为一步预测误差方差的平滑系数。观测值为小时平均功率(W)。
+    """
+
+    def __init__(self, alpha=0.2, beta=0.01, gamma=0.3, phi=0.98, variance_alpha=0.05):
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.phi = phi
+        self.variance_alpha = variance_alpha
+        self.states = {}
+
+    # ---------- 增量更新 ----------
+
+    def on_new_hour(self, device_id, hour_key, rollups):
+        """设备出现新的小时汇总时调用：上一个未完成的小时已经结束，用它更新状态
+
+        乱序到达的旧小时读数只进入汇总，不回溯修改预测状态。
+        """
+        state = self.states.get(device_id)
+        if state is None:
+            state = self.states[device_id] = DeviceForecastState()
+        pending = state.pending_hour
+        if pending is not None and hour_key <= pending:
+            return
+        if pending is not None and pending in rollups:
+            rollup = rollups[pending]
+            self.observe(state, hour_key_to_index(pending), rollup['power_sum'] / rollup['count'])
+        state.pending_hour = hour_key
+
+    def replay(self, device_id, rollups):
+        """从已有的小时汇总重建设备状态（旧数据文件升级时使用）"""
+        state = self.states[device_id] = DeviceForecastState()
+        for hour_key in sorted(rollups):
+            self.on_new_hour(device_id, hour_key, rollups)
+        return state
+
+    def observe(self, state, hour_index, power):
+        """用一个小时的平均功率更新水平、趋势和季节项"""
+        slot = hour_of_week(hour_index * 3600)
+        if state.count == 0:
+            state.level = power
+            state.seasonal_count[slot] = 1
+            state.count = 1
+            state.last_index = hour_index
+            return
+
+        steps = max(hour_index - state.last_index, 1)
+        damped = sum(self.phi ** i for i in range(1, min(steps, 200) + 1))
+        level_forecast = state.level + damped * state.trend
+        if state.seasonal_count[slot] == 0:
+            # 首次见到该时段，直接以偏差作为季节项初值
+            state.seasonal[slot] = power - level_forecast
+        season = state.seasonal[slot]
+
+        error = power - (level_forecast + season)
+        state.variance = ((1 - self.variance_alpha) * state.variance + self.variance_alpha * error * error
+                          if state.count > 1 else error * error)
+
+        level = self.alpha * (power - season) + (1 - self.alpha) * level_forecast
+        state.trend = self.beta * (level - state.level) / steps + (1 - self.beta) * self.phi ** steps * state.trend
+        state.seasonal[slot] = self.gamma * (power - level) + (1 - self.gamma) * season
+        state.level = level
+        state.seasonal_count[slot] += 1
+        state.count += 1
+        state.last_index = hour_index
+
+    # ---------- 预测 ----------
+
+    def forecast(self, device_id, start_index, hours, z=1.96, open_hour=None):
+        """从小时序号 start_index 起预测 hours 个小时的平均功率
+
+        open_hour 为 (小时序号, 平均功率)，表示尚未结束的当前小时，临时并入状态后再预测。
+        返回 (均值, 下限, 上限) 三个 ndarray；设备没有任何数据时返回 None。
+        """
+        state = self.states.get(device_id)
+        if open_hour is not None:
+            state = state.copy() if state is not None else DeviceForecastState()
+            if state.last_index is None or open_hour[0] > state.last_index:
+                self.observe(state, *open_hour)
+        if state is None or state.count == 0:
+            return None
+
+        steps = start_index - state.last_index + np.arange(hours)
+        steps = np.maximum(steps, 1)
+        if self.phi == 1:
+            damped = steps.astype(float)
+        else:
+            damped = self.phi * (1 - self.phi ** steps) / (1 - self.phi)
+        slots = hour_of_week((state.last_index + steps) * 3600)
+        seasonal = np.asarray(state.seasonal)[slots]
+        mean = np.maximum(state.level + damped * state.trend + seasonal, 0.0)
+
+        sigma = max(np.sqrt(state.variance), 0.05 * abs(state.level), 1.0)
+        spread = z * sigma * np.sqrt(1 + (steps - 1) * self.alpha ** 2)
+        return mean, np.maximum(mean - spread, 0.0), mean + spread
+
+    def to_dict(self):
+        """序列化所有设备状态"""
+        return {device_id: state.to_dict() for device_id, state in self.states.items()}
+
+    def load_states(self, data):
+        """恢复设备状态"""
+        self.states = {device_id: DeviceForecastState.from_dict(state) for device_id, state in data.items()}
+
+
+HEATING_BASE = 15.0
+COOLING_BASE = 22.0
+FEATURE_COUNT = 1 + 23 + 6 + 3
+_UPPER = np.triu_indices(FEATURE_COUNT)
+
+
+def regression_features(hour_indexes, temperatures):
+    """构造回归特征矩阵
+
+    列依次为：截距、1-23 点的小时哑变量（0 点为基准）、周二至周日的哑变量（周一为基准）、
+    温度、采暖度时 max(15-T, 0)、制冷度时 max(T-22, 0)。
+    小时用哑变量而不是低阶傅里叶项：上下班形成的阶跃负荷用少数谐波拟合不了，
+    残差会与白天偏高的温度相关，被错算进温度系数。
+    """
+    hour_indexes = np.asarray(hour_indexes)
+    temperatures = np.asarray(temperatures, dtype=float)
+    rows = len(hour_indexes)
+    features = np.empty((rows, FEATURE_COUNT))
+    features[:, 0] = 1.0
+
+    hour_of_day = hour_indexes % 24
+    for hour in range(1, 24):
+        features[:, hour] = hour_of_day == hour
+
+    weekday = (hour_indexes // 24 + 3) % 7
+    column = 24
+    for day in range(1, 7):
+        features[:, column + day - 1] = weekday == day
+
+    column += 6
+    features[:, column] = temperatures
+    features[:, column + 1] = np.maximum(HEATING_BASE - temperatures, 0.0)
+    features[:, column + 2] = np.maximum(temperatures - COOLING_BASE, 0.0)
+    return features
+
+
+class DeviceRegressionState:
+    """单台设备的回归状态：累积的 XᵀX / Xᵀy / yᵀy 和缓存的系数"""
+
+    __slots__ = ('count', 'xtx', 'xty', 'yty', 'pending_hour', 'coefficients')
+
+    def __init__(self):
+        self.count = 0
+        self.xtx = np.zeros((FEATURE_COUNT, FEATURE_COUNT))
+        self.xty = np.zeros(FEATURE_COUNT)
+        self.yty = 0.0
+        self.pending_hour = None
+        self.coefficients = None
+
+    def to_dict(self):
+        """序列化为可写入JSON的字典，XᵀX 对称只保存上三角"""
+        return {'count': self.count, 'xtx': self.xtx[_UPPER].tolist(),
+                'xty': self.xty.tolist(), 'yty': self.yty, 'pending_hour': self.pending_hour}
+
+    @classmethod
+    def from_dict(cls, data):
+        """从字典恢复"""
+        state = cls()
+        state.count = data['count']
+        state.xtx[_UPPER] = data['xtx']
+        state.xtx.T[_UPPER] = data['xtx']
+        state.xty = np.asarray(data['xty'], dtype=float)
+        state.yty = data['yty']
+        state.pending_hour = data['pending_hour']
+        return state
+
+
+class TemperatureRegression:
+    """按设备的温度回归预测模型
+
+    每个整点小时结束后把 (特征, 小时平均功率) 累加进 XᵀX 和 Xᵀy，
+    旧样本按 decay 衰减以适应季节变化。系数在需要时用最小二乘求解并缓存，
+    预测只是一次矩阵乘法。
+    """
+
+    def __init__(self, decay=0.999, ridge=1e-3, min_samples=2 * FEATURE_COUNT):
+        self.decay = decay
+        self.ridge = ridge
+        self.min_samples = min_samples
+        self.states = {}
+
+    def on_new_hour(self, device_id, hour_key, rollups):
+        """设备出现新的小时汇总时，用刚结束的上一个小时更新累积量"""
+        state = self.states.get(device_id)
+        if state is None:
+            state = self.states[device_id] = DeviceRegressionState()
+        pending = state.pending_hour
+        if pending is not None and hour_key <= pending:
+            return
+        if pending is not None and pending in rollups:
+            rollup = rollups[pending]
+            self.observe(state, [hour_key_to_index(pending)],
+                         [rollup['temperature_sum'] / rollup['count']],
+                         [rollup['power_sum'] / rollup['count']])
+        state.pending_hour = hour_key
+
+    def replay(self, device_id, rollups):
+        """从已有的小时汇总一次性累积（最后一个小时视为未结束）"""
+        state = self.states[device_id] = DeviceRegressionState()
+        hour_keys = sorted(rollups)
+        if len(hour_keys) > 1:
+            closed = [rollups[key] for key in hour_keys[:-1]]
+            self.observe(state, [hour_key_to_index(key) for key in hour_keys[:-1]],
+                         [r['temperature_sum'] / r['count'] for r in closed],
+                         [r['power_sum'] / r['count'] for r in closed])
+        state.pending_hour = hour_keys[-1] if hour_keys else None
+        return state
+
+    def observe(self, state, hour_indexes, temperatures, powers):
+        """累加一批样本（按时间顺序，越早的样本衰减越多）"""
+        features = regression_features(hour_indexes, temperatures)
+        powers = np.asarray(powers, dtype=float)
+        weights = self.decay ** np.arange(len(powers) - 1, -1, -1)
+        decay_all = self.decay ** len(powers)
+        state.xtx = decay_all * state.xtx + (features * weights[:, None]).T @ features
+        state.xty = decay_all * state.xty + features.T @ (weights * powers)
+        state.yty = decay_all * state.yty + float(weights @ (powers * powers))
+        state.count += len(powers)
+        state.coefficients = None
+
+    def coefficients(self, device_id):
+        """返回缓存的系数，样本不足时返回 None"""
+        state = self.states.get(device_id)
+        if state is None or state.count < self.min_samples:
+            return None
+        if state.coefficients is None:
+            penalty = self.ridge * np.eye(FEATURE_COUNT)
+            penalty[0, 0] = 0.0
+            state.coefficients = np.linalg.lstsq(state.xtx + penalty, state.xty, rcond=None)[0]
+        return state.coefficients
+
+    def predict(self, device_id, hour_indexes, temperatures):
+        """按温度预测逐小时平均功率，返回 ndarray；模型未就绪时返回 None"""
+        coefficients = self.coefficients(device_id)
+        if coefficients is None:
+            return None
+        return np.maximum(regression_features(hour_indexes, temperatures) @ coefficients, 0.0)
+
+    def residual_std(self, device_id):
+        """拟合残差的标准差：SSE = yᵀy - 2βᵀXᵀy + βᵀXᵀXβ，按衰减后的有效样本数折算"""
+        coefficients = self.coefficients(device_id)
+        if coefficients is None:
+            return None
+        state = self.states[device_id]
+        sse = state.yty - 2 * coefficients @ state.xty + coefficients @ state.xtx @ coefficients
+        effective = min(state.count, 1 / (1 - self.decay)) if self.decay < 1 else state.count
+        return float(np.sqrt(max(sse, 0.0) / max(effective - FEATURE_COUNT, 1)))
+
+    def to_dict(self):
+        """序列化所有设备状态"""
+        return {device_id: state.to_dict() for device_id, state in self.states.items()}
+
+    def load_states(self, data):
+        """恢复设备状态（特征维数不符的旧状态丢弃，由调用方从小时汇总重放）"""
+        self.states = {device_id: DeviceRegressionState.from_dict(state) for device_id, state in data.items()
+                       if len(state['xty']) == FEATURE_COUNT}
@@ -12,6 +12,8 @@ from matplotlib.figure import Figure
 import numpy as np
 from datetime import datetime, timedelta
 from energy_management_system import EnergyManagementSystem
+from ingestion_server import IngestionServer
+from log_config import configure_from_settings
 
 # 设置中文字体
 plt.rcParams['font.sans-serif'] = ['SimHei', 'DejaVu Sans']
@@ -23,6 +25,7 @@ class EnergyManagementGUI:
     
     def __init__(self):
         self.ems = EnergyManagementSystem()
+        configure_from_settings(self.ems.data['system_settings'])
         self.root = tk.Tk()
         self.root.title("智能能耗管理系统")
         self.root.geometry("1200x800")
@@ -94,6 +97,7 @@ class EnergyManagementGUI:
         menubar.add_cascade(label="工具", menu=tools_menu)
         tools_menu.add_command(label="系统设置", command=self.open_settings)
         tools_menu.add_command(label="数据备份", command=self.backup_data)
+        tools_menu.add_command(label="性能剖析", command=self.open_profiling)
         
         # 帮助菜单
         help_menu = tk.Menu(menubar, tearoff=0)
@@ -175,7 +179,7 @@ class EnergyManagementGUI:
         notebook.add(alerts_frame, text="告警信息")
         
         # 创建Treeview
-        columns = ('ID', '设备ID', '类型', '严重程度', '消息', '时间')
+        columns = ('ID', '设备ID', '类型', '严重程度', '消息', '次数', '最近时间')
         self.alerts_tree = ttk.Treeview(alerts_frame, columns=columns, show='headings', height=10)
         
         # 设置列标题
@@ -204,11 +208,11 @@ class EnergyManagementGUI:
         
         # 示例图表：设备能耗对比
         ax = fig.add_subplot(111)
-        devices = self.ems.get_all_devices()
-        if devices:
-            device_names = [d['name'][:8] for d in devices[:5]]  # 取前5个设备，名称截断
-            # 模拟能耗数据
-            energy_data = [np.random.uniform(10, 100) for _ in device_names]
+        meters = self.ems.get_all_meters()
+        if meters:
+            device_names = [d['name'][:8] for d in meters[:5]]  # 取前5个设备（含虚拟电表），名称截断
+            # 最近24小时能耗，取自小时汇总桶
+            energy_data = [self.ems.get_meter_energy(d['id'], hours=24) for d in meters[:5]]
             
             bars = ax.bar(device_names, energy_data, color=['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4', '#FFEAA7'])
             ax.set_title('设备能耗对比图', fontsize=14, fontweight='bold')
@@ -244,22 +248,29 @@ class EnergyManagementGUI:
             ))
     
     def refresh_alerts_list(self):
-        """刷新告警列表"""
-        # 清空现有数据
-        for item in self.alerts_tree.get_children():
-            self.alerts_tree.delete(item)
+        """刷新告警列表（只显示未关闭告警，按告警ID增量更新）"""
+        alerts = self.ems.get_all_alerts('active')
+        shown = set(self.alerts_tree.get_children())
         
-        # 加载告警数据
-        alerts = self.ems.get_all_alerts()
         for alert in alerts:
-            self.alerts_tree.insert('', tk.END, values=(
+            values = (
                 alert['id'],
                 alert['device_id'],
                 alert['type'],
                 alert['severity'],
                 alert['message'][:30] + '...' if len(alert['message']) > 30 else alert['message'],
-                alert['timestamp']
-            ))
+                alert.get('count', 1),
+                alert.get('last_seen', alert['timestamp'])
+            )
+            if alert['id'] in shown:
+                self.alerts_tree.item(alert['id'], values=values)
+                shown.discard(alert['id'])
+            else:
+                self.alerts_tree.insert('', tk.END, iid=alert['id'], values=values)
+        
+        # 已关闭的告警移出列表
+        if shown:
+            self.alerts_tree.delete(*shown)
     
     # ==================== 功能窗口 ====================
     
@@ -308,6 +319,10 @@ class EnergyManagementGUI:
         if filename:
             messagebox.showinfo("提示", f"数据导出功能开发中\n保存位置: {filename}")
     
+    def open_profiling(self):
+        """打开性能剖析窗口"""
+        ProfilingWindow(self.root, self.ems)
+    
     def open_settings(self):
         """打开系统设置"""
         messagebox.showinfo("系统设置", "系统设置功能开发中")
@@ -548,11 +563,14 @@ class EnergyMonitoringWindow:
     
     def __init__(self, parent, ems):
         self.ems = ems
+        self.ingestion_server = None
+        self.monitor_job = None
         
         self.window = tk.Toplevel(parent)
         self.window.title("用电监控")
         self.window.geometry("800x600")
         self.window.grab_set()
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
         
         self.setup_ui()
     
@@ -580,7 +598,11 @@ class EnergyMonitoringWindow:
         if device_list:
             self.device_combo.set(device_list[0])
         
-        ttk.Button(select_frame, text="开始监控", command=self.start_monitoring).pack(side=tk.LEFT)
+        self.monitor_button = ttk.Button(select_frame, text="开始监控", command=self.start_monitoring)
+        self.monitor_button.pack(side=tk.LEFT)
+        
+        self.monitor_status_var = tk.StringVar(value="实时接入服务未启动")
+        ttk.Label(main_frame, textvariable=self.monitor_status_var).pack(anchor='w', pady=(0, 10))
         
         # 数据输入框架
         input_frame = ttk.LabelFrame(main_frame, text="手动记录用电数据", padding=10)
@@ -631,14 +653,60 @@ class EnergyMonitoringWindow:
         self.refresh_data()
     
     def start_monitoring(self):
-        """开始监控"""
+        """开始监控：启动实时接入服务，并按监控间隔刷新数据"""
+        if self.ingestion_server:
+            self.stop_monitoring()
+            return
+        
         if not self.device_var.get():
             messagebox.showwarning("警告", "请选择设备")
             return
         
-        messagebox.showinfo("提示", "实时监控功能开发中\n当前显示历史数据")
+        try:
+            self.ingestion_server = IngestionServer.from_settings(self.ems)
+            self.ingestion_server.start_in_thread()
+        except OSError as e:
+            self.ingestion_server = None
+            messagebox.showerror("错误", f"实时接入服务启动失败: {e}")
+            return
+        
+        self.monitor_button.config(text="停止监控")
+        self.poll_monitoring()
+    
+    def poll_monitoring(self):
+        """刷新数据表和接入计数"""
+        if not self.ingestion_server:
+            return
+        stats = self.ingestion_server.stats.summary()
+        ports = ", ".join(f"{name.upper()}:{port}" for name, port in self.ingestion_server.ports.items())
+        self.monitor_status_var.set(
+            f"实时接入中 ({ports})  已入库 {stats['accepted']} 条，拒绝 {stats['rejected']} 条，"
+            f"丢弃 {stats['dropped']} 条，{stats['throughput_per_sec']:.0f} 条/秒，"
+            f"P99 延迟 {stats['latency_ms']['p99'] or 0:.0f} ms"
+        )
+        self.refresh_data()
+        interval_minutes = self.ems.data['system_settings'].get('monitoring_interval', 15)
+        self.monitor_job = self.window.after(int(interval_minutes * 60 * 1000), self.poll_monitoring)
+    
+    def stop_monitoring(self):
+        """停止实时接入服务"""
+        if self.monitor_job:
+            self.window.after_cancel(self.monitor_job)
+            self.monitor_job = None
+        if self.ingestion_server:
+            self.ingestion_server.stop_thread()
+            stats = self.ingestion_server.stats.summary()
+            self.ingestion_server = None
+            self.monitor_status_var.set(f"实时接入服务已停止，本次共入库 {stats['accepted']} 条")
+        self.monitor_button.config(text="开始监控")
         self.refresh_data()
     
+    def close(self):
+        """关闭窗口前停止接入服务"""
+        if self.ingestion_server:
+            self.stop_monitoring()
+        self.window.destroy()
+    
     def record_data(self):
         """记录用电数据"""
         try:
@@ -726,8 +794,8 @@ class EnergyAnalysisWindow:
         self.device_combo = ttk.Combobox(param_frame, textvariable=self.device_var, width=30)
         self.device_combo.grid(row=0, column=1, padx=(0, 20))
         
-        # 加载设备列表
-        devices = self.ems.get_all_devices()
+        # 加载设备列表（含虚拟电表）
+        devices = self.ems.get_all_meters()
         device_list = [f"{d['id']} - {d['name']}" for d in devices]
         self.device_combo['values'] = device_list
         if device_list:
@@ -910,11 +978,12 @@ class EnergyAnalysisWindow:
 
 === 预测结果 ===
 预测能耗: {prediction['predicted_energy_kwh']} kWh
-基准功率: {prediction['base_power_w']} W
+预测区间: {prediction['lower_energy_kwh']} ~ {prediction['upper_energy_kwh']} kWh
+平均功率: {prediction['base_power_w']} W
 
 === 预测说明 ===
-• 基于最近的用电数据进行预测
-• 考虑了工作时间和非工作时间的用电模式
+• 基于逐小时汇总增量更新的季节性模型（水平 + 趋势 + 周内小时季节项）
+• 区间按历史一步预测误差估计，预测越远区间越宽
 • 预测结果仅供参考，实际用电可能受多种因素影响
 
 === 成本预估 ===
@@ -1124,6 +1193,8 @@ class EnergyRecommendationsWindow:
 
 建议ID: {savings['recommendation_id']}
 设备ID: {savings['device_id']}
+实施日期: {savings['implementation_date']}
+基准期/报告期: {savings['baseline_days']} / {savings['reporting_days']} 天
 
 === 节能效果 ===
 基准日均能耗: {savings['baseline_daily_consumption']} kWh
@@ -1545,6 +1616,8 @@ class ReportGenerationWindow:
 {'─' * 50}
 """
             
+            report_content += self.format_percentile_section(report_data.get('percentiles'))
+            
             report_content += f"""
 
 ═══════════════════════════════════════
@@ -1582,6 +1655,23 @@ class ReportGenerationWindow:
         else:
             self.content_text.insert(tk.END, f"日报表生成失败: {msg}")
     
+    def format_percentile_section(self, percentiles):
+        """格式化报表中的功率分位数"""
+        if not percentiles or not percentiles['devices']:
+            return ""
+        
+        content = """
+═══════════════════════════════════════
+            功率分位数 (P50/P95/P99)
+═══════════════════════════════════════
+
+"""
+        for item in percentiles['devices']:
+            content += f"{item['device_name']}: {item['p50']}W / {item['p95']}W / {item['p99']}W\n"
+        for item in percentiles['floors']:
+            content += f"{item['floor']}层合计: {item['p50']}W / {item['p95']}W / {item['p99']}W\n"
+        return content
+    
     def display_monthly_report(self, report_data, msg, year, month):
         """显示月报表"""
         if report_data:
@@ -1618,6 +1708,8 @@ class ReportGenerationWindow:
 {'─' * 50}
 """
             
+            report_content += self.format_percentile_section(report_data.get('percentiles'))
+            
             # 计算一些统计信息
             if report_data['devices']:
                 max_consumption_device = max(report_data['devices'], key=lambda x: x['monthly_consumption'])
@@ -1729,6 +1821,135 @@ class ReportGenerationWindow:
         messagebox.showinfo("提示", "打印功能开发中")
 
 
+class ProfilingWindow:
+    """性能剖析窗口：方法计时热点和单次调用剖析"""
+    
+    PROFILE_METHODS = ['save_data', 'generate_daily_report', 'analyze_fleet_consumption',
+                       'generate_fleet_recommendations']
+    
+    def __init__(self, parent, ems):
+        self.ems = ems
+        
+        self.window = tk.Toplevel(parent)
+        self.window.title("性能剖析")
+        self.window.geometry("900x650")
+        self.window.grab_set()
+        
+        self.setup_ui()
+        self.refresh_hot_spots()
+    
+    def setup_ui(self):
+        """设置界面"""
+        main_frame = ttk.Frame(self.window, padding=10)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        ttk.Label(main_frame, text="性能剖析", font=('Arial', 16, 'bold')).pack(pady=(0, 20))
+        
+        # 计时控制
+        control_frame = ttk.Frame(main_frame)
+        control_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        self.toggle_button = ttk.Button(control_frame, command=self.toggle_instrumentation)
+        self.toggle_button.pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(control_frame, text="刷新", command=self.refresh_hot_spots).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(control_frame, text="清空统计", command=self.reset_statistics).pack(side=tk.LEFT)
+        
+        # 热点方法
+        hot_frame = ttk.LabelFrame(main_frame, text="热点方法（按累计耗时）", padding=10)
+        hot_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 10))
+        
+        columns = ('方法', '调用次数', '累计(ms)', '平均(ms)', 'P95(ms)', '最大(ms)')
+        self.hot_tree = ttk.Treeview(hot_frame, columns=columns, show='headings', height=10)
+        
+        for col in columns:
+            self.hot_tree.heading(col, text=col)
+            if col == '方法':
+                self.hot_tree.column(col, width=260)
+            else:
+                self.hot_tree.column(col, width=100)
+        
+        scrollbar = ttk.Scrollbar(hot_frame, orient=tk.VERTICAL, command=self.hot_tree.yview)
+        self.hot_tree.configure(yscrollcommand=scrollbar.set)
+        
+        self.hot_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        # 单次调用剖析
+        profile_frame = ttk.LabelFrame(main_frame, text="单次调用剖析 (cProfile + tracemalloc)", padding=10)
+        profile_frame.pack(fill=tk.BOTH, expand=True)
+        
+        select_frame = ttk.Frame(profile_frame)
+        select_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        ttk.Label(select_frame, text="方法:").pack(side=tk.LEFT, padx=(0, 10))
+        self.method_var = tk.StringVar(value=self.PROFILE_METHODS[0])
+        method_combo = ttk.Combobox(select_frame, textvariable=self.method_var, width=35)
+        method_combo['values'] = self.PROFILE_METHODS
+        method_combo.pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(select_frame, text="剖析", command=self.profile_method).pack(side=tk.LEFT)
+        
+        self.profile_text = tk.Text(profile_frame, height=12, width=100, font=('Courier', 9))
+        profile_scrollbar = ttk.Scrollbar(profile_frame, orient=tk.VERTICAL, command=self.profile_text.yview)
+        self.profile_text.configure(yscrollcommand=profile_scrollbar.set)
+        
+        self.profile_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        profile_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    
+    def toggle_instrumentation(self):
+        """开启或关闭方法计时"""
+        if self.ems.instrumentation is not None and self.ems.instrumentation.enabled:
+            self.ems.disable_instrumentation()
+        else:
+            self.ems.enable_instrumentation()
+        self.refresh_hot_spots()
+    
+    def reset_statistics(self):
+        """清空计时统计"""
+        if self.ems.instrumentation is not None:
+            self.ems.instrumentation.reset()
+        self.refresh_hot_spots()
+    
+    def refresh_hot_spots(self):
+        """刷新热点方法列表"""
+        enabled = self.ems.instrumentation is not None and self.ems.instrumentation.enabled
+        self.toggle_button.configure(text="关闭计时" if enabled else "开启计时")
+        
+        for item in self.hot_tree.get_children():
+            self.hot_tree.delete(item)
+        
+        for row in self.ems.get_method_latency(limit=50):
+            self.hot_tree.insert('', tk.END, values=(
+                row['method'],
+                row['calls'],
+                f"{row['total_ms']:.2f}",
+                f"{row['mean_ms']:.3f}",
+                f"{row['p95_ms']:.3f}",
+                f"{row['max_ms']:.3f}"
+            ))
+    
+    def profile_method(self):
+        """剖析一次所选方法的调用"""
+        try:
+            report, message = self.ems.profile_method(self.method_var.get().strip())
+        except TypeError as e:
+            messagebox.showerror("错误", f"仅支持无必填参数的方法: {e}")
+            return
+        if report is None:
+            messagebox.showerror("错误", message)
+            return
+        
+        lines = [message]
+        if report['alloc_peak_kb'] is not None:
+            lines.append(f"内存分配峰值: {report['alloc_peak_kb']:.1f} KB")
+            for allocation in report['top_allocations'][:5]:
+                lines.append(f"  {allocation['size_kb']:>9.1f} KB  {allocation['location']}")
+        lines.append(report['profile'])
+        
+        self.profile_text.delete(1.0, tk.END)
+        self.profile_text.insert(1.0, "\n".join(lines))
+        self.refresh_hot_spots()
+
+
 if __name__ == "__main__":
     app = EnergyManagementGUI()
     app.run()
@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能能耗管理系统 - 实时数据接入
+asyncio 实现的 TCP / UDP（可选 HTTP）接入服务，接收电表和网关上报的 NDJSON 或行协议读数，
+经有界队列攒批后写入 record_energy_readings_batch。队列满时 TCP 连接暂停读取、HTTP 返回 503、
+UDP 丢弃并计数，以此形成背压。
+
+行协议（每行一条，末尾 Unix 秒时间戳可省略，省略时取接收时间）:
+    energy,device_id=DEV001 voltage=220,current=10,power=2200,temperature=25 1700000000
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+
+from log_config import configure_from_settings, get_logger
+from streaming_stats import RunningStats, TDigest
+
+log = get_logger('ingestion')
+
+REQUIRED_FIELDS = ('device_id', 'voltage', 'current', 'power')
+NUMERIC_FIELDS = ('voltage', 'current', 'power', 'temperature', 'humidity')
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+@lru_cache(maxsize=4096)
+def format_epoch(seconds):
+    """Unix 秒 -> "YYYY-MM-DD HH:MM:SS"（本地时间），同一秒内的读数共用缓存"""
+    return datetime.fromtimestamp(seconds).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def parse_line_protocol(line):
+    """解析一行行协议，标签作为字符串字段，字段值转为浮点数"""
+    parts = line.split(' ')
+    if len(parts) not in (2, 3):
+        raise ValueError("行协议格式应为: measurement,device_id=... 字段=值,... [时间戳]")
+    row = {}
+    for tag in parts[0].split(',')[1:]:
+        key, _, value = tag.partition('=')
+        row[key] = value
+    for field in parts[1].split(','):
+        key, _, value = field.partition('=')
+        row[key] = float(value)
+    if len(parts) == 3:
+        row['timestamp'] = int(parts[2])
+    return row
+
+
+def parse_line(line, received_timestamp=None):
+    """解析一行 NDJSON 或行协议，返回读数字典；空行返回 None
+
+    缺字段、数值字段不是有限数字或时间戳无法解析时抛出 ValueError，坏行在进入批次前就被拒绝。
+    """
+    line = line.strip()
+    if not line:
+        return None
+    if line[0] == '{':
+        row = json.loads(line)
+        if not isinstance(row, dict):
+            raise ValueError("NDJSON 每行必须是对象")
+    else:
+        row = parse_line_protocol(line)
+
+    missing = [field for field in REQUIRED_FIELDS if row.get(field) is None]
+    if missing:
+        raise ValueError(f"缺少字段: {', '.join(missing)}")
+    row['device_id'] = str(row['device_id'])
+    for field in NUMERIC_FIELDS:
+        value = row.get(field)
+        if value is None:
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"字段 {field} 不是数字: {value!r}")
+        if not math.isfinite(value):
+            raise ValueError(f"字段 {field} 不是有限数字: {value!r}")
+        row[field] = value
+
+    timestamp = row.get('timestamp')
+    if isinstance(timestamp, bool):
+        raise ValueError(f"时间戳无效: {timestamp!r}")
+    if isinstance(timestamp, (int, float)):
+        try:
+            row['timestamp'] = format_epoch(int(timestamp))
+        except (OverflowError, OSError, ValueError):
+            raise ValueError(f"时间戳超出范围: {timestamp!r}")
+    elif isinstance(timestamp, str):
+        try:
+            datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+        except ValueError:
+            raise ValueError(f"时间戳格式应为 {TIMESTAMP_FORMAT} 或 Unix 秒: {timestamp!r}")
+    elif timestamp is None:
+        if received_timestamp:
+            row['timestamp'] = received_timestamp
+    else:
+        raise ValueError(f"时间戳无效: {timestamp!r}")
+    return row
+
+
+def format_line_protocol(row, measurement="energy"):
+    """读数字典 -> 一行行协议（timestamp 为 Unix 秒时附在末尾）"""
+    fields = ",".join(f"{key}={row[key]}" for key in ('voltage', 'current', 'power', 'temperature', 'humidity')
+                      if row.get(key) is not None)
+    line = f"{measurement},device_id={row['device_id']} {fields}"
+    if isinstance(row.get('timestamp'), int):
+        line += f" {row['timestamp']}"
+    return line
+
+
+class IngestionStats:
+    """接入计数器：接收/入库/拒绝/丢弃条数、批次数和从接收到入库的延迟分布"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.received = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.batches = 0
+        self.saves = 0
+        self.latency = RunningStats()
+        self.latency_digest = TDigest()
+
+    def record_latency(self, seconds, count):
+        """记录一个数据块的入库延迟（按条数加权）"""
+        milliseconds = seconds * 1000
+        self.latency.update(milliseconds)
+        self.latency_digest.add(milliseconds, count)
+
+    def summary(self):
+        """返回计数器快照"""
+        elapsed = time.monotonic() - self.started
+        p50 = self.latency_digest.quantile(0.5)
+        p99 = self.latency_digest.quantile(0.99)
+        return {
+            'uptime_seconds': round(elapsed, 3),
+            'received': self.received,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'saves': self.saves,
+            'throughput_per_sec': round(self.accepted / elapsed, 1) if elapsed > 0 else 0.0,
+            'latency_ms': {
+                'mean': round(self.latency.mean, 3),
+                'max': round(self.latency.max, 3) if self.latency.max is not None else None,
+                'p50': round(p50, 3) if p50 is not None else None,
+                'p99': round(p99, 3) if p99 is not None else None
+            }
+        }
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    """UDP 数据报：每个数据报可含多行，队列满时整包丢弃"""
+
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        rows = self.server.parse_chunk(data.decode('utf-8', errors='replace').split('\n'))
+        if not rows:
+            return
+        if self.server.queue.full():
+            self.server.stats.dropped += len(rows)
+        else:
+            self.server.queue.put_nowait((time.perf_counter(), rows))
+
+
+class IngestionServer:
+    """实时数据接入服务
+
+    sink: 批量写入回调 sink(rows) -> 入库条数，默认写入 ems.record_energy_readings_batch(rows, save=False)，
+    并每隔 save_interval 秒保存一次数据文件。queue_size 按数据块计（TCP 每次读取或 UDP 每个数据报为一块）。
+    端口为 None 时不启用对应协议，为 0 时由系统分配（启动后见 self.ports）。
+    """
+
+    def __init__(self, ems=None, sink=None, host="127.0.0.1", tcp_port=9009, udp_port=9010, http_port=None,
+                 batch_size=1000, flush_interval=0.5, queue_size=100, save_interval=5.0):
+        if ems is None and sink is None:
+            raise ValueError("必须提供 ems 或 sink")
+        self.ems = ems
+        self.sink = sink or (lambda rows: ems.record_energy_readings_batch(rows, save=False)[0])
+        self.host = host
+        self.requested_ports = {'tcp': tcp_port, 'udp': udp_port, 'http': http_port}
+        self.ports = {}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.save_interval = save_interval
+        self.stats = IngestionStats()
+        self.queue = None
+        self.running = False
+        self._servers = []
+        self._transports = []
+        self._writer_task = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._last_save = time.monotonic()
+        self._loop = None
+        self._thread = None
+
+    @classmethod
+    def from_settings(cls, ems, **overrides):
+        """按 system_settings.ingestion 创建服务，关键字参数覆盖设置"""
+        options = dict(ems.data['system_settings'].get('ingestion', {}))
+        options.update(overrides)
+        return cls(ems, **options)
+
+    # ---------- 生命周期 ----------
+
+    async def start(self):
+        """监听各端口并启动写入任务"""
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.stats = IngestionStats()
+        self._last_save = time.monotonic()
+
+        if self.requested_ports['tcp'] is not None:
+            server = await asyncio.start_server(self._handle_tcp, self.host, self.requested_ports['tcp'])
+            self._servers.append(server)
+            self.ports['tcp'] = server.sockets[0].getsockname()[1]
+        if self.requested_ports['udp'] is not None:
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: _UDPProtocol(self), local_addr=(self.host, self.requested_ports['udp']))
+            self._transports.append(transport)
+            self.ports['udp'] = transport.get_extra_info('sockname')[1]
+        if self.requested_ports['http'] is not None:
+            server = await asyncio.start_server(self._handle_http, self.host, self.requested_ports['http'])
+            self._servers.append(server)
+            self.ports['http'] = server.sockets[0].getsockname()[1]
+
+        self._writer_task = asyncio.ensure_future(self._writer())
+        self.running = True
+
+    async def stop(self):
+        """停止监听，写完队列中剩余的读数并保存"""
+        if not self.running:
+            return
+        self.running = False
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        for transport in self._transports:
+            transport.close()
+        self._servers = []
+        self._transports = []
+        await self.queue.put(None)
+        await self._writer_task
+        if self.ems is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._save)
+
+    async def serve_forever(self):
+        """启动并一直运行，直到任务被取消"""
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
+
+    def start_in_thread(self):
+        """在后台线程的事件循环中运行服务（供 GUI/CLI 使用），返回时端口已就绪"""
+        ready = threading.Event()
+        failure = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._loop.run_until_complete(self.start())
+            except Exception as e:
+                failure.append(e)
+                ready.set()
+                self._loop.close()
+                return
+            ready.set()
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="ingestion-server", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if failure:
+            raise failure[0]
+
+    def stop_thread(self, timeout=10):
+        """停止 start_in_thread 启动的服务"""
+        if not self._thread:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result(timeout)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+
+    # ---------- 解析与入队 ----------
+
+    def parse_chunk(self, lines):
+        """解析一组行，格式错误的行计入 rejected"""
+        received_timestamp = format_epoch(int(time.time()))
+        rows = []
+        for line in lines:
+            try:
+                row = parse_line(line, received_timestamp)
+            except (ValueError, TypeError):
+                self.stats.received += 1
+                self.stats.rejected += 1
+                continue
+            if row is not None:
+                rows.append(row)
+        self.stats.received += len(rows)
+        return rows
+
+    async def _handle_tcp(self, reader, writer):
+        """TCP 长连接：按换行切分，队列满时 await 阻塞读取，由 TCP 窗口把压力传回客户端"""
+        tail = b''
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                data = tail + data
+                cut = data.rfind(b'\n')
+                if cut < 0:
+                    tail = data
+                    continue
+                tail = data[cut + 1:]
+                rows = self.parse_chunk(data[:cut].decode('utf-8', errors='replace').split('\n'))
+                if rows:
+                    await self.queue.put((time.perf_counter(), rows))
+            rows = self.parse_chunk([tail.decode('utf-8', errors='replace')])
+            if rows:
+                await self.queue.put((time.perf_counter(), rows))
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_http(self, reader, writer):
+        """最小 HTTP/1.1：POST /ingest 上报（202，队列满时 503），GET /stats 查询计数器"""
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+
+            if len(request_line) < 2:
+                status, body = 400, {'error': '请求格式错误'}
+            elif request_line[0] == 'GET' and request_line[1] == '/stats':
+                status, body = 200, self.stats.summary()
+            elif request_line[0] == 'POST' and request_line[1] == '/ingest':
+                payload = await reader.readexactly(int(headers.get('content-length', 0)))
+                if self.queue.full():
+                    status, body = 503, {'error': '接入队列已满，请稍后重试'}
+                else:
+                    rejected = self.stats.rejected
+                    rows = self.parse_chunk(payload.decode('utf-8', errors='replace').split('\n'))
+                    if rows:
+                        self.queue.put_nowait((time.perf_counter(), rows))
+                    status, body = 202, {'queued': len(rows), 'rejected': self.stats.rejected - rejected}
+            else:
+                status, body = 404, {'error': '未知路径'}
+
+            content = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            reason = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found',
+                      503: 'Service Unavailable'}[status]
+            writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                         f"Content-Length: {len(content)}\r\nConnection: close\r\n\r\n".encode('latin-1') + content)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    # ---------- 攒批写入 ----------
+
+    async def _writer(self):
+        """从队列攒批：达到 batch_size 或等待超过 flush_interval 即写入"""
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            item = await self.queue.get()
+            if item is None:
+                break
+            chunks = [item]
+            size = len(item[1])
+            deadline = loop.time() + self.flush_interval
+            while size < self.batch_size:
+                if self.queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self.queue.get_nowait()
+                if item is None:
+                    closing = True
+                    break
+                chunks.append(item)
+                size += len(item[1])
+            await self._flush(chunks)
+
+    async def _flush(self, chunks):
+        """把若干数据块作为一批写入 sink，并按需保存数据文件"""
+        loop = asyncio.get_running_loop()
+        batch = [row for _, rows in chunks for row in rows]
+        try:
+            accepted = await loop.run_in_executor(self._executor, self.sink, batch)
+        except Exception as e:
+            # 写入回调出错时整批按拒绝计，写入任务继续运行
+            log.error("批量写入失败: %s", e, exc_info=True, extra={'rows': len(batch)})
+            accepted = 0
+        finished = time.perf_counter()
+
+        self.stats.batches += 1
+        self.stats.accepted += accepted
+        self.stats.rejected += len(batch) - accepted
+        for received_at, rows in chunks:
+            self.stats.record_latency(finished - received_at, len(rows))
+
+        if self.ems is not None and time.monotonic() - self._last_save >= self.save_interval:
+            await loop.run_in_executor(self._executor, self._save)
+
+    def _save(self):
+        """保存数据文件（在写入线程中执行）"""
+        self.ems.save_data()
+        self.stats.saves += 1
+        self._last_save = time.monotonic()
+
+
+# ==================== 基准测试 ====================
+
+def build_benchmark_payload(device_ids, count, start_epoch=None):
+    """生成 count 行行协议读数，设备轮流上报、每轮间隔15秒"""
+    start_epoch = start_epoch or int(time.time()) - count // len(device_ids) * 15
+    lines = []
+    for i in range(count):
+        device_id = device_ids[i % len(device_ids)]
+        power = 1000 + (i * 37) % 500
+        lines.append(f"energy,device_id={device_id} voltage=220,current={power / 220:.3f},power={power},"
+                     f"temperature=24 {start_epoch + i // len(device_ids) * 15}")
+    return ("\n".join(lines) + "\n").encode('utf-8')
+
+
+async def _benchmark(server, payload, count, connections):
+    """用多个 TCP 连接把负载发给服务，返回所有读数处理完的耗时"""
+    await server.start()
+    started = time.perf_counter()
+    pieces = []
+    step = -(-len(payload) // connections)
+    position = 0
+    while position < len(payload):
+        cut = payload.find(b'\n', min(position + step, len(payload)) - 1) + 1 or len(payload)
+        pieces.append(payload[position:cut])
+        position = cut
+
+    async def send(piece):
+        _, writer = await asyncio.open_connection(server.host, server.ports['tcp'])
+        for offset in range(0, len(piece), 65536):
+            writer.write(piece[offset:offset + 65536])
+            await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    await asyncio.gather(*(send(piece) for piece in pieces))
+    while server.stats.accepted + server.stats.rejected < count:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    await server.stop()
+    return elapsed
+
+
+def run_benchmark(count=200000, devices=100, engine=False, connections=4, batch_size=5000):
+    """接入吞吐基准，返回的 mode 标明测的是哪一段
+
+    engine=False（mode 为 parse_only）时写入端只计数，测的是网络接收、解析和攒批本身的吞吐，不含入库；
+    engine=True（mode 为 engine）时写入临时数据文件上的完整引擎管线（不计最后一次保存）。
+    """
+    workdir = None
+    if engine:
+        from energy_management_system import EnergyManagementSystem
+        workdir = tempfile.mkdtemp()
+        ems = EnergyManagementSystem(data_file=os.path.join(workdir, "energy_data.json"))
+        device_ids = [ems.register_device(f"基准设备{i}", "HVAC", "基准测试", 3000)[0] for i in range(devices)]
+        server = IngestionServer(ems, tcp_port=0, udp_port=None, batch_size=batch_size, save_interval=float('inf'))
+    else:
+        device_ids = [f"DEV{i + 1:03d}" for i in range(devices)]
+        server = IngestionServer(sink=len, tcp_port=0, udp_port=None, batch_size=batch_size)
+
+    payload = build_benchmark_payload(device_ids, count)
+    try:
+        elapsed = asyncio.run(_benchmark(server, payload, count, connections))
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = server.stats.summary()
+    summary.update({'readings': count, 'elapsed_seconds': round(elapsed, 3),
+                    'readings_per_sec': round(count / elapsed, 1), 'engine': engine,
+                    'mode': 'engine' if engine else 'parse_only'})
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="智能能耗管理系统 - 实时数据接入服务")
+    parser.add_argument('--host', default=None, help="监听地址")
+    parser.add_argument('--tcp-port', type=int, default=None)
+    parser.add_argument('--udp-port', type=int, default=None)
+    parser.add_argument('--http-port', type=int, default=None)
+    parser.add_argument('--benchmark', type=int, metavar='N',
+                        help="发送 N 条读数测吞吐后退出（默认只测接收和解析，不含入库）")
+    parser.add_argument('--engine', action='store_true', help="基准测试写入完整引擎管线")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        summary = run_benchmark(args.benchmark, engine=args.engine)
+        if not args.engine:
+            print("仅测接收和解析吞吐（写入端只计数，不含入库）；加 --engine 测完整入库管线")
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return
+
+    from energy_management_system import EnergyManagementSystem
+    ems = EnergyManagementSystem()
+    configure_from_settings(ems.data['system_settings'])
+    overrides = {key: value for key, value in (('host', args.host), ('tcp_port', args.tcp_port),
+                                               ('udp_port', args.udp_port), ('http_port', args.http_port))
+                 if value is not None}
+    server = IngestionServer.from_settings(ems, **overrides)
+    print(f"接入服务启动: {server.host} {server.requested_ports}")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print(f"\n接入服务已停止: {json.dumps(server.stats.summary(), ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    main()
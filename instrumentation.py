@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能能耗管理系统 - 方法级性能剖析
+按需把引擎实例的入口方法替换为计时包装，统计调用次数、异常次数、累计/最大耗时和对数分桶的延迟直方图；
+关闭后恢复原方法，不开启时没有任何开销。另可对单次调用做 cProfile + tracemalloc 剖析。
+入口方法指带锁域声明的公开方法（见 concurrency）加上 EXTRA_METHODS，逐条读数调用的内部步骤不计时。
+计时为包含子调用的总耗时（如 generate_daily_report 包含其中的 save_data）；多个线程并发调用时计数在锁内更新。
+"""
+
+import bisect
+import cProfile
+import functools
+import io
+import pstats
+import time
+import threading
+import tracemalloc
+
+# 延迟直方图桶上界（秒），与 Prometheus 默认桶同一量级
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, float('inf'))
+
+# 不加锁、但由调用方直接使用的入口方法，与带锁域声明的方法一起计时
+EXTRA_METHODS = {'save_data', 'flush_pending_save', 'get_all_devices', 'get_all_meters', 'get_all_virtual_meters'}
+
+
+class LatencyHistogram:
+    """固定分桶的延迟直方图，记录一次为一次二分查找"""
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """按桶线性插值估计分位数（秒）"""
+        if not self.count:
+            return None
+        target = q * self.count
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            if count and cumulative + count >= target:
+                upper = min(bound, self.max)
+                return lower + (upper - lower) * (target - cumulative) / count
+            cumulative += count
+            lower = bound
+        return self.max
+
+    def cumulative_buckets(self):
+        """[(上界, 累计次数)]，供 Prometheus 直方图导出"""
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        return buckets
+
+
+class MethodStats:
+    """单个方法的调用统计，多个线程并发调用时在 lock 下更新"""
+
+    __slots__ = ('calls', 'errors', 'histogram', 'lock')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.histogram = LatencyHistogram()
+        self.lock = threading.Lock()
+
+    def record(self, seconds, failed):
+        with self.lock:
+            self.calls += 1
+            if failed:
+                self.errors += 1
+            self.histogram.record(seconds)
+
+    def summary(self, name):
+        with self.lock:
+            return self._summary(name)
+
+    def _summary(self, name):
+        histogram = self.histogram
+        return {
+            'method': name,
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_ms': round(histogram.total * 1000, 3),
+            'mean_ms': round(histogram.total / histogram.count * 1000, 3) if histogram.count else None,
+            'p50_ms': round(histogram.quantile(0.5) * 1000, 3) if histogram.count else None,
+            'p95_ms': round(histogram.quantile(0.95) * 1000, 3) if histogram.count else None,
+            'max_ms': round(histogram.max * 1000, 3)
+        }
+
+
+class Instrumentation:
+    """引擎实例的方法计时器"""
+
+    def __init__(self, target):
+        self.target = target
+        self.methods = {}
+        self.wrapped = []
+
+    @staticmethod
+    def instrumentable_methods(target):
+        """类上定义的入口方法名：带锁域声明（lock_plan）的公开方法和 EXTRA_METHODS"""
+        return sorted(name for name, value in vars(type(target)).items()
+                      if callable(value) and not name.startswith('_')
+                      and (hasattr(value, 'lock_plan') or name in EXTRA_METHODS))
+
+    @property
+    def enabled(self):
+        return bool(self.wrapped)
+
+    def enable(self, methods=None):
+        """在实例上用计时包装覆盖方法，返回包装的方法数"""
+        self.disable()
+        for name in methods or self.instrumentable_methods(self.target):
+            self.wrapped.append(name)
+            setattr(self.target, name, self._wrap(name, getattr(self.target, name)))
+        return len(self.wrapped)
+
+    def disable(self):
+        """删除实例上的包装，恢复类方法（已收集的统计保留）"""
+        for name in self.wrapped:
+            self.target.__dict__.pop(name, None)
+        self.wrapped = []
+
+    def reset(self):
+        self.methods = {}
+        if self.wrapped:
+            self.enable(list(self.wrapped))
+
+    def _wrap(self, name, method):
+        stats = self.methods.setdefault(name, MethodStats())
+        record = stats.record
+        clock = time.perf_counter
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            started = clock()
+            failed = True
+            try:
+                result = method(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                record(clock() - started, failed)
+
+        return timed
+
+    def hot_spots(self, sort_by='total_ms', limit=None):
+        """按累计耗时（或 mean_ms / p95_ms / max_ms / calls）降序的方法统计"""
+        rows = [stats.summary(name) for name, stats in self.methods.items() if stats.calls]
+        rows.sort(key=lambda row: row[sort_by] or 0, reverse=True)
+        return rows[:limit] if limit else rows
+
+
+def profile_call(function, args=(), kwargs=None, limit=20, allocations=True):
+    """用 cProfile（和 tracemalloc）剖析一次调用，返回 (调用结果, 剖析报告)
+
+    limit 为报告中按累计耗时列出的函数数；allocations 为 False 时不启用 tracemalloc。
+    """
+    profiler = cProfile.Profile()
+    tracing = allocations and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        profiler.enable()
+        try:
+            result = function(*args, **(kwargs or {}))
+        finally:
+            profiler.disable()
+        elapsed = time.perf_counter() - started
+        report = {'elapsed_ms': round(elapsed * 1000, 3), 'alloc_peak_kb': None, 'top_allocations': []}
+        if allocations and tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            report['alloc_peak_kb'] = round(peak / 1024, 1)
+            for stat in tracemalloc.take_snapshot().statistics('lineno')[:10]:
+                frame = stat.traceback[0]
+                report['top_allocations'].append({'location': f"{frame.filename}:{frame.lineno}",
+                                                  'size_kb': round(stat.size / 1024, 1), 'blocks': stat.count})
+    finally:
+        if tracing:
+            tracemalloc.stop()
+
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(limit)
+    report['profile'] = stream.getvalue()
+    report['function_calls'] = stats.total_calls
+    return result, report
+
+
+def format_hot_spots(rows):
+    """把热点方法格式化为表格"""
+    lines = [f"{'方法':<36} {'调用':>8} {'累计(ms)':>11} {'平均(ms)':>10} {'P95(ms)':>10} {'最大(ms)':>10}",
+             "-" * 90]
+    for row in rows:
+        lines.append(f"{row['method']:<36} {row['calls']:>8} {row['total_ms']:>11.2f} {row['mean_ms'] or 0:>10.3f} "
+                     f"{row['p95_ms'] or 0:>10.3f} {row['max_ms']:>10.3f}")
+    return "\n".join(lines)
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能能耗管理系统 - 合成负荷数据生成
+按设备类型生成带日/周季节性的多设备读数，空调负荷随室外温度变化，可注入功率尖峰、电压骤降和掉线等异常。
+按天分块向量化生成，同一 seed 结果完全相同，可流式写入 NDJSON / JSON / CSV / 行协议文件或直接批量写入引擎数据文件。
+
+用法示例:
+    python load_generator.py --devices 200 --months 3 --interval 900 --format ndjson --output readings.ndjson
+    python load_generator.py --devices 50 --months 1 --format engine --output /tmp/energy_data.json
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from alert_backfill import match_labels
+
+# 类型: (中文名, 额定功率范围W, 占比)
+DEVICE_TYPES = {
+    'HVAC': ("空调", (2000, 8000), 0.3),
+    'Lighting': ("照明", (200, 1500), 0.3),
+    'Computer': ("计算机", (150, 600), 0.2),
+    'Refrigerator': ("冰箱", (100, 400), 0.1),
+    'Water Heater': ("热水器", (1500, 4000), 0.1)
+}
+
+ANOMALY_KINDS = ('power_spike', 'voltage_sag', 'dropout')
+
+
+def generate_devices(count, seed=0):
+    """按类型占比生成 count 台设备，返回字典列表（id 为 DEV001 起的顺序编号）"""
+    rng = np.random.default_rng([seed, 0])
+    types = list(DEVICE_TYPES)
+    weights = np.array([DEVICE_TYPES[t][2] for t in types])
+    chosen = rng.choice(len(types), size=count, p=weights / weights.sum())
+    devices = []
+    for i, index in enumerate(chosen):
+        device_type = types[index]
+        label, (low, high), _ = DEVICE_TYPES[device_type]
+        devices.append({
+            'id': f"DEV{i + 1:03d}",
+            'name': f"{label}{i + 1}",
+            'type': device_type,
+            'location': f"{i // 20 + 1}楼",
+            'rated_power': float(round(rng.uniform(low, high), -1)),
+            'power_factor': float(round(rng.uniform(0.88, 0.98), 3))
+        })
+    return devices
+
+
+def outdoor_temperature(day_of_year, hours, rng):
+    """室外温度: 年周期 + 日周期 + 逐日随机偏移 + 小幅噪声"""
+    annual = 15 - 10 * np.cos(2 * math.pi * (day_of_year - 15) / 365.25)
+    diurnal = 4 * np.sin(2 * math.pi * (hours - 9) / 24)
+    return annual + diurnal + rng.normal(0, 2) + rng.normal(0, 0.3, len(hours))
+
+
+def occupancy(hours, weekday):
+    """工作时段占用率: 工作日 8-18 点接近1（前后各1小时渐变），夜间和周末较低"""
+    ramp = np.clip(np.minimum(hours - 7, 19 - hours), 0, 1)
+    return np.where(weekday < 5, 0.1 + 0.9 * ramp, 0.1 + 0.15 * ramp)
+
+
+def load_fraction(device_type, hours, weekday, temperature, occupied, phase):
+    """设备负载率（占额定功率的比例）"""
+    if device_type == 'HVAC':
+        demand = 0.05 * np.maximum(temperature - 22, 0) + 0.04 * np.maximum(15 - temperature, 0)
+        return np.clip(0.08 + occupied * (0.25 + demand), 0, 1)
+    if device_type == 'Lighting':
+        return 0.05 + 0.85 * occupied
+    if device_type == 'Computer':
+        return 0.15 + 0.7 * occupied
+    if device_type == 'Refrigerator':
+        # 压缩机约40分钟一个启停周期
+        return np.where(np.sin(2 * math.pi * (hours * 60 + phase) / 40) > 0, 0.75, 0.1)
+    if device_type == 'Water Heater':
+        peaks = np.exp(-((hours - 7) ** 2) / 0.8) + np.exp(-((hours - 19.5) ** 2) / 1.5)
+        return np.clip(0.03 + 0.9 * peaks, 0, 1)
+    return 0.3 + 0.5 * occupied
+
+
+def generate_chunks(devices, start, days, interval=900, seed=0, anomaly_rate=0.0):
+    """按天生成读数块
+
+    每块为字典: timestamps / epochs（长度S）、device_ids（长度D）、voltage / current / power（D×S）、
+    temperature / humidity（长度S，全站共用）、anomalies（[(设备ID, 时间戳, 类型)]）。
+    每块使用由 (seed, 块序号) 派生的随机数，块之间互不依赖。
+    """
+    steps_per_chunk = max(1, 86400 // interval)
+    total_steps = int(days * 86400 // interval)
+    device_ids = [device['id'] for device in devices]
+    rated = np.array([device['rated_power'] for device in devices])[:, None]
+    power_factor = np.array([device.get('power_factor', 0.95) for device in devices])[:, None]
+    phases = np.arange(len(devices)) * 7.0
+    groups = {}
+    for index, device in enumerate(devices):
+        groups.setdefault(device['type'], []).append(index)
+
+    for chunk_index, first in enumerate(range(0, total_steps, steps_per_chunk)):
+        rng = np.random.default_rng([seed, chunk_index + 1])
+        steps = min(steps_per_chunk, total_steps - first)
+        moments = [start + timedelta(seconds=(first + k) * interval) for k in range(steps)]
+        hours = np.array([m.hour + m.minute / 60 + m.second / 3600 for m in moments])
+        weekday = np.array([m.weekday() for m in moments])
+        temperature = outdoor_temperature(moments[0].timetuple().tm_yday, hours, rng)
+        humidity = np.clip(65 - 1.5 * (temperature - 15) + rng.normal(0, 3, steps), 20, 95)
+        occupied = occupancy(hours, weekday)
+
+        fraction = np.empty((len(devices), steps))
+        for device_type, indices in groups.items():
+            fraction[indices] = load_fraction(device_type, hours[None, :], weekday[None, :], temperature[None, :],
+                                              occupied[None, :], phases[indices, None])
+        power = rated * fraction * rng.lognormal(0, 0.05, fraction.shape)
+        voltage = 220 + rng.normal(0, 2, fraction.shape)
+
+        anomalies = []
+        if anomaly_rate > 0:
+            rows, columns = np.nonzero(rng.random(fraction.shape) < anomaly_rate)
+            kinds = rng.integers(0, len(ANOMALY_KINDS), len(rows))
+            for row, column, kind in zip(rows, columns, kinds):
+                if ANOMALY_KINDS[kind] == 'power_spike':
+                    power[row, column] = rated[row, 0] * rng.uniform(1.5, 2.5)
+                elif ANOMALY_KINDS[kind] == 'voltage_sag':
+                    voltage[row, column] = rng.uniform(170, 195)
+                else:
+                    power[row, column] = 0.0
+                anomalies.append((device_ids[row], int(column), ANOMALY_KINDS[kind]))
+
+        current = power / (voltage * power_factor)
+        timestamps = [m.strftime("%Y-%m-%d %H:%M:%S") for m in moments]
+        yield {
+            'timestamps': timestamps,
+            'epochs': [int(m.timestamp()) for m in moments],
+            'device_ids': device_ids,
+            'voltage': voltage,
+            'current': current,
+            'power': power,
+            'temperature': temperature,
+            'humidity': humidity,
+            'anomalies': [(device_id, timestamps[column], kind) for device_id, column, kind in anomalies]
+        }
+
+
+def chunk_rows(chunk):
+    """读数块 -> 按时间、设备排序的 (device_id, timestamp, epoch, voltage, current, power, temperature, humidity)"""
+    voltage = np.round(chunk['voltage'], 1).T.tolist()
+    current = np.round(chunk['current'], 3).T.tolist()
+    power = np.round(chunk['power'], 1).T.tolist()
+    temperature = np.round(chunk['temperature'], 1).tolist()
+    humidity = np.round(chunk['humidity'], 1).tolist()
+    device_ids = chunk['device_ids']
+    for step, timestamp in enumerate(chunk['timestamps']):
+        epoch = chunk['epochs'][step]
+        for device_id, v, c, p in zip(device_ids, voltage[step], current[step], power[step]):
+            yield device_id, timestamp, epoch, v, c, p, temperature[step], humidity[step]
+
+
+class NDJSONWriter:
+    """每行一个 JSON 对象"""
+
+    def __init__(self, path, devices):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, chunk):
+        lines = [
+            f'{{"device_id": "{d}", "timestamp": "{ts}", "voltage": {v}, "current": {c}, "power": {p}, '
+            f'"temperature": {t}, "humidity": {h}}}\n'
+            for d, ts, _, v, c, p, t, h in chunk_rows(chunk)
+        ]
+        self.file.writelines(lines)
+        return len(lines)
+
+    def close(self):
+        self.file.close()
+
+
+class JSONWriter(NDJSONWriter):
+    """JSON 数组（逐块流式写出，不在内存中拼整个数组）"""
+
+    def __init__(self, path, devices):
+        super().__init__(path, devices)
+        self.file.write("[\n")
+        self.first = True
+
+    def write(self, chunk):
+        lines = [
+            f'{{"device_id": "{d}", "timestamp": "{ts}", "voltage": {v}, "current": {c}, "power": {p}, '
+            f'"temperature": {t}, "humidity": {h}}}'
+            for d, ts, _, v, c, p, t, h in chunk_rows(chunk)
+        ]
+        if lines:
+            self.file.write(("" if self.first else ",\n") + ",\n".join(lines))
+            self.first = False
+        return len(lines)
+
+    def close(self):
+        self.file.write("\n]\n")
+        self.file.close()
+
+
+class CSVWriter(NDJSONWriter):
+    """带表头的 CSV"""
+
+    def __init__(self, path, devices):
+        super().__init__(path, devices)
+        self.file.write("device_id,timestamp,voltage,current,power,temperature,humidity\n")
+
+    def write(self, chunk):
+        lines = [f"{d},{ts},{v},{c},{p},{t},{h}\n" for d, ts, _, v, c, p, t, h in chunk_rows(chunk)]
+        self.file.writelines(lines)
+        return len(lines)
+
+
+class LineProtocolWriter(NDJSONWriter):
+    """行协议（与 ingestion_server 的格式一致，时间戳为 Unix 秒）"""
+
+    def write(self, chunk):
+        lines = [
+            f"energy,device_id={d} voltage={v},current={c},power={p},temperature={t},humidity={h} {epoch}\n"
+            for d, _, epoch, v, c, p, t, h in chunk_rows(chunk)
+        ]
+        self.file.writelines(lines)
+        return len(lines)
+
+
+class EngineWriter:
+    """注册设备后按块写入 record_energy_readings_batch，结束时保存一次
+
+    引擎中已有设备时生成的设备会顺延编号，读数中的设备ID随之映射。注入的异常同样换成引擎设备ID，
+    并附上引擎读数ID和写入过程中产生的告警ID（labels），可作为告警回填的真实标注。
+    """
+
+    def __init__(self, path, devices, ems=None):
+        if ems is None:
+            from energy_management_system import EnergyManagementSystem
+            ems = EnergyManagementSystem(data_file=path)
+        self.ems = ems
+        self.id_map = {}
+        for device in devices:
+            device_id, _ = ems.register_device(device['name'], device['type'], device['location'],
+                                               device['rated_power'])
+            self.id_map[device['id']] = device_id
+        self.labels = []
+
+    def write(self, chunk):
+        rows = [
+            {'device_id': self.id_map[d], 'timestamp': ts, 'voltage': v, 'current': c, 'power': p,
+             'temperature': t, 'humidity': h}
+            for d, ts, _, v, c, p, t, h in chunk_rows(chunk)
+        ]
+        first = len(self.ems.data['energy_readings'])
+        accepted, _ = self.ems.record_energy_readings_batch(rows, save=False)
+        if chunk['anomalies']:
+            reading_ids = {(r['device_id'], r['timestamp']): r['id']
+                           for r in self.ems.data['energy_readings'][first:]}
+            for device_id, timestamp, kind in chunk['anomalies']:
+                engine_id = self.id_map[device_id]
+                self.labels.append({'device_id': engine_id, 'timestamp': timestamp, 'type': kind,
+                                    'reading_id': reading_ids.get((engine_id, timestamp))})
+        return accepted
+
+    def close(self):
+        match_labels(self.ems, self.labels)
+        self.ems.save_data()
+
+
+WRITERS = {
+    'ndjson': NDJSONWriter,
+    'json': JSONWriter,
+    'csv': CSVWriter,
+    'line': LineProtocolWriter,
+    'engine': EngineWriter
+}
+
+
+def generate_dataset(writer, devices, start, days, interval=900, seed=0, anomaly_rate=0.0, progress=None):
+    """生成数据并交给 writer 写出，返回汇总信息（含注入的异常清单）"""
+    started = time.perf_counter()
+    total_chunks = -(-int(days * 86400 // interval) // max(1, 86400 // interval))
+    rows = 0
+    anomalies = []
+    for index, chunk in enumerate(generate_chunks(devices, start, days, interval, seed, anomaly_rate)):
+        rows += writer.write(chunk)
+        anomalies.extend({'device_id': d, 'timestamp': ts, 'type': kind} for d, ts, kind in chunk['anomalies'])
+        if progress:
+            progress(index + 1, total_chunks, rows)
+    writer.close()
+    # 写入引擎时以引擎中的设备、读数和告警ID为准
+    anomalies = getattr(writer, 'labels', anomalies)
+    elapsed = time.perf_counter() - started
+    return {
+        'devices': len(devices),
+        'rows': rows,
+        'days': days,
+        'interval_seconds': interval,
+        'seed': seed,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_minute': round(rows / elapsed * 60) if elapsed > 0 else None,
+        'anomalies': anomalies
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="智能能耗管理系统 - 合成负荷数据生成")
+    parser.add_argument('--devices', type=int, default=50, help="设备数量")
+    parser.add_argument('--months', type=float, default=1, help="时长（月，按30天计）")
+    parser.add_argument('--days', type=float, default=None, help="时长（天），指定时忽略 --months")
+    parser.add_argument('--interval', type=int, default=900, help="采样间隔（秒）")
+    parser.add_argument('--start', default=None, help="开始日期 YYYY-MM-DD，默认为时长之前的今天零点")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--anomaly-rate', type=float, default=0.0, help="每条读数被注入异常的概率")
+    parser.add_argument('--format', choices=sorted(WRITERS), default='ndjson')
+    parser.add_argument('--output', required=True, help="输出文件（engine 格式为引擎数据文件）")
+    parser.add_argument('--anomalies', default=None, help="把注入的异常清单写入该 JSON 文件")
+    args = parser.parse_args()
+
+    days = args.days if args.days is not None else args.months * 30
+    if args.start:
+        start = datetime.strptime(args.start, "%Y-%m-%d")
+    else:
+        start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=math.ceil(days))
+
+    devices = generate_devices(args.devices, args.seed)
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    writer = WRITERS[args.format](args.output, devices)
+
+    def show_progress(done, total, rows):
+        print(f"\r生成进度: {done}/{total} 天，{rows} 条", end="", flush=True)
+
+    summary = generate_dataset(writer, devices, start, days, args.interval, args.seed, args.anomaly_rate,
+                               show_progress)
+    print()
+    anomalies = summary.pop('anomalies')
+    if args.anomalies:
+        with open(args.anomalies, 'w', encoding='utf-8') as f:
+            json.dump(anomalies, f, ensure_ascii=False, indent=2)
+    summary['anomalies_injected'] = len(anomalies)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能能耗管理系统 - 负荷转移调度
+把一天按固定分辨率切成时段，按分时电价为可调度负荷（每次运行所需电量、允许时段、功率上限）
+贪心地分配到最便宜的允许时段，可选全站功率上限。与"最早允许时刻开机"的基准方案比较给出节省金额。
+"""
+
+import numpy as np
+
+
+def slot_prices(tariff_table, slot_minutes=15):
+    """把按分钟的费率表折算为每个时段的平均电价"""
+    return np.asarray(tariff_table, dtype=float).reshape(-1, slot_minutes).mean(axis=1)
+
+
+def _minute_of_day(text):
+    """ "HH:MM" 或 "HH:MM:SS" -> 当天分钟数"""
+    return int(text[:2]) * 60 + int(text[3:5])
+
+
+def window_mask(windows, slot_minutes=15):
+    """允许时段列表 [("HH:MM", "HH:MM")] -> 时段布尔掩码，结束早于开始表示跨零点"""
+    slots = 1440 // slot_minutes
+    if not windows:
+        return np.ones(slots, dtype=bool)
+    mask = np.zeros(slots, dtype=bool)
+    for start, end in windows:
+        first = _minute_of_day(start) // slot_minutes
+        last = -(-_minute_of_day(end) // slot_minutes)
+        if last <= first:
+            mask[first:] = True
+            mask[:last] = True
+        else:
+            mask[first:last] = True
+    return mask
+
+
+def slot_label(slot, slot_minutes=15):
+    """时段序号 -> "HH:MM" """
+    minutes = slot * slot_minutes
+    return f"{minutes // 60 % 24:02d}:{minutes % 60:02d}"
+
+
+def window_start_slot(mask):
+    """第一个允许区间的起始时段：前一个时段（跨零点循环）不允许的允许时段，全天允许时为 0"""
+    starts = np.flatnonzero(mask & ~np.roll(mask, 1))
+    return int(starts[0]) if len(starts) else 0
+
+
+def _runs(allocation, slot_minutes):
+    """把逐时段分配合并为连续运行区间 [(开始, 结束, kWh)]，跨零点的运行合并为一个区间"""
+    runs = []
+    active = np.flatnonzero(allocation > 1e-9)
+    if not len(active):
+        return runs
+    start = previous = active[0]
+    for slot in list(active[1:]) + [None]:
+        if slot is None or slot != previous + 1:
+            runs.append((slot_label(start, slot_minutes), slot_label(previous + 1, slot_minutes),
+                         round(float(allocation[start:previous + 1].sum()), 3)))
+            if slot is not None:
+                start = slot
+        if slot is not None:
+            previous = slot
+    if len(runs) > 1 and active[0] == 0 and active[-1] == len(allocation) - 1:
+        first = runs.pop(0)
+        last = runs.pop()
+        runs.append((last[0], first[1], round(last[2] + first[2], 3)))
+    return runs
+
+
+def baseline_allocation(energy, slot_capacity, mask, start_slot=None):
+    """基准方案：从指定时段（默认允许区间的起点，跨零点窗口为前一天的开始时刻）起按功率上限连续运行直到满足电量"""
+    slots = len(mask)
+    allocation = np.zeros(slots)
+    if start_slot is None:
+        start_slot = window_start_slot(mask)
+    remaining = energy
+    for offset in range(slots):
+        if remaining <= 1e-9:
+            break
+        slot = (start_slot + offset) % slots
+        allocation[slot] = min(slot_capacity, remaining)
+        remaining -= allocation[slot]
+    return allocation
+
+
+def optimize_schedule(loads, prices, site_cap_kw=None, slot_minutes=15):
+    """贪心求解负荷调度
+
+    loads: [{'device_id', 'energy_kwh', 'power_kw', 'windows', 'contiguous', 'baseline_start'}]，
+    contiguous 为 True 时负荷必须连续运行（在允许时段内选总电价最低的起点，可跨零点），否则可按时段拆分。
+    未给 baseline_start 时基准方案从第一个允许时段窗口的开始时刻起运行；energy_kwh 为 0 的负荷不分配。
+    prices: 每个时段的电价数组；site_cap_kw: 全站功率上限，None 表示不限。
+    价差越大的负荷越先分配，使其优先占用便宜时段。
+    返回 (逐负荷结果列表, 未满足电量合计kWh)。
+    """
+    prices = np.asarray(prices, dtype=float)
+    slots = len(prices)
+    hours_per_slot = slot_minutes / 60
+    site_remaining = np.full(slots, np.inf if site_cap_kw is None else site_cap_kw * hours_per_slot)
+
+    prepared = []
+    for load in loads:
+        mask = window_mask(load.get('windows'), slot_minutes)
+        allowed_prices = prices[mask]
+        spread = float(allowed_prices.max() - allowed_prices.min()) if len(allowed_prices) else 0.0
+        prepared.append((spread, load, mask))
+    order = sorted(range(len(prepared)), key=lambda i: -prepared[i][0])
+
+    results = [None] * len(prepared)
+    unserved_total = 0.0
+    for index in order:
+        _, load, mask = prepared[index]
+        energy = float(load['energy_kwh'])
+        capacity = float(load['power_kw']) * hours_per_slot
+        available = np.where(mask, np.minimum(capacity, site_remaining), 0.0)
+        allocation = np.zeros(slots)
+
+        if energy <= 1e-9:
+            pass
+        elif load.get('contiguous'):
+            length = int(np.ceil(energy / capacity - 1e-9)) if capacity > 0 else slots + 1
+            if length <= slots:
+                # 窗口内每个时段都要能满功率运行；数组首尾相接后再卷积，一次算出所有（含跨零点）起点的窗口电价
+                full = (available >= capacity - 1e-9).astype(int)
+                ok = np.convolve(np.concatenate([full, full[:length - 1]]), np.ones(length, dtype=int), 'valid') == length
+                window_cost = np.convolve(np.concatenate([prices, prices[:length - 1]]), np.ones(length), 'valid')
+                if ok.any():
+                    start = int(np.argmin(np.where(ok, window_cost, np.inf)))
+                    run = (start + np.arange(length)) % slots
+                    allocation[run] = capacity
+                    allocation[run[-1]] = energy - capacity * (length - 1)
+        else:
+            # 允许时段按电价升序依次填满，前缀和一次算出每个时段的分配量
+            cheapest = np.argsort(np.where(mask, prices, np.inf), kind='stable')[:int(mask.sum())]
+            room = available[cheapest]
+            allocation[cheapest] = np.clip(energy - (np.cumsum(room) - room), 0.0, room)
+
+        site_remaining -= allocation
+        unserved = round(max(energy - float(allocation.sum()), 0.0), 6)
+        unserved_total += unserved
+
+        start_slot = None
+        if load.get('baseline_start'):
+            start_slot = _minute_of_day(load['baseline_start']) // slot_minutes
+        elif load.get('windows'):
+            start_slot = _minute_of_day(load['windows'][0][0]) // slot_minutes
+        baseline = baseline_allocation(energy, capacity, mask, start_slot)
+        baseline_cost = float(baseline @ prices)
+        optimized_cost = float(allocation @ prices)
+        results[index] = {
+            'device_id': load['device_id'],
+            'energy_kwh': energy,
+            'schedule': _runs(allocation, slot_minutes),
+            'baseline_schedule': _runs(baseline, slot_minutes),
+            'baseline_cost': round(baseline_cost, 4),
+            'optimized_cost': round(optimized_cost, 4),
+            'savings': round(baseline_cost - optimized_cost, 4) if not unserved else 0.0,
+            'unserved_kwh': round(unserved, 3)
+        }
+    return results, round(unserved_total, 3)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能能耗管理系统 - 日志
+各子系统使用 "ems.<子系统>" 命名的 logger（如 ems.storage、ems.alerts），诊断信息的上下文通过 extra
+作为结构化字段传入。默认只在 "ems" 上挂 NullHandler：不调用 configure_logging 就没有任何输出。
+configure_logging 在 "ems" 上挂 QueueHandler，由后台 QueueListener 线程格式化并写出，
+写入路径上的日志调用只做一次入队，不等待终端或磁盘 I/O。
+"""
+
+import atexit
+import json
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+ROOT_LOGGER = "ems"
+SUBSYSTEMS = ('storage', 'monitoring', 'alerts', 'recommendations', 'cost', 'collector', 'metrics')
+
+# LogRecord 自带的属性，其余属性即 extra 传入的结构化字段
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+logging.getLogger(ROOT_LOGGER).addHandler(logging.NullHandler())
+
+_listener = None
+_queue_handler = None
+_configured_loggers = []
+
+
+def get_logger(subsystem):
+    """子系统 logger，如 get_logger('storage') -> ems.storage"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{subsystem}")
+
+
+class StructuredFormatter(logging.Formatter):
+    """文本格式在消息后附 key=value 结构化字段；json_lines 为 True 时每条记录输出一行 JSON"""
+
+    def __init__(self, json_lines=False):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+        self.json_lines = json_lines
+
+    @staticmethod
+    def fields(record):
+        return {key: value for key, value in vars(record).items() if key not in STANDARD_ATTRIBUTES}
+
+    def format(self, record):
+        fields = self.fields(record)
+        if self.json_lines:
+            entry = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name,
+                     'message': record.getMessage(), **fields}
+            if record.exc_info:
+                entry['exception'] = self.formatException(record.exc_info)
+            elif record.exc_text:
+                entry['exception'] = record.exc_text
+            return json.dumps(entry, ensure_ascii=False, default=str)
+        text = super().format(record)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+def resolve_logger_name(name):
+    return name if name == ROOT_LOGGER or name.startswith(ROOT_LOGGER + ".") else f"{ROOT_LOGGER}.{name}"
+
+
+def configure_logging(level='INFO', levels=None, stream=None, filename=None, json_lines=False):
+    """开启 ems.* 日志输出，返回后台 QueueListener
+
+    levels 为 {子系统或完整 logger 名: 级别}，覆盖总级别；stream 缺省为 stderr，
+    只给 filename 时只写文件。重复调用会先关闭上一次的配置。
+    """
+    global _listener, _queue_handler
+    shutdown_logging()
+
+    handlers = []
+    if stream is not None or not filename:
+        handlers.append(logging.StreamHandler(stream or sys.stderr))
+    if filename:
+        handlers.append(logging.FileHandler(filename, encoding='utf-8'))
+    formatter = StructuredFormatter(json_lines)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level)
+    root.propagate = False
+    _configured_loggers.append(root)
+    for name, subsystem_level in (levels or {}).items():
+        logger = logging.getLogger(resolve_logger_name(name))
+        logger.setLevel(subsystem_level)
+        _configured_loggers.append(logger)
+
+    _queue_handler = QueueHandler(records)
+    root.addHandler(_queue_handler)
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def configure_from_settings(settings):
+    """按 system_settings['logging'] 配置日志，未开启时保持静默"""
+    options = settings.get('logging', {})
+    if not options.get('enabled'):
+        return None
+    return configure_logging(level=options.get('level', 'INFO'), levels=options.get('levels'),
+                             filename=options.get('file'), json_lines=options.get('format') == 'json')
+
+
+def shutdown_logging():
+    """停止后台线程（写完队列中剩余的记录）并恢复静默"""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    root = logging.getLogger(ROOT_LOGGER)
+    root.removeHandler(_queue_handler)
+    root.propagate = True
+    while _configured_loggers:
+        _configured_loggers.pop().setLevel(logging.NOTSET)
+    _listener = None
+    _queue_handler = None
+
+
+atexit.register(shutdown_logging)
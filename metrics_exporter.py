@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能能耗管理系统 - Prometheus 指标导出
+引擎在写入和保存路径上只做整数累加和一次直方图分桶（EngineMetrics），告警数、索引大小、缓存命中率
+和内存等其余指标在抓取时才从现有结构汇总，因此不抓取时几乎没有开销。
+指标以 Prometheus 文本格式通过标准库 HTTP 服务（GET /metrics）提供，或定期原子地重写到文本文件，
+供 node_exporter 的 textfile collector 读取。
+
+单独运行本脚本时导出器自建引擎，每次抓取前若数据文件有变化则重新加载，告警、集合、索引和文件大小
+反映写入进程最近一次保存的数据；读数入库、保存次数和延迟直方图等计数只统计本进程，单独运行时保持为 0。
+需要这些计数时在写入进程内启动导出器（CLI「数据管理 → 指标导出」或 MetricsExporter(ems).start()）。
+
+用法示例:
+    python metrics_exporter.py --port 9108
+    python metrics_exporter.py --textfile /var/lib/node_exporter/ems.prom --interval 15
+    python metrics_exporter.py --once
+"""
+
+import argparse
+import os
+import platform
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，不导出峰值内存
+    resource = None
+
+from concurrency import LOCK_DOMAINS
+from ingestion_server import format_epoch
+from instrumentation import LatencyHistogram
+from log_config import get_logger, configure_from_settings
+from streaming_stats import day_epoch
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# 导出大小的内存索引: 指标标签 -> 引擎属性
+INDEXES = {
+    'devices_by_id': '_devices_by_id', 'open_alerts': '_open_alerts', 'alerts_by_device': '_alerts_by_device',
+    'alerts_by_day': '_alerts_by_day', 'compiled_rules': '_compiled_rules', 'device_stats': '_device_stats',
+    'open_sketches': '_open_sketches', 'virtual_meter_index': '_virtual_meter_index',
+    'pending_recommendations': '_pending_recommendations', 'budget_index': '_budget_index'
+}
+
+log = get_logger('metrics')
+
+
+class EngineMetrics:
+    """引擎内部计数器，由写入和保存路径直接累加"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.readings_ingested = 0
+        self.readings_rejected = 0
+        self.ingest_latency = LatencyHistogram()
+        self.saves = 0
+        self.save_failures = 0
+        self.save_latency = LatencyHistogram()
+        self.bytes_written = 0
+        self.last_save_bytes = 0
+        self.last_save_time = 0.0
+
+    def observe_ingest(self, accepted, rejected, seconds):
+        """一次单条或批量写入（不含保存）"""
+        self.readings_ingested += accepted
+        self.readings_rejected += rejected
+        self.ingest_latency.record(seconds)
+
+    def observe_save(self, seconds, size):
+        """一次成功的数据文件保存"""
+        self.saves += 1
+        self.save_latency.record(seconds)
+        self.bytes_written += size
+        self.last_save_bytes = size
+        self.last_save_time = time.time()
+
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+class MetricFamilies:
+    """按 Prometheus 文本格式累积指标族"""
+
+    def __init__(self):
+        self.lines = []
+
+    def add(self, name, kind, help_text, samples):
+        """samples 为数值，或 [(标签字典, 数值)] 列表；值为 None 的样本跳过"""
+        if not isinstance(samples, list):
+            samples = [({}, samples)]
+        samples = [(labels, value) for labels, value in samples if value is not None]
+        if not samples:
+            return
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+    def histogram(self, name, help_text, series):
+        """series 为 LatencyHistogram，或 [(标签字典, LatencyHistogram)] 列表"""
+        if not isinstance(series, list):
+            series = [({}, series)]
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in series:
+            for bound, count in histogram.cumulative_buckets():
+                self.lines.append(f"{name}_bucket{format_labels(dict(labels, le=format_value(bound)))} {count}")
+            self.lines.append(f"{name}_sum{format_labels(labels)} {format_value(histogram.total)}")
+            self.lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+    def render(self):
+        return "\n".join(self.lines) + "\n"
+
+
+def resident_memory_bytes():
+    """当前常驻内存（仅 Linux，读取 /proc/self/statm）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_resident_memory_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 计，macOS 以字节计
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+def cache_samples(caches):
+    """lru_cache 的命中/未命中/条目数样本"""
+    hits, misses, entries, ratios = [], [], [], []
+    for name, function in caches.items():
+        info = function.cache_info()
+        labels = {'cache': name}
+        hits.append((labels, info.hits))
+        misses.append((labels, info.misses))
+        entries.append((labels, info.currsize))
+        lookups = info.hits + info.misses
+        ratios.append((labels, round(info.hits / lookups, 6) if lookups else None))
+    return hits, misses, entries, ratios
+
+
+def collect_metrics(ems):
+    """汇总引擎指标，返回 Prometheus 文本格式"""
+    metrics = ems.metrics
+    families = MetricFamilies()
+
+    families.add("ems_start_time_seconds", "gauge", "引擎启动时间（Unix秒）", round(metrics.started, 3))
+    families.add("ems_readings_ingested_total", "counter", "已入库的读数条数", metrics.readings_ingested)
+    families.add("ems_readings_rejected_total", "counter", "被拒绝的读数条数（设备不存在或行数据无效）", metrics.readings_rejected)
+    families.histogram("ems_ingest_duration_seconds", "单条或批量写入耗时（不含保存）", metrics.ingest_latency)
+
+    families.add("ems_saves_total", "counter", "数据文件保存次数", metrics.saves)
+    families.add("ems_save_failures_total", "counter", "数据文件保存失败次数", metrics.save_failures)
+    families.histogram("ems_save_duration_seconds", "数据文件保存耗时（含编码）", metrics.save_latency)
+    families.add("ems_save_bytes_total", "counter", "累计写入数据文件的字节数", metrics.bytes_written)
+    families.add("ems_last_save_bytes", "gauge", "最近一次保存的数据文件大小", metrics.last_save_bytes)
+    families.add("ems_last_save_timestamp_seconds", "gauge", "最近一次成功保存的时间（Unix秒）",
+                 round(metrics.last_save_time, 3))
+
+    # 告警、集合和索引在读锁下汇总，不与写入交错
+    with ems.locks.hold(reads=LOCK_DOMAINS):
+        active = {}
+        for alert in ems.get_all_alerts('active'):
+            active[alert.get('severity', 'unknown')] = active.get(alert.get('severity', 'unknown'), 0) + 1
+        collections = [({'collection': name}, len(value)) for name, value in ems.data.items()
+                       if isinstance(value, (list, dict)) and name != 'system_settings']
+        index_sizes = [({'index': name}, len(getattr(ems, attribute))) for name, attribute in INDEXES.items()
+                       if hasattr(ems, attribute)]
+    families.add("ems_active_alerts", "gauge", "当前活动告警数",
+                 [({'severity': severity}, count) for severity, count in sorted(active.items())] or [({}, 0)])
+    families.add("ems_collection_items", "gauge", "数据集合条目数", collections)
+    families.add("ems_index_entries", "gauge", "内存索引条目数", index_sizes)
+
+    hits, misses, entries, ratios = cache_samples({'day_epoch': day_epoch, 'format_epoch': format_epoch})
+    families.add("ems_cache_hits_total", "counter", "缓存命中次数", hits)
+    families.add("ems_cache_misses_total", "counter", "缓存未命中次数", misses)
+    families.add("ems_cache_entries", "gauge", "缓存条目数", entries)
+    families.add("ems_cache_hit_ratio", "gauge", "缓存命中率", ratios)
+    families.add("ems_tariff_table_compiled", "gauge", "分时电价费率表是否已编译",
+                 int(ems._tariff_table is not None))
+
+    families.add("ems_process_resident_memory_bytes", "gauge", "进程当前常驻内存", resident_memory_bytes())
+    families.add("ems_process_peak_resident_memory_bytes", "gauge", "进程峰值常驻内存", peak_resident_memory_bytes())
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        families.add("ems_python_traced_memory_bytes", "gauge", "tracemalloc 跟踪的当前 Python 内存分配", current)
+    try:
+        families.add("ems_data_file_bytes", "gauge", "数据文件大小", os.path.getsize(ems.data_file))
+    except OSError:
+        pass
+
+    instrumentation = ems.instrumentation
+    if instrumentation is not None and instrumentation.methods:
+        methods = sorted(instrumentation.methods.items())
+        families.histogram("ems_method_duration_seconds", "方法调用耗时（开启性能计时后）",
+                           [({'method': name}, stats.histogram) for name, stats in methods])
+        families.add("ems_method_errors_total", "counter", "方法抛出异常次数",
+                     [({'method': name}, stats.errors) for name, stats in methods])
+
+    return families.render()
+
+
+class MetricsExporter:
+    """指标导出器：HTTP 端点和/或定期重写的文本文件，均在后台守护线程中运行
+
+    port 为 None 时不启动 HTTP 服务（0 表示随机端口）；textfile 为 None 时不写文件。
+    reload 为 True 时每次导出前检查数据文件，修改时间变化则重新加载（单独运行、由其他进程写入时使用）。
+    """
+
+    def __init__(self, ems, host='127.0.0.1', port=None, textfile=None, interval=15.0, reload=False):
+        self.ems = ems
+        self.host = host
+        self.port = port
+        self.textfile = textfile
+        self.interval = interval
+        self.reload = reload
+        self.scrapes = 0
+        self._loaded_mtime = self._data_file_mtime()
+        self._reload_lock = threading.Lock()
+        self._server = None
+        self._threads = []
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_settings(cls, ems, reload=False, **overrides):
+        """按 system_settings['metrics'] 创建，overrides 覆盖对应配置"""
+        options = dict(ems.data['system_settings'].get('metrics', {}))
+        options.update(overrides)
+        return cls(ems, host=options.get('host', '127.0.0.1'), port=options.get('http_port'),
+                   textfile=options.get('textfile'), interval=options.get('interval', 15.0), reload=reload)
+
+    @property
+    def running(self):
+        return bool(self._threads)
+
+    @property
+    def bound_port(self):
+        return self._server.server_address[1] if self._server else None
+
+    def _data_file_mtime(self):
+        try:
+            return os.stat(self.ems.data_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload_if_changed(self):
+        """数据文件修改时间变化时重新加载，返回是否重新加载"""
+        with self._reload_lock:
+            mtime = self._data_file_mtime()
+            if mtime is None or mtime == self._loaded_mtime:
+                return False
+            self.ems.load_data()
+            self._loaded_mtime = mtime
+            log.debug("数据文件已变化，重新加载", extra={'data_file': self.ems.data_file})
+            return True
+
+    def render(self):
+        self.scrapes += 1
+        if self.reload:
+            self.reload_if_changed()
+        return collect_metrics(self.ems)
+
+    def write_textfile(self):
+        """先写临时文件再重命名，textfile collector 不会读到半个文件"""
+        temporary = f"{self.textfile}.{os.getpid()}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(temporary, self.textfile)
+
+    def _textfile_loop(self):
+        while True:
+            try:
+                self.write_textfile()
+            except OSError as e:
+                log.warning("指标文件写入失败: %s", e, extra={'textfile': self.textfile})
+            if self._stop.wait(self.interval):
+                break
+
+    def _handler(self):
+        exporter = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return MetricsHandler
+
+    def start(self):
+        """启动 HTTP 端点和文本文件线程"""
+        if self.running:
+            return
+        self._stop.clear()
+        if self.port is not None:
+            self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+            self._server.daemon_threads = True
+            self._threads.append(threading.Thread(target=self._server.serve_forever, daemon=True))
+        if self.textfile:
+            self._threads.append(threading.Thread(target=self._textfile_loop, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="智能能耗管理系统 - Prometheus 指标导出")
+    parser.add_argument('--host', default=None, help="监听地址")
+    parser.add_argument('--port', type=int, default=None, help="HTTP 端口（GET /metrics）")
+    parser.add_argument('--textfile', default=None, help="定期重写的指标文件路径")
+    parser.add_argument('--interval', type=float, default=None, help="文件重写间隔（秒）")
+    parser.add_argument('--once', action='store_true', help="输出一次指标后退出")
+    args = parser.parse_args()
+
+    from energy_management_system import EnergyManagementSystem
+    ems = EnergyManagementSystem()
+    configure_from_settings(ems.data['system_settings'])
+    if args.once:
+        print(collect_metrics(ems), end="")
+        return
+
+    overrides = {key: value for key, value in (('host', args.host), ('http_port', args.port),
+                                               ('textfile', args.textfile), ('interval', args.interval))
+                 if value is not None}
+    # 数据由其他进程写入，抓取时按文件变化重新加载
+    exporter = MetricsExporter.from_settings(ems, reload=True, **overrides)
+    if exporter.port is None and not exporter.textfile:
+        parser.error("需要指定 --port 或 --textfile（或在 system_settings.metrics 中配置）")
+    exporter.start()
+    print(f"指标导出已启动: http={exporter.bound_port} textfile={exporter.textfile}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        exporter.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能能耗管理系统 - 轮询采集
+按 monitoring_interval 周期轮询各设备的电表驱动，读数攒批后写入 record_energy_readings_batch。
+每台设备在周期内有固定的随机相位，避免所有设备同时发起请求；下一次轮询时刻按
+"起始时刻 + 周期数 × 间隔 + 相位" 计算而不是"上次完成 + 间隔"，设备再多周期也不会漂移，
+错过的轮询直接跳到下一个周期并计数。每种驱动有独立的连接池和超时。
+"""
+
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ingestion_server import format_epoch
+from log_config import get_logger
+from streaming_stats import RunningStats
+
+log = get_logger('collector')
+
+
+class ConnectionPool:
+    """驱动连接池：最多 size 个连接，借出超时抛出 asyncio.TimeoutError，出错的连接直接丢弃"""
+
+    def __init__(self, driver, size=8):
+        self.driver = driver
+        self.size = size
+        self.idle = []
+        self.opened = 0
+        self.slots = asyncio.Semaphore(size)
+
+    async def acquire(self, timeout):
+        await asyncio.wait_for(self.slots.acquire(), timeout)
+        if self.idle:
+            return self.idle.pop()
+        try:
+            connection = await asyncio.wait_for(self.driver.connect(), timeout)
+        except BaseException:
+            self.slots.release()
+            raise
+        self.opened += 1
+        return connection
+
+    async def release(self, connection, broken=False):
+        if broken:
+            self.opened -= 1
+            await self.driver.close(connection)
+        else:
+            self.idle.append(connection)
+        self.slots.release()
+
+    async def close(self):
+        while self.idle:
+            await self.driver.close(self.idle.pop())
+        self.opened = 0
+
+
+class MeterDriver:
+    """电表驱动接口
+
+    connect() 建立连接，read(connection, point) 返回 {'voltage', 'current', 'power', ...}，
+    close(connection) 关闭连接。point 为采集点配置（device_id、rated_power 及驱动参数）。
+    """
+
+    async def connect(self):
+        return None
+
+    async def read(self, connection, point):
+        raise NotImplementedError
+
+    async def close(self, connection):
+        pass
+
+
+class SimulatedModbusDriver(MeterDriver):
+    """模拟 Modbus 电表（用于测试和演示）
+
+    保持寄存器: 0 电压×10, 1 电流×100, 2-3 有功功率W(高/低16位), 4 温度×10, 5 湿度×10。
+    latency 为每次请求的模拟往返时延（秒），failure_rate 为请求失败概率。
+    """
+
+    def __init__(self, latency=0.005, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+
+    async def connect(self):
+        await asyncio.sleep(self.latency)
+        return {'open': True}
+
+    async def close(self, connection):
+        connection['open'] = False
+
+    async def read_holding_registers(self, connection, unit_id, point, address, count):
+        """模拟读保持寄存器，按额定功率生成随时段变化的负荷"""
+        await asyncio.sleep(self.latency)
+        self.requests += 1
+        if not connection['open'] or self.random.random() < self.failure_rate:
+            raise ConnectionError(f"Modbus 从站 {unit_id} 无响应")
+        rated_power = float(point.get('rated_power') or 1000)
+        hour = time.localtime().tm_hour
+        load = (0.6 if 8 <= hour < 22 else 0.3) + self.random.uniform(-0.05, 0.05)
+        voltage = 220 + self.random.uniform(-3, 3)
+        power = int(rated_power * load)
+        registers = [int(voltage * 10), int(power / voltage * 100), power >> 16, power & 0xFFFF,
+                     int((24 + self.random.uniform(-1, 1)) * 10), int(60 * 10)]
+        return registers[address:address + count]
+
+    async def read(self, connection, point):
+        registers = await self.read_holding_registers(connection, point.get('unit_id', 1), point, 0, 6)
+        return {
+            'voltage': registers[0] / 10,
+            'current': registers[1] / 100,
+            'power': float((registers[2] << 16) | registers[3]),
+            'temperature': registers[4] / 10,
+            'humidity': registers[5] / 10
+        }
+
+
+DRIVERS = {
+    'simulated_modbus': SimulatedModbusDriver
+}
+
+
+class CollectorStats:
+    """采集计数器：轮询/成功/超时/失败/错过次数，以及实际开始时刻相对计划时刻的滞后"""
+
+    def __init__(self):
+        self.polls = 0
+        self.succeeded = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.missed = 0
+        self.written = 0
+        self.lag = RunningStats()
+
+    def summary(self):
+        return {
+            'polls': self.polls,
+            'succeeded': self.succeeded,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'missed_cycles': self.missed,
+            'written': self.written,
+            'lag_ms': {
+                'mean': round(self.lag.mean * 1000, 3),
+                'max': round(self.lag.max * 1000, 3) if self.lag.max is not None else None
+            }
+        }
+
+
+class PollingCollector:
+    """轮询采集器
+
+    drivers: {驱动名: 驱动实例}，缺省按 DRIVERS 创建；points 缺省取 ems.get_collector_points()。
+    interval 为轮询间隔（秒），缺省取 monitoring_interval（分钟）；jitter 为相位分布占间隔的比例；
+    timeout 同时作用于借连接和单次读取；pool_size 为每种驱动的连接数上限。
+    缓冲区每隔 flush_interval 秒、或攒满 batch_size 条时写入一次，与轮询间隔无关。
+    """
+
+    def __init__(self, ems, drivers=None, points=None, interval=None, jitter=None, timeout=None, pool_size=None,
+                 save_interval=None, flush_interval=None, batch_size=None):
+        settings = ems.data['system_settings']
+        options = settings.get('collector', {})
+        self.ems = ems
+        self.points = points if points is not None else ems.get_collector_points()
+        self.interval = float(interval or settings.get('monitoring_interval', 15) * 60)
+        self.jitter = options.get('jitter', 1.0) if jitter is None else jitter
+        self.timeout = timeout or options.get('timeout', 2.0)
+        self.pool_size = pool_size or options.get('pool_size', 8)
+        self.save_interval = options.get('save_interval', 60.0) if save_interval is None else save_interval
+        self.flush_interval = flush_interval or options.get('flush_interval', 1.0)
+        self.batch_size = batch_size or options.get('batch_size', 500)
+        self.drivers = dict(drivers or {})
+        for point in self.points:
+            if point['driver'] not in self.drivers:
+                if point['driver'] not in DRIVERS:
+                    raise ValueError(f"未知的电表驱动: {point['driver']}")
+                self.drivers[point['driver']] = DRIVERS[point['driver']]()
+        self.stats = CollectorStats()
+        self.buffer = []
+        self._buffer_full = None
+        self._pools = {}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._last_save = time.monotonic()
+
+    def phase(self, device_id):
+        """设备在周期内的固定相位（秒），由设备ID决定，重启后不变"""
+        return random.Random(device_id).uniform(0, self.jitter * self.interval)
+
+    async def poll(self, point):
+        """轮询一个采集点，成功时把读数放入缓冲区"""
+        pool = self._pools[point['driver']]
+        self.stats.polls += 1
+        connection = None
+        broken = False
+        try:
+            connection = await pool.acquire(self.timeout)
+            values = await asyncio.wait_for(pool.driver.read(connection, point), self.timeout)
+            values = dict(values, device_id=point['device_id'], timestamp=format_epoch(int(time.time())))
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            log.debug("轮询超时", extra={'device_id': point['device_id'], 'driver': point['driver']})
+            broken = True
+            return
+        except (ConnectionError, OSError, ValueError) as e:
+            self.stats.errors += 1
+            log.debug("轮询失败: %s", e, extra={'device_id': point['device_id'], 'driver': point['driver']})
+            broken = True
+            return
+        except Exception as e:
+            # 驱动的其他异常同样只影响这一次轮询，设备的轮询节拍继续
+            self.stats.errors += 1
+            log.warning("轮询出错: %s", e, exc_info=True,
+                        extra={'device_id': point['device_id'], 'driver': point['driver']})
+            broken = True
+            return
+        finally:
+            if connection is not None:
+                await pool.release(connection, broken)
+        self.buffer.append(values)
+        self.stats.succeeded += 1
+        if len(self.buffer) >= self.batch_size and self._buffer_full is not None:
+            self._buffer_full.set()
+
+    async def _device_loop(self, point, started, cycles):
+        """按固定节拍轮询单台设备，迟到超过一个间隔的周期记为错过"""
+        loop = asyncio.get_running_loop()
+        phase = self.phase(point['device_id'])
+        cycle = 0
+        while cycles is None or cycle < cycles:
+            scheduled = started + cycle * self.interval + phase
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif -delay >= self.interval:
+                skipped = int(-delay // self.interval)
+                self.stats.missed += skipped
+                log.warning("轮询落后，跳过%d个周期", skipped, extra={'device_id': point['device_id']})
+                cycle += skipped
+                continue
+            self.stats.lag.update(max(loop.time() - scheduled, 0.0))
+            await self.poll(point)
+            cycle += 1
+
+    async def _flusher(self, stop):
+        """每隔 flush_interval 秒或缓冲区攒满 batch_size 条时写入一次"""
+        while not stop.is_set():
+            waiters = [asyncio.ensure_future(stop.wait()), asyncio.ensure_future(self._buffer_full.wait())]
+            await asyncio.wait(waiters, timeout=self.flush_interval, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in waiters:
+                waiter.cancel()
+            self._buffer_full.clear()
+            await self.flush()
+
+    async def flush(self):
+        """把缓冲区中的读数写入批量入库路径，并按需保存数据文件"""
+        loop = asyncio.get_running_loop()
+        if self.buffer:
+            rows, self.buffer = self.buffer, []
+            written = await loop.run_in_executor(
+                self._executor, lambda: self.ems.record_energy_readings_batch(rows, save=False)[0])
+            self.stats.written += written
+        if time.monotonic() - self._last_save >= self.save_interval:
+            await loop.run_in_executor(self._executor, self.ems.save_data)
+            self._last_save = time.monotonic()
+
+    async def run(self, cycles=None):
+        """运行采集；cycles 为每台设备的轮询次数，None 表示一直运行直到任务被取消"""
+        loop = asyncio.get_running_loop()
+        self._pools = {name: ConnectionPool(driver, self.pool_size) for name, driver in self.drivers.items()}
+        self._last_save = time.monotonic()
+        started = loop.time()
+        stop = asyncio.Event()
+        self._buffer_full = asyncio.Event()
+        flusher = asyncio.ensure_future(self._flusher(stop))
+        try:
+            await asyncio.gather(*(self._device_loop(point, started, cycles) for point in self.points))
+        finally:
+            stop.set()
+            await flusher
+            for pool in self._pools.values():
+                await pool.close()
+            await loop.run_in_executor(self._executor, self.ems.save_data)
+        return self.stats.summary()
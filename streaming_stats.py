@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+智能能耗管理系统 - 流式统计
+每条读数O(1)更新的在线统计量，供实时看板和告警使用
+"""
+
+import calendar
+import math
+from datetime import datetime
+from functools import lru_cache
+
+
+@lru_cache(maxsize=4096)
+def day_epoch(date_str):
+    """日期字符串对应当天零点的秒数（按UTC换算，仅用于相对比较）"""
+    return calendar.timegm(datetime.strptime(date_str, "%Y-%m-%d").timetuple())
+
+
+def timestamp_to_epoch(timestamp):
+    """把 "YYYY-MM-DD HH:MM:SS" 时间戳转换为秒数，避免每条读数都调用strptime"""
+    return (day_epoch(timestamp[:10]) + int(timestamp[11:13]) * 3600
+            + int(timestamp[14:16]) * 60 + int(timestamp[17:19]))
+
+
+class RunningStats:
+    """Welford 在线均值/方差，附带最值和指数移动平均"""
+
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max', 'ewma', 'alpha')
+
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.ewma = None
+
+    def update(self, value):
+        """加入一个样本"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.ewma = value if self.ewma is None else self.ewma + self.alpha * (value - self.ewma)
+
+    @property
+    def variance(self):
+        """样本方差"""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def summary(self):
+        """返回统计摘要"""
+        return {
+            'count': self.count,
+            'mean': round(self.mean, 3),
+            'variance': round(self.variance, 3),
+            'std': round(math.sqrt(self.variance), 3),
+            'min': self.min,
+            'max': self.max,
+            'ewma': round(self.ewma, 3) if self.ewma is not None else None
+        }
+
+    def to_dict(self):
+        """序列化为可写入JSON的字典"""
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2, 'min': self.min,
+                'max': self.max, 'ewma': self.ewma, 'alpha': self.alpha}
+
+    @classmethod
+    def from_dict(cls, data):
+        """从字典恢复"""
+        stats = cls(data.get('alpha', 0.1))
+        stats.count = data['count']
+        stats.mean = data['mean']
+        stats.m2 = data['m2']
+        stats.min = data['min']
+        stats.max = data['max']
+        stats.ewma = data['ewma']
+        return stats
+
+
+class WindowedStats:
+    """环形缓冲区滑动窗口统计
+
+    窗口被切分为固定数量的时间槽，每个槽保存计数、和、平方和及最值。
+    写入时只触碰一个槽，查询时合并窗口内的槽，过期槽在复用时清零。
+    """
+
+    __slots__ = ('slot_seconds', 'slots', 'epochs', 'counts', 'sums', 'sumsqs', 'mins', 'maxs')
+
+    def __init__(self, slot_seconds, slots):
+        self.slot_seconds = slot_seconds
+        self.slots = slots
+        self.epochs = [-1] * slots
+        self.counts = [0] * slots
+        self.sums = [0.0] * slots
+        self.sumsqs = [0.0] * slots
+        self.mins = [0.0] * slots
+        self.maxs = [0.0] * slots
+
+    def update(self, epoch_seconds, value):
+        """把样本写入所属时间槽"""
+        slot_epoch = epoch_seconds // self.slot_seconds
+        index = slot_epoch % self.slots
+        if self.epochs[index] != slot_epoch:
+            if self.epochs[index] > slot_epoch:
+                return  # 比窗口还旧的乱序样本直接丢弃
+            self.epochs[index] = slot_epoch
+            self.counts[index] = 1
+            self.sums[index] = value
+            self.sumsqs[index] = value * value
+            self.mins[index] = value
+            self.maxs[index] = value
+            return
+        self.counts[index] += 1
+        self.sums[index] += value
+        self.sumsqs[index] += value * value
+        if value < self.mins[index]:
+            self.mins[index] = value
+        if value > self.maxs[index]:
+            self.maxs[index] = value
+
+    def summary(self, now_epoch):
+        """合并截至 now_epoch 的窗口内各槽"""
+        oldest = now_epoch // self.slot_seconds - self.slots
+        count = 0
+        total = 0.0
+        total_sq = 0.0
+        low = None
+        high = None
+        for i in range(self.slots):
+            if self.epochs[i] > oldest and self.counts[i]:
+                count += self.counts[i]
+                total += self.sums[i]
+                total_sq += self.sumsqs[i]
+                low = self.mins[i] if low is None else min(low, self.mins[i])
+                high = self.maxs[i] if high is None else max(high, self.maxs[i])
+
+        if count == 0:
+            return {'count': 0, 'mean': None, 'variance': None, 'std': None, 'min': None, 'max': None}
+
+        mean = total / count
+        variance = max((total_sq - count * mean * mean) / (count - 1), 0.0) if count > 1 else 0.0
+        return {
+            'count': count,
+            'mean': round(mean, 3),
+            'variance': round(variance, 3),
+            'std': round(math.sqrt(variance), 3),
+            'min': low,
+            'max': high
+        }
+
+    def to_dict(self):
+        """序列化为可写入JSON的字典（列表为副本，可在锁外编码）"""
+        return {'slot_seconds': self.slot_seconds, 'epochs': list(self.epochs), 'counts': list(self.counts),
+                'sums': list(self.sums), 'sumsqs': list(self.sumsqs), 'mins': list(self.mins),
+                'maxs': list(self.maxs)}
+
+    @classmethod
+    def from_dict(cls, data):
+        """从字典恢复"""
+        window = cls(data['slot_seconds'], len(data['epochs']))
+        window.epochs = data['epochs']
+        window.counts = data['counts']
+        window.sums = data['sums']
+        window.sumsqs = data['sumsqs']
+        window.mins = data['mins']
+        window.maxs = data['maxs']
+        return window
+
+
+class DeviceStatistics:
+    """单台设备的功率流式统计：全量累计 + 最近1小时 + 最近1天"""
+
+    __slots__ = ('total', 'hour', 'day')
+
+    def __init__(self, alpha=0.1):
+        self.total = RunningStats(alpha)
+        self.hour = WindowedStats(60, 60)      # 60个1分钟槽
+        self.day = WindowedStats(3600, 24)     # 24个1小时槽
+
+    def update(self, epoch_seconds, power):
+        """加入一条功率读数"""
+        self.total.update(power)
+        self.hour.update(epoch_seconds, power)
+        self.day.update(epoch_seconds, power)
+
+    def to_dict(self):
+        """序列化为可写入JSON的字典"""
+        return {'total': self.total.to_dict(), 'hour': self.hour.to_dict(), 'day': self.day.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        """从字典恢复"""
+        stats = cls.__new__(cls)
+        stats.total = RunningStats.from_dict(data['total'])
+        stats.hour = WindowedStats.from_dict(data['hour'])
+        stats.day = WindowedStats.from_dict(data['day'])
+        return stats
+
+
+class TDigest:
+    """可合并的 t-digest 分位数草图
+
+    以带权质心近似数据分布，两端质心更细、中间更粗，
+    P95/P99 等尾部分位数误差很小。不同时间段或不同设备的草图可直接合并。
+    """
+
+    __slots__ = ('compression', 'means', 'weights', 'buffer', 'total_weight', 'min', 'max')
+
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.means = []
+        self.weights = []
+        self.buffer = []
+        self.total_weight = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value, weight=1.0):
+        """加入一个样本"""
+        self.buffer.append((value, weight))
+        self.total_weight += weight
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if len(self.buffer) >= self.compression * 5:
+            self.compress()
+
+    def merge(self, other):
+        """并入另一个草图"""
+        if other.total_weight == 0:
+            return self
+        other.compress()
+        self.buffer.extend(zip(other.means, other.weights))
+        self.total_weight += other.total_weight
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.compress()
+        return self
+
+    def _k(self, q):
+        """k1 尺度函数"""
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def compress(self):
+        """把缓冲区与现有质心按尺度函数重新归并"""
+        if not self.buffer:
+            return
+        points = sorted(list(zip(self.means, self.weights)) + self.buffer)
+        self.buffer = []
+        total = self.total_weight
+
+        means = []
+        weights = []
+        current_mean, current_weight = points[0]
+        cumulative = 0.0
+        k_lower = self._k(0.0)
+        for mean, weight in points[1:]:
+            q = (cumulative + current_weight + weight) / total
+            if self._k(min(q, 1.0)) - k_lower <= 1.0:
+                current_weight += weight
+                current_mean += (mean - current_mean) * weight / current_weight
+            else:
+                means.append(current_mean)
+                weights.append(current_weight)
+                cumulative += current_weight
+                k_lower = self._k(min(cumulative / total, 1.0))
+                current_mean, current_weight = mean, weight
+        means.append(current_mean)
+        weights.append(current_weight)
+        self.means = means
+        self.weights = weights
+
+    def quantile(self, q):
+        """估计分位数 q (0~1)"""
+        self.compress()
+        if not self.means:
+            return None
+        if len(self.means) == 1 or q <= 0:
+            return self.min if q <= 0 else self.means[0]
+        if q >= 1:
+            return self.max
+
+        target = q * self.total_weight
+        cumulative = 0.0
+        for i, weight in enumerate(self.weights):
+            center = cumulative + weight / 2
+            if target < center:
+                if i == 0:
+                    # 第一个质心左侧在最小值与质心之间插值
+                    return self.min + (self.means[0] - self.min) * target / center
+                prev_center = cumulative - self.weights[i - 1] / 2
+                ratio = (target - prev_center) / (center - prev_center)
+                return self.means[i - 1] + (self.means[i] - self.means[i - 1]) * ratio
+            cumulative += weight
+        last_center = self.total_weight - self.weights[-1] / 2
+        ratio = (target - last_center) / (self.total_weight - last_center)
+        return self.means[-1] + (self.max - self.means[-1]) * ratio
+
+    def to_dict(self):
+        """序列化为可写入JSON的字典"""
+        self.compress()
+        return {'compression': self.compression, 'means': self.means, 'weights': self.weights,
+                'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        """从字典恢复"""
+        digest = cls(data.get('compression', 100))
+        digest.means = list(data['means'])
+        digest.weights = list(data['weights'])
+        digest.total_weight = float(sum(digest.weights))
+        digest.min = data['min']
+        digest.max = data['max']
+        return digest